@@ -1,7 +1,23 @@
 """kitsu_lib package."""
 
-from icecream import ic
+__version__ = '0.0.1'
 
-ic.configureOutput(includeContext=True)
 
-__version__ = '0.0.1'
+def __getattr__(name):
+    """Import and configure `icecream.ic` on first access of `kitsu_lib.ic` rather than when the package is imported.
+
+    Args:
+        name: attribute name
+
+    Returns:
+        object: `ic` debugging function
+
+    Raises:
+        AttributeError: for any other attribute
+
+    """
+    if name == 'ic':
+        from icecream import ic
+        ic.configureOutput(includeContext=True)
+        return ic
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
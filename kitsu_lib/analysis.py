@@ -1,14 +1,15 @@
 """Helpers for Kitsu data analysis."""
 
 import json
+import re
+from operator import itemgetter
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import humps
-from furl import furl
-from icecream import ic
 
-from .cache_helpers import KITSU_DATA
-from .kitsu_helpers import LOGGER, rm_brs
+from .cache_helpers import KITSU_DATA, apply_pragmas, iter_ndjson, quote_name
+from .kitsu_helpers import LOGGER, chunked, rm_brs
 
 
 def filter_stream_urls(streams):
@@ -30,6 +31,66 @@ def filter_stream_urls(streams):
     return stream_urls
 
 
+class _LazyFormat:
+    """Defer `ic.format()` until the log record is formatted, which is skipped if the level is disabled."""
+
+    def __init__(self, obj):
+        """Store the object to format.
+
+        Args:
+            obj: object passed to `ic.format()`
+
+        """
+        self.obj = obj
+
+    def __str__(self):
+        """Return the formatted object.
+
+        Returns:
+            str: output of `ic.format()`
+
+        """
+        from icecream import ic
+        return ic.format(self.obj)
+
+
+STREAM_HOSTS = {
+    'a.co': 'amazon',  # Shortened Amazon link, example: http://a.co/d/9hJEmKC
+    'amazon.com': 'amazon',
+    'crunchyroll.com': 'crunchyroll',
+    'funimation.com': 'funimation',
+    'hulu.com': 'hulu',
+    'netflix.com': 'netflix',
+    'tubitv.com': 'tubitv',
+}
+"""Lookup table of the registered domain for known stream providers to the summary key."""
+
+_URL_HOST = re.compile(r'^https?://(?:[^@/?#]*@)?([^:/?#]+)', re.IGNORECASE)
+"""Match the host name of a HTTP(S) URL without parsing the other URL components."""
+
+
+def classify_stream_host(stream_url):
+    """Return the summary key for the host of a stream URL.
+
+    Known providers are matched against `STREAM_HOSTS`. Other URLs fall back to `urllib.parse` and use the second
+    level domain name (i.e. `www.hidive.com` is `hidive`)
+
+    Args:
+        stream_url: full stream URL
+
+    Returns:
+        str: host key, such as `crunchyroll`
+
+    """
+    match = _URL_HOST.match(stream_url)
+    if match:
+        key = STREAM_HOSTS.get('.'.join(match.group(1).lower().rsplit('.', 2)[-2:]))
+        if key:
+            return key
+    labels = (urlsplit(stream_url).hostname or '').split('.')
+    return labels[-2] if len(labels) > 1 else labels[0]
+
+
 def summarize_streams(streams):
     """Create summary dictionary of available stream URLs.
 
@@ -41,19 +102,16 @@ def summarize_streams(streams):
 
     """
     summary = {}
-    ic_streams = ic.format(streams)
     for stream_url in filter_stream_urls(streams):
         # Create a key for each hostname
-        if 'a.co/' in stream_url:
-            key = 'amazon'  # Handle case of the shortened Amazon link, example: http://a.co/d/9hJEmKC
-        else:
-            key = furl(stream_url).asdict()['host'].split('.')[-2]
+        key = classify_stream_host(stream_url)
         for style in ['sub', 'dub']:
             if style in stream_url.lower():
                 key += f'_{style}'
         # Add unique hostname key to the summary
         if key in summary:
-            LOGGER.warning(f'Too many streams. Overwriting {key}. Found: {ic_streams}')
+            # Only format the full streams response when the warning is logged
+            LOGGER.warning('Too many streams. Overwriting %s. Found: %s', key, _LazyFormat(streams))
         summary[key] = stream_url
     return summary
 
@@ -71,6 +129,19 @@ def parse_categories(anime):
     return [attr['attributes']['slug'] for attr in anime['included']]
 
 
+ENTRY_KEYS = ('createdAt', 'updatedAt', 'progress', 'notes', 'private', 'progressedAt', 'startedAt', 'finishedAt',
+              'ratingTwenty', 'subtype')
+"""Library entry attributes kept in the summary dictionary and the `library_entry` table."""
+
+ANIME_KEYS = ('canonicalTitle', 'slug', 'averageRating', 'userCount', 'favoritesCount', 'startDate', 'endDate',
+              'nextRelease', 'popularityRank', 'ratingRank', 'ageRating', 'status', 'episodeCount', 'episodeLength',
+              'totalLength', 'showType')
+"""Anime attributes kept in the summary dictionary and the `anime` table."""
+
+if set(ENTRY_KEYS) & set(ANIME_KEYS):
+    raise RuntimeError(f'FOUND DUPLICATE KEYS: {set(ENTRY_KEYS) & set(ANIME_KEYS)}')
+
+
 def merge_anime_info(anime_entry_data, anime, streams):
     """WIP: combines a library entry and corresponding anime entry into single, flat dictionary.
 
@@ -85,21 +156,10 @@ def merge_anime_info(anime_entry_data, anime, streams):
     Returns:
         dict: single summary dictionary
 
-    Raises:
-        RuntimeError: developer warning that there are duplicate keys in the hardcoded lists
-
     """
     entry_attr = anime_entry_data['attributes']
     anime_attr = anime['data']['attributes']
 
-    entry_keys = ['createdAt', 'updatedAt', 'progress', 'notes', 'private', 'progressedAt', 'startedAt',
-                  'finishedAt', 'ratingTwenty', 'subtype']
-    anime_keys = ['canonicalTitle', 'slug', 'averageRating', 'userCount', 'favoritesCount', 'startDate', 'endDate',
-                  'nextRelease', 'popularityRank', 'ratingRank', 'ageRating', 'status', 'episodeCount',
-                  'episodeLength', 'totalLength', 'showType']
-    if any(key in entry_keys for key in anime_keys):
-        raise RuntimeError('FOUND DUPLICATE KEYS')
-
     # Combine and collapse fields of interest
     poster_image = anime_attr['posterImage']
     data = {
@@ -110,29 +170,294 @@ def merge_anime_info(anime_entry_data, anime, streams):
         'watch_status': entry_attr['status'],
         **summarize_streams(streams),
     }
-    for attr, keys in [(entry_attr, entry_keys), (anime_attr, anime_keys)]:
+    for attr, keys in [(entry_attr, ENTRY_KEYS), (anime_attr, ANIME_KEYS)]:
         for key in keys:
             data[key] = attr[key] if key in attr else None
 
     return data
 
 
-def create_kitsu_database(summary_file_path):
+def merge_library_frame(batch):
+    """Merge many library entries column-wise into a DataFrame with the same values as `merge_anime_info()`.
+
+    The `COLUMN_TYPES` columns use nullable integer and boolean dtypes, `averageRating` is a float, and the
+    `DATETIME_KEYS` are parsed as UTC timestamps. All other columns keep the same values as the summary dictionaries.
+    The categories are stored as sparse boolean indicator columns (camelized, like the `kitsu` view) that are listed
+    in `frame.attrs['categories']`. To merge one or more batched library pages:
+
+    ```py
+    frame = merge_library_frame([args for page in pages for args in split_library_page(page)])
+    ```
+
+    Args:
+        batch: iterable of `(anime_entry_data, anime, streams)` tuples with the arguments for `merge_anime_info()`
+
+    Returns:
+        pd.DataFrame: one row for each library entry
+
+    """
+    # Imported here so that the scraper does not pay for the numpy and pandas start up time
+    import numpy as np
+    import pandas as pd
+
+    batch = [*batch]
+    entries, animes, all_streams = zip(*batch) if batch else ((), (), ())
+    entry_attrs = [entry['attributes'] for entry in entries]
+    anime_attrs = [anime['data']['attributes'] for anime in animes]
+    summaries = [summarize_streams(streams) for streams in all_streams]
+
+    columns = {
+        'id': [entry['id'] for entry in entries],
+        'synopsis': [rm_brs(attr['synopsis']) for attr in anime_attrs],
+        'posterImage': [attr['posterImage']['original'] if attr['posterImage'] else None for attr in anime_attrs],
+        'watch_status': [attr['status'] for attr in entry_attrs],
+    }
+    for host in dict.fromkeys(host for summary in summaries for host in summary):
+        columns[host] = [summary.get(host) for summary in summaries]
+    for attrs, keys in [(entry_attrs, ENTRY_KEYS), (anime_attrs, ANIME_KEYS)]:
+        for key in keys:
+            columns[key] = [attr.get(key) for attr in attrs]
+    frame = pd.DataFrame(columns, dtype=object)
+    frame = frame.astype({key: FRAME_DTYPES[sql_type] for key, sql_type in COLUMN_TYPES.items()})
+    frame['averageRating'] = pd.to_numeric(frame['averageRating']).astype(float)
+    for key in DATETIME_KEYS:
+        frame[key] = pd.to_datetime(frame[key], utc=True)
+
+    # Build each category indicator from the row positions rather than one dictionary key per row
+    category_rows = {}
+    for row, anime in enumerate(animes):
+        for category in parse_categories(anime):
+            category_rows.setdefault(humps.camelize(category), []).append(row)
+    indicators = {}
+    for category, rows in category_rows.items():
+        values = np.zeros(len(frame), dtype=bool)
+        values[rows] = True
+        indicators[category] = pd.arrays.SparseArray(values, fill_value=False)
+    frame = pd.concat([frame, pd.DataFrame(indicators, index=frame.index)], axis=1)
+    frame.attrs['categories'] = [*category_rows]
+    return frame
+
+
+def iter_summary(summary_file_path):
+    """Yield each entry from a summary file of `merge_anime_info()` dictionaries.
+
+    Args:
+        summary_file_path: path to the NDJSON summary file (one entry per line) or JSON file with format `{data: [...]}`
+
+    Yields:
+        dict: summary dictionary. NDJSON files are read one line at a time
+
+    """
+    if Path(summary_file_path).suffix == '.ndjson':
+        yield from iter_ndjson(summary_file_path)
+    else:
+        yield from json.loads(Path(summary_file_path).read_text())['data']
+
+
+COLUMN_TYPES = {
+    'progress': 'INTEGER', 'private': 'BOOLEAN', 'ratingTwenty': 'INTEGER', 'userCount': 'INTEGER',
+    'favoritesCount': 'INTEGER', 'popularityRank': 'INTEGER', 'ratingRank': 'INTEGER', 'episodeCount': 'INTEGER',
+    'episodeLength': 'INTEGER', 'totalLength': 'INTEGER',
+}
+"""SQLite column types for the summary keys. All other columns are TEXT."""
+
+FRAME_DTYPES = {'INTEGER': 'Int64', 'BOOLEAN': 'boolean'}
+"""Nullable pandas dtypes for the `COLUMN_TYPES` used by `merge_library_frame()`."""
+
+DATETIME_KEYS = ('createdAt', 'updatedAt', 'progressedAt', 'startedAt', 'finishedAt', 'startDate', 'endDate',
+                 'nextRelease')
+"""Summary keys with ISO 8601 dates or timestamps."""
+
+KITSU_SCHEMA = {
+    'library_entry': (('id', 'slug', 'watch_status', *ENTRY_KEYS), 'id'),
+    'anime': ((*ANIME_KEYS, 'synopsis', 'posterImage'), 'slug'),
+    'anime_category': (('slug', 'category'), 'slug, category'),
+    'anime_stream': (('slug', 'host', 'url'), 'slug, host'),
+}
+"""Normalized Kitsu tables with format `{table_name: (columns, primary_key)}`. Tables are joined on `slug`."""
+
+KITSU_INDEXES = {
+    'ix_library_entry_slug': 'library_entry (slug)',
+    'ix_library_entry_watch_status': 'library_entry (watch_status)',
+    'ix_anime_status': 'anime (status)',
+    'ix_anime_category_category': 'anime_category (category, slug)',
+    'ix_anime_stream_host': 'anime_stream (host)',
+}
+"""Secondary indexes for filtering the normalized tables by slug, status, category, and stream host."""
+
+
+def split_summary(entry):
+    """Split a summary dictionary into the rows for each of the normalized tables.
+
+    Any key that is not a library entry or anime attribute is a stream host from `summarize_streams()`
+
+    Args:
+        entry: summary dictionary from `merge_anime_info()`
+
+    Returns:
+        dict: with keys of each table name in `KITSU_SCHEMA` and values of the list of rows
+
+    """
+    slug = entry['slug']
+    entry_columns, anime_columns = KITSU_SCHEMA['library_entry'][0], KITSU_SCHEMA['anime'][0]
+    known_keys = {*entry_columns, *anime_columns, 'categories'}
+    return {
+        'library_entry': [{key: entry.get(key) for key in entry_columns}],
+        'anime': [{key: entry.get(key) for key in anime_columns}],
+        'anime_category': [{'slug': slug, 'category': category} for category in entry['categories']],
+        'anime_stream': [{'slug': slug, 'host': key, 'url': value} for key, value in entry.items()
+                         if key not in known_keys],
+    }
+
+
+def create_kitsu_schema(db, indexes=True):
+    """Create the normalized Kitsu tables and indexes if they do not already exist.
+
+    Args:
+        db: dataset database or transaction
+        indexes: if False, only create the tables. Bulk loads are faster when the indexes are created afterward
+
+    """
+    if 'kitsu' in db.tables:
+        db['kitsu'].drop()  # Replace the wide table from earlier versions with the `kitsu` view
+    for table, (columns, primary_key) in KITSU_SCHEMA.items():
+        column_defs = ', '.join(f'{quote_name(col)} {COLUMN_TYPES.get(col, "TEXT")}' for col in columns)
+        db.query(f'CREATE TABLE IF NOT EXISTS {table} ({column_defs}, PRIMARY KEY ({primary_key}))')
+    if indexes:
+        for index, target in KITSU_INDEXES.items():
+            db.query(f'CREATE INDEX IF NOT EXISTS {index} ON {target}')
+
+
+def create_kitsu_view(db):
+    """Create the `kitsu` view that joins the normalized tables into the wide format of the summary dictionaries.
+
+    Each stream host and each category (camelized and set to 1) is a separate column, so the view is regenerated
+    whenever new categories or hosts are added
+
+    Args:
+        db: dataset database or transaction
+
+    """
+    def literal(value):
+        return "'{}'".format(value.replace("'", "''"))
+
+    columns = [f'e.{quote_name(col)}' for col in KITSU_SCHEMA['library_entry'][0]]
+    columns.extend(f'a.{quote_name(col)}' for col in KITSU_SCHEMA['anime'][0] if col != 'slug')
+    for row in db.query('SELECT DISTINCT host FROM anime_stream ORDER BY host'):
+        columns.append(f'(SELECT s.url FROM anime_stream AS s WHERE s.slug = e.slug AND s.host = '
+                       f'{literal(row["host"])}) AS {quote_name(row["host"])}')
+    for row in db.query('SELECT DISTINCT category FROM anime_category ORDER BY category'):
+        columns.append(f'(SELECT 1 FROM anime_category AS c WHERE c.slug = e.slug AND c.category = '
+                       f'{literal(row["category"])}) AS {quote_name(humps.camelize(row["category"]))}')
+
+    db.query('DROP VIEW IF EXISTS kitsu')
+    db.query(f'CREATE VIEW kitsu AS SELECT {", ".join(columns)} FROM library_entry AS e '
+             'JOIN anime AS a ON a.slug = e.slug')
+    db._tables.pop('kitsu', None)  # Columns of a previously loaded view are reflected only once
+
+
+def _insert_statement(table):
+    """Return the INSERT statement with a positional parameter for each column of a table in `KITSU_SCHEMA`.
+
+    Args:
+        table: table name
+
+    Returns:
+        str: SQL statement
+
+    """
+    columns = KITSU_SCHEMA[table][0]
+    names = ', '.join(quote_name(col) for col in columns)
+    return f'INSERT INTO {table} ({names}) VALUES ({", ".join("?" * len(columns))})'
+
+
+def insert_summaries(db, entries):
+    """Split the summary dictionaries and insert the rows into each of the normalized tables.
+
+    The tables have a fixed set of columns, so the rows are inserted as tuples with a single `executemany` per table
+    on the DBAPI cursor of the current connection (and transaction) rather than with `dataset`, which checks the
+    columns of every row, or SQLAlchemy, which builds the parameters for each row
+
+    Args:
+        db: dataset database or transaction
+        entries: iterable of summary dictionaries from `merge_anime_info()`
+
+    """
+    rows = {table: [] for table in KITSU_SCHEMA}
+    for entry in entries:
+        for table, table_rows in split_summary(entry).items():
+            rows[table].extend(table_rows)
+    cursor = db.executable.connection.cursor()
+    try:
+        for table, table_rows in rows.items():
+            cursor.executemany(_insert_statement(table), map(itemgetter(*KITSU_SCHEMA[table][0]), table_rows))
+    finally:
+        cursor.close()
+
+
+def create_kitsu_database(summary_file_path, chunk_size=500):
     """Create the Kitsu database with data from cached `merge_anime_info()` file.
 
+    The data is stored in the normalized tables from `KITSU_SCHEMA` and the `kitsu` view from `create_kitsu_view()`.
+    All entries are loaded in a single transaction with the `BULK_PRAGMAS` and the indexes are created last
+
+    Args:
+        summary_file_path: path to the NDJSON or JSON summary file. See `iter_summary()`
+        chunk_size: number of entries to insert at a time. Default is 500
+
+    """
+    db = KITSU_DATA.db
+    apply_pragmas(db)
+    with db as tx:
+        tx.query('DROP VIEW IF EXISTS kitsu')
+        for table in KITSU_SCHEMA:
+            if table in tx.tables:
+                tx[table].drop()  # Clear database
+        create_kitsu_schema(tx, indexes=False)
+
+        # Insert entries from the summary file into the tables in fixed-size chunks to limit memory use
+        for chunk in chunked(iter_summary(summary_file_path), chunk_size):
+            insert_summaries(tx, chunk)
+        create_kitsu_schema(tx)
+        create_kitsu_view(tx)
+
+
+SYNC_KEYS = ('updatedAt', 'progressedAt')
+"""Library entry attributes that are compared to identify entries that changed since the last sync."""
+
+
+def load_sync_state():
+    """Return the sync keys of each library entry in the Kitsu database.
+
+    Returns:
+        dict: with keys of the library entry ID and values of a tuple of the `SYNC_KEYS`
+
+    """
+    if 'library_entry' not in KITSU_DATA.db.tables:
+        return {}
+    rows = KITSU_DATA.db.query(f'SELECT id, {", ".join(SYNC_KEYS)} FROM library_entry')
+    return {row['id']: tuple(row[key] for key in SYNC_KEYS) for row in rows}
+
+
+def update_kitsu_database(entries, removed_ids=(), chunk_size=500):
+    """Replace the changed entries and delete the removed entries from the Kitsu database in a single transaction.
+
     Args:
-        summary_file_path: path to the JSON summary file
+        entries: list of summary dictionaries from `merge_anime_info()` that are new or have changed
+        removed_ids: library entry IDs to delete. Default is none
+        chunk_size: maximum number of IDs in each delete statement. Default is 500
 
     """
-    table = KITSU_DATA.db.create_table('kitsu', primary_id='slug', primary_type=KITSU_DATA.db.types.text)
-    table.drop()  # Clear database
-
-    # Insert each entry from JSON file into the table
-    all_data = json.loads(Path(summary_file_path).read_text())
-    entries = []
-    for entry in all_data['data']:
-        # The list of categories is an unsupported type in SQL. Unwrap category and add each as a new key
-        for category in entry.pop('categories'):
-            entry[humps.camelize(category)] = True
-        entries.append(entry)
-    table.insert_many(entries)  # much faster than insert()
+    create_kitsu_schema(KITSU_DATA.db)
+    stale_ids = [entry['id'] for entry in entries] + [*removed_ids]
+    with KITSU_DATA.db as tx:
+        # Delete and re-insert changed entries so that any removed categories and streams are cleared
+        stale_slugs = [entry['slug'] for entry in entries]
+        for chunk in chunked(stale_ids, chunk_size):
+            stale_slugs.extend(row['slug'] for row in tx['library_entry'].find(id=chunk))
+            tx['library_entry'].delete(id=chunk)
+        for chunk in chunked(stale_slugs, chunk_size):
+            for table in ('anime', 'anime_category', 'anime_stream'):
+                tx[table].delete(slug=chunk)
+        insert_summaries(tx, entries)
+        create_kitsu_view(tx)
@@ -1,26 +1,214 @@
 """Helpers for Kitsu API requests."""
 
-import json
+import threading
 import time
+from concurrent.futures import Future
 from json.decoder import JSONDecodeError
-from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
 
-from .cache_helpers import FILE_DATA, match_url_in_cache, store_response
+from .cache_helpers import (CACHE_MANAGER, find_cached_response, forget_response, is_stale, load_response,
+                            normalize_url, refresh_response, store_response, update_response)
 from .kitsu_helpers import LOGGER
 
-
-def get_data(url, kwargs=None, debug=False):
-    """Return response from generic get request for data object.
+KITSU_API_URL = 'https://kitsu.io/api/edge'
+"""Base URL for the Kitsu API. Can be overridden to point at a local server for testing."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter shared by all workers making requests."""
+
+    rate = None
+    """Number of tokens added per second. Initialize in `__init__()`."""
+
+    capacity = None
+    """Maximum number of tokens that can accumulate (i.e. the allowed burst). Initialize in `__init__()`."""
+
+    def __init__(self, rate, capacity=1):
+        """Initialize a full bucket.
+
+        Args:
+            rate: number of requests allowed per second
+            capacity: maximum burst of requests. Default is 1
+
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available then consume it."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SessionConnect:
+    """Manage a shared keep-alive HTTP session so that connections are reused between requests."""
+
+    pool_size = None
+    """Maximum number of connections kept open per host. Should be at least the number of scraper workers."""
+
+    retries = None
+    """Number of retries for connection errors and 429/5xx responses. The `Retry-After` header is respected."""
+
+    backoff_factor = None
+    """Exponential backoff factor (seconds) between retries when no `Retry-After` header is returned."""
+
+    _session = None
+
+    def __init__(self, pool_size=10, retries=3, backoff_factor=0.5):
+        """Store the session settings. The session is created on first use.
+
+        Args:
+            pool_size: maximum number of connections kept open per host. Default is 10
+            retries: number of retries. Default is 3
+            backoff_factor: exponential backoff factor in seconds. Default is 0.5
+
+        """
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        """Return the shared session. Will create a new session if one does not exist already.
+
+        Returns:
+            requests.Session: session with connection pooling, retries, and compressed transfer
+
+        """
+        with self._lock:
+            if self._session is None:
+                LOGGER.debug(f'Initializing HTTP session with pool_size={self.pool_size}')
+                retry = Retry(total=self.retries, backoff_factor=self.backoff_factor,
+                              status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True)
+                adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # Request gzip/deflate (and brotli if a decoder is installed)
+                session.headers.update(make_headers(accept_encoding=True))
+                session.headers['Accept'] = 'application/vnd.api+json'
+                self._session = session
+            return self._session
+
+    def stats(self):
+        """Count the connections opened and the requests made through the current session.
+
+        Returns:
+            dict: with keys `connections` and `requests`
+
+        """
+        counts = {'connections': 0, 'requests': 0}
+        if self._session is not None:
+            for adapter in {*self._session.adapters.values()}:
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    counts['connections'] += pools[key].num_connections
+                    counts['requests'] += pools[key].num_requests
+        return counts
+
+    def close(self):
+        """Close the current session and all pooled connections. A new session is created on next use."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+class InFlightRequests:
+    """Share a single call between the threads that request the same key at the same time."""
+
+    def __init__(self):
+        """Initialize an empty map of the calls in progress."""
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, func):
+        """Call the function unless a call for the same key is already in progress, then wait for that result.
+
+        Args:
+            key: hashable key, such as the normalized URL
+            func: function without arguments that returns the result
+
+        Returns:
+            object: result of the first call for the key. Exceptions are raised in every waiting thread
+
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not is_owner:
+            return future.result()
+
+        try:
+            result = func()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+IN_FLIGHT = InFlightRequests()
+"""Global map of the requests in progress so that concurrent workers share one fetch of the same resource."""
+
+KITSU_SESSION = SessionConnect()
+"""Global HTTP session shared by all requests to the Kitsu API."""
+
+RATE_LIMITER = TokenBucket(rate=10, capacity=5)
+"""Global rate limiter for requests to the Kitsu API. Replace to change the allowed request rate."""
+
+BATCH_INCLUDE = 'anime,anime.categories,anime.streamingLinks'
+"""Related resources to include with each page of library entries when using `get_library_batch()`."""
+
+BATCH_FIELDS = {
+    'libraryEntries': ['createdAt', 'updatedAt', 'status', 'progress', 'notes', 'private', 'progressedAt',
+                       'startedAt', 'finishedAt', 'ratingTwenty', 'anime'],
+    'anime': ['canonicalTitle', 'slug', 'synopsis', 'posterImage', 'averageRating', 'userCount', 'favoritesCount',
+              'startDate', 'endDate', 'nextRelease', 'popularityRank', 'ratingRank', 'ageRating', 'status',
+              'episodeCount', 'episodeLength', 'totalLength', 'showType', 'categories', 'streamingLinks'],
+    'categories': ['slug'],
+    'streamingLinks': ['url'],
+}
+"""Sparse fieldsets for `get_library_batch()` limited to the keys read by `merge_anime_info()`."""
+
+
+def conditional_get(url, validators=None, kwargs=None, debug=False):
+    """Make a get request that can be revalidated with the `ETag` and `Last-Modified` headers of a cached response.
 
     Args:
         url: URL for request
-        kwargs: Additional arguments to pass to `requests.get()`. Default is None
+        validators: optional dictionary with `etag` and `last_modified` from an earlier response. Default is None
+        kwargs: Additional query arguments to pass to `Session.get()`. Default is None
         debug: if True, will print full response to log file
 
     Returns:
-        dict: request response
+        tuple: `(resp, validators)` where resp is None if the server responded with 304 Not Modified and validators
+            is a dictionary with the `etag` and `last_modified` headers of the new response
 
     Raises:
         JSONDecodeError: if response cannot be decoded to JSON
@@ -29,47 +217,107 @@ def get_data(url, kwargs=None, debug=False):
     LOGGER.debug(f'get_data for: `{url}`')
     if kwargs is None:
         kwargs = {}
-    raw = requests.get(url, kwargs)
+    headers = {}
+    if validators:
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+    RATE_LIMITER.acquire()
+    raw = KITSU_SESSION.session.get(url, params=kwargs, headers=headers)
+    new_validators = {'etag': raw.headers.get('ETag'), 'last_modified': raw.headers.get('Last-Modified')}
+    if raw.status_code == requests.codes.not_modified:
+        LOGGER.debug(f'Not modified: `{url}`')
+        return None, new_validators
+
     resp = None
     try:
         resp = raw.json()
-        time.sleep(0.1)
     except JSONDecodeError as error:
         LOGGER.debug(f"{'=' * 80}\nFailed to parse response from: {url}\n{raw.text}\n\nerror:{error}")
         raise
 
     if debug:
         LOGGER.debug(resp)
-    return resp
+    return resp, new_validators
+
+
+def get_data(url, kwargs=None, debug=False):
+    """Return response from generic get request for data object.
+
+    Args:
+        url: URL for request
+        kwargs: Additional query arguments to pass to `Session.get()`. Default is None
+        debug: if True, will print full response to log file
+
+    Returns:
+        dict: request response
+
+    """
+    return conditional_get(url, kwargs=kwargs, debug=debug)[0]
 
 
 def selective_request(prefix, url, **get_kwargs):
-    """Store the response object as a JSON file and track in a SQLite database.
+    """Return the cached response or make a new request and store the response in the cache.
+
+    The URL is normalized with `normalize_url()` and concurrent calls for the same URL share a single request
 
     Args:
         prefix: string used to create more recognizable filenames
         url: full URL to use as a reference if already downloaded
-        get_kwargs: additional keyword arguments to pass to `get_data()`
+        get_kwargs: additional keyword arguments to pass to `conditional_get()`
 
     Returns:
         dict: Kitsu API response
 
-    Raises:
-        RuntimeError: if duplicates found in database
+    """
+    url = normalize_url(url)
+    return IN_FLIGHT.run(url, lambda: _cached_request(prefix, url, get_kwargs))
+
+
+def _cached_request(prefix, url, get_kwargs):
+    """Return the cached response or make a new request and store the response in the cache.
+
+    Cached responses older than the time-to-live in `CACHE_TTL` are revalidated with the server. Each hit and miss is
+    recorded by `CACHE_MANAGER`, which may evict the least used responses
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: normalized URL
+        get_kwargs: dictionary of keyword arguments to pass to `conditional_get()`
+
+    Returns:
+        dict: Kitsu API response
 
     """
-    matches = match_url_in_cache(url)
+    row = find_cached_response(url)
 
     obj = None
-    if len(matches) == 0:
+    if row is None:
         LOGGER.debug(f'Making new get request for {url}')
-        obj = get_data(url, **get_kwargs)
-        store_response(prefix, url, obj)
-    elif len(matches) == 1:
-        LOGGER.debug(f"Loading response from {matches[0]['filename']} for {url}")
-        obj = json.loads(Path(matches[0]['filename']).read_text())
+        CACHE_MANAGER.record_miss()
+        obj, validators = conditional_get(url, **get_kwargs)
+        store_response(prefix, url, obj, validators)
+    elif is_stale(row):
+        LOGGER.debug(f'Revalidating stale response from {row["filename"]} for {url}')
+        obj, validators = conditional_get(url, validators=row, **get_kwargs)
+        if obj is None:
+            refresh_response(url, validators)
+            obj = load_response(row['filename'])
+            CACHE_MANAGER.record_hit(url)
+        else:
+            CACHE_MANAGER.record_miss()
+            update_response(prefix, url, obj, validators)
     else:
-        raise RuntimeError(f'Too many matches for url={url} in {FILE_DATA.database_path}. Matches: {matches}')
+        LOGGER.debug(f'Loading response from {row["filename"]} for {url}')
+        try:
+            obj = load_response(row['filename'])
+        except FileNotFoundError:
+            # The file was deleted manually and the cache reconciliation running in the background hasn't removed it
+            LOGGER.warning(f'Cached response is missing: {row["filename"]}')
+            forget_response(url)
+            return _cached_request(prefix, url, get_kwargs)
+        CACHE_MANAGER.record_hit(url)
 
     return obj  # noqa: R504
 
@@ -86,7 +334,7 @@ def get_kitsu(endpoint, prefix='kitsu', **kwargs):
         dict: Kitsu API response
 
     """
-    return selective_request(prefix, f'https://kitsu.io/api/edge/{endpoint}', **kwargs)
+    return selective_request(prefix, f'{KITSU_API_URL}/{endpoint}', **kwargs)
 
 
 def get_user(username):
@@ -137,17 +385,64 @@ def get_library(user_id, is_anime=True):
 
     """
     source_type = 'anime' if is_anime else 'manga'
-    url = f'users/{user_id}/library-entries?filter[kind]={source_type}'
+    # Include only the slug of each title so that the relationship has the ID of the title for `entry_anime_link()`
+    url = f'users/{user_id}/library-entries?filter[kind]={source_type}&include={source_type}&fields[{source_type}]=slug'
     return get_kitsu(url, prefix='library')
 
 
+def resource_key(relationship):
+    """Return the canonical key of the resource in a to-one relationship.
+
+    Args:
+        relationship: relationship object, such as `lib_entry['relationships']['anime']`
+
+    Returns:
+        tuple: `(type, id)` or None if the relationship only has links (the resource was not included)
+
+    """
+    linkage = relationship.get('data')
+    return (linkage['type'], linkage['id']) if isinstance(linkage, dict) else None
+
+
+def resource_url(resource_type, resource_id):
+    """Return the canonical URL of a resource.
+
+    Args:
+        resource_type: JSON:API type, such as `anime`
+        resource_id: Kitsu ID
+
+    Returns:
+        str: full URL
+
+    """
+    return f'{KITSU_API_URL}/{resource_type}/{resource_id}'
+
+
+def entry_anime_link(anime_entry):
+    """Return the URL of the anime for a library entry.
+
+    The `related` link is specific to each library entry (`library-entries/<entry ID>/anime`), so the canonical
+    `anime/<anime ID>` URL is used when the ID is available so that every user with the same anime shares one response
+
+    Args:
+        anime_entry: entry from within library response
+
+    Returns:
+        str: URL to pass to `get_anime()`
+
+    """
+    relationship = anime_entry['relationships']['anime']
+    key = resource_key(relationship)
+    return relationship['links']['related'] if key is None else resource_url(*key)
+
+
 def get_anime(anime_link):
     """Get anime response from Kitsu API.
 
-    `anime_link = lib_entry['data'][0]['relationships']['anime']['links']['related']`
+    `anime_link = entry_anime_link(lib_entry['data'][0])`
 
     Args:
-        anime_link: URL to the anime. Typically from `relationships:anime:links:related`
+        anime_link: URL to the anime. Typically from `entry_anime_link()` or `relationships:anime:links:related`
 
     Returns:
         dict: Kitsu API response
@@ -169,3 +464,52 @@ def get_streams(stream_link):
 
     """
     return selective_request('streams', stream_link)
+
+
+def get_library_batch(user_id, page_size=50):
+    """Get a page of the user's anime library with the anime, categories, and streams included.
+
+    The `links.next` URL of each page retains the include and sparse fieldset arguments
+
+    Args:
+        user_id: Kitsu user ID
+        page_size: number of library entries per page. Default is 50
+
+    Returns:
+        dict: Kitsu API response
+
+    """
+    fields = '&'.join(f'fields[{_type}]={",".join(keys)}' for _type, keys in BATCH_FIELDS.items())
+    url = (f'users/{user_id}/library-entries?filter[kind]=anime&page[limit]={page_size}'
+           f'&include={BATCH_INCLUDE}&{fields}')
+    return get_kitsu(url, prefix='library')
+
+
+def split_library_page(library_page):
+    """Demultiplex the included resources from `get_library_batch()` into the `get_anime()`/`get_streams()` format.
+
+    Args:
+        library_page: Kitsu API response from `get_library_batch()` or the following `links.next` pages
+
+    Returns:
+        list: of tuples `(anime_entry, anime, streams)` for each library entry that can be passed to
+            `merge_anime_info()`
+
+    """
+    included = {(resource['type'], resource['id']): resource for resource in library_page.get('included', [])}
+
+    def lookup(linkage):
+        return [included[(link['type'], link['id'])] for link in linkage or []]
+
+    batch = []
+    for anime_entry in library_page['data']:
+        anime_link = anime_entry['relationships']['anime'].get('data')
+        if anime_link is None:
+            LOGGER.warning(f'No anime included for library entry: {anime_entry["id"]}')
+            continue
+        anime_data = included[(anime_link['type'], anime_link['id'])]
+        relationships = anime_data['relationships']
+        anime = {'data': anime_data, 'included': lookup(relationships['categories'].get('data'))}
+        streams = {'data': lookup(relationships['streamingLinks'].get('data'))}
+        batch.append((anime_entry, anime, streams))
+    return batch
@@ -2,25 +2,18 @@
 # PLANNED: Generalize and move to Dash_Charts
 
 import re
-import time
-from datetime import datetime
 
 import dash
 import dash_bootstrap_components as dbc
-import dash_core_components as dcc
 import dash_html_components as html
-import dash_table
-import pandas as pd
-import plotly.express as px
 from dash.exceptions import PreventUpdate
-from dash_charts.components import dropdown_group, opts_dd
-from dash_charts.modules_datatable import ModuleFilteredTable
 from dash_charts.utils_app_modules import DataCache
 from dash_charts.utils_app_with_navigation import AppWithTabs
-from dash_charts.utils_callbacks import map_args, map_outputs
-from icecream import ic
+from dash_charts.utils_callbacks import map_args
 
 from .app_tabs import InstructionsTab, TabIris, TabTip
+from .cache_helpers import KITSU_DATA
+from .table_module import ModuleSQLTable, table_columns
 from .upload_module import UploadModule
 
 # add popup module with datatable vertically so that all data fits (add column that says "more" with button that will
@@ -120,8 +113,8 @@ class KitsuExplorer(AppWithTabs):  # noqa: H601
     id_wip_button = 'button-wip'
     """Placeholder button ID for testing."""
 
-    mod_table = ModuleFilteredTable('filtered_table')
-    """Main table module (DataTable)."""
+    mod_table = ModuleSQLTable('filtered_table')
+    """Main table module (DataTable) that pages, filters, and sorts in SQLite."""
 
     mod_cache = DataCache('user_session')
     """Data cache module for storing session information."""
@@ -150,6 +143,17 @@ class KitsuExplorer(AppWithTabs):  # noqa: H601
             InstructionsTab(app=self.app),
         ]
 
+    def table_source(self):
+        """Return the database and table shown in the main table.
+
+        Returns:
+            tuple: `(database, table_name)` for the `kitsu` view if scraped, otherwise the default upload table
+
+        """
+        if table_columns(KITSU_DATA.db, 'kitsu'):
+            return KITSU_DATA, 'kitsu'
+        return self.mod_upload.database, self.mod_upload.default_table.name
+
     def return_layout(self):
         """Return Dash application layout.
 
@@ -172,7 +176,7 @@ class KitsuExplorer(AppWithTabs):  # noqa: H601
             dbc.Row([dbc.Col([
                 html.H2('Data Interaction'),
                 html.P(' FIXME: Needs dropdown to select table_name. Filtered data should be applied to px chart'),
-                self.mod_table.return_layout(self.ids, px.data.gapminder()),
+                self.mod_table.return_layout(self.ids, *self.table_source()),
             ])], style={'maxWidth': '90%', 'paddingLeft': '5%'}),
 
             dbc.Modal([
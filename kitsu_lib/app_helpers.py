@@ -89,25 +89,37 @@ def parse_uploaded_image(b64_file, filename, timestamp):
     return html.Img(src=b64_file)
 
 
-def parse_json(raw_json):
-    """Return dataframe from JSON formatted in the 'records' orientation.
+def json_records(dict_json):
+    """Return the list of records from JSON formatted in the 'records' orientation.
 
     Args:
-        raw_json: json string
+        dict_json: parsed JSON dictionary
 
     Returns:
-        dataframe: uploaded dataframe parsed from JSON
+        list: records from the only key of the dictionary
 
     Raises:
         RuntimeError: if the JSON file can't be parsed
 
     """
-    dict_json = json.loads(raw_json)
     keys = [*dict_json.keys()]
     if len(keys) != 1:
         raise RuntimeError('Expected JSON with format `{data: [...]}` where `data` could be any key.'
                            f'However, more than one key was found: {keys}')
-    return pd.DataFrame.from_records(dict_json[keys[0]])
+    return dict_json[keys[0]]
+
+
+def parse_json(raw_json):
+    """Return dataframe from JSON formatted in the 'records' orientation.
+
+    Args:
+        raw_json: json string
+
+    Returns:
+        dataframe: uploaded dataframe parsed from JSON
+
+    """
+    return pd.DataFrame.from_records(json_records(json.loads(raw_json)))
 
 
 def load_df(decoded, filename):
@@ -162,3 +174,70 @@ def parse_uploaded_df(b64_file, filename, timestamp):
         raise RuntimeError(f'Could not parse {filename} ({content_type})\nError: {error}')
 
     return df_upload  # noqa: R504
+
+
+def decode_b64_file(b64_file, chunk_size=2 ** 20):
+    """Decode a base64 file from Plotly Dash in fixed-size slices into a binary buffer.
+
+    Unlike `split_b64_file()`, the full string is not encoded to bytes first, so only the decoded data and one slice
+    are held in memory in addition to the original string
+
+    Args:
+        b64_file: file encoded in base64
+        chunk_size: number of base64 characters decoded at a time. Rounded down to a multiple of 4. Default is 1 MB
+
+    Returns:
+        tuple: `(content_type, buffer)` with the string content type and an `io.BytesIO` at position 0
+
+    """
+    separator = ';base64,'
+    header_end = b64_file.index(separator)
+    step = max(chunk_size - chunk_size % 4, 4)
+    buffer = io.BytesIO()
+    for start in range(header_end + len(separator), len(b64_file), step):
+        buffer.write(base64.b64decode(b64_file[start:start + step]))
+    buffer.seek(0)
+    return b64_file[:header_end], buffer
+
+
+def iter_df_chunks(buffer, filename, chunksize=10000):
+    """Parse a binary file buffer into dataframes of at most `chunksize` rows based on the file type.
+
+    CSV and newline-delimited JSON (`.ndjson`/`.jsonl`) files are read incrementally from the buffer. JSON in the
+    'records' orientation and Excel files must be parsed in full before the rows are returned in chunks
+
+    Args:
+        buffer: binary file object, such as the buffer from `decode_b64_file()`
+        filename: filename of upload file. Name only
+        chunksize: maximum number of rows in each dataframe. Default is 10,000
+
+    Yields:
+        dataframe: next chunk of rows from the uploaded file
+
+    Raises:
+        RuntimeError: if the file type is not supported
+
+    """
+    suffix = Path(filename).suffix.lower()
+    if suffix in {'.csv', '.ndjson', '.jsonl'}:
+        text = io.TextIOWrapper(buffer, encoding='utf-8', newline='' if suffix == '.csv' else None)
+        try:
+            if suffix == '.csv':
+                yield from pd.read_csv(text, chunksize=chunksize)
+            else:
+                yield from pd.read_json(text, lines=True, chunksize=chunksize)
+        finally:
+            text.detach()  # Leave the buffer open for the caller
+
+    elif suffix.startswith('.xl'):
+        df_upload = pd.read_excel(buffer)
+        for start in range(0, len(df_upload), chunksize):
+            yield df_upload.iloc[start:start + chunksize]
+
+    elif suffix == '.json':
+        records = json_records(json.load(buffer))
+        for start in range(0, len(records), chunksize):
+            yield pd.DataFrame.from_records(records[start:start + chunksize])
+
+    else:
+        raise RuntimeError(f'File type ({suffix}) is unsupported. Expected .csv, .xl*, .json, .ndjson, or .jsonl')
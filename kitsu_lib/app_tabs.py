@@ -1,6 +1,9 @@
 """Exploratory Dashboard Interface."""
 
+import hashlib
+import inspect
 from collections import OrderedDict
+from functools import lru_cache
 
 import dash
 import dash_bootstrap_components as dbc
@@ -14,6 +17,41 @@ from dash_charts.utils_app import AppBase
 from dash_charts.utils_callbacks import map_args, map_outputs
 from dash_charts.utils_fig import min_graph
 
+from .cache_helpers import CACHE_DIR, FigureCache
+from .chart_helpers import bin_density, bin_histogram, bin_spec, downsample, is_numeric
+
+FIGURE_CACHE = FigureCache(CACHE_DIR / '_figure_cache.db')
+"""Shared cache of the charts in each tab. The SQLite file is shared by all workers serving the dashboard."""
+
+
+@lru_cache(maxsize=None)
+def load_demo_data(name):
+    """Return a Plotly Express demo dataset. Each dataset is only loaded once and on first use.
+
+    Args:
+        name: name of the function in `px.data`, such as `tips` or `iris`
+
+    Returns:
+        pd.DataFrame: demo dataset
+
+    """
+    return getattr(px.data, name)()
+
+
+def fingerprint_df(df):
+    """Return a hash of the values, index, and column names of a dataframe.
+
+    Args:
+        df: pandas dataframe
+
+    Returns:
+        str: SHA1 hex digest
+
+    """
+    digest = hashlib.sha1(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    digest.update(repr([*df.columns]).encode('utf-8'))
+    return digest.hexdigest()
+
 
 class StaticTab(AppBase):  # noqa: H601
     """Simple App without charts or callbacks."""
@@ -66,7 +104,7 @@ of the charts
             dict: Dash HTML object
 
         """
-        example_df = px.data.iris()[:20]
+        example_df = load_demo_data('iris')[:20]
         return html.Div(children=[
             dcc.Markdown(self.summary),
             html.H5('Tidy Data'),
@@ -111,6 +149,18 @@ class TabBase(AppBase):  # noqa: H601
     takes_args: bool = True
     """If True, will pass arguments from UI to function."""
 
+    figure_cache: FigureCache = FIGURE_CACHE
+    """Cache of the figures built from `data`. Set to None to rebuild the figure on every change."""
+
+    max_points: int = 20000
+    """Maximum number of rows passed to a chart. Larger data is pre-binned or downsampled in `reduce_data()`."""
+
+    max_bins: int = 100
+    """Number of bins (along each axis) for pre-binned histograms and density contours."""
+
+    group_keys: tuple = ('color', 'symbol', 'facet_row', 'facet_col')
+    """Keyword arguments with column names that split the data into separate traces or facets."""
+
     templates: list = ['ggplot2', 'seaborn', 'simple_white', 'plotly',
                        'plotly_white', 'plotly_dark', 'presentation', 'xgridoff',
                        'ygridoff', 'gridon', 'none']
@@ -120,7 +170,7 @@ class TabBase(AppBase):  # noqa: H601
     name: str = None
     """Unique tab component name. Must be overridden in child class."""
     data: pd.DataFrame = None
-    """Dataframe. Must be overridden in child class."""
+    """Dataframe. Must be overridden in child class or returned by `load_data()`."""
     func_map: OrderedDict = None
     """Map of functions to keywords. Must be overridden in child class."""
 
@@ -130,9 +180,19 @@ class TabBase(AppBase):  # noqa: H601
     dims_dict: OrderedDict = OrderedDict([])
     """OrderedDict of keyword from function to allowed values. Must be overridden in child class."""
 
+    def load_data(self):
+        """Return the dataframe for this tab. Override to load the data when the tab is created instead of on import.
+
+        Returns:
+            pd.DataFrame: dataframe or None
+
+        """
+        return self.data
+
     def initialization(self):
         """Initialize ids with `self.register_uniq_ids([...])` and other one-time actions."""
         super().initialization()
+        self.data = self.load_data()
 
         # Register the the unique element IDs
         self.input_ids = [self.id_func, self.id_template] + [*self.dims] + [*self.dims_dict.keys()]
@@ -142,6 +202,7 @@ class TabBase(AppBase):  # noqa: H601
         self.col_opts = [] if self.data is None else tuple(opts_dd(_c, _c) for _c in self.data.columns)
         self.func_opts = tuple(opts_dd(lbl, lbl) for lbl in self.func_map.keys())
         self.t_opts = tuple(opts_dd(template, template) for template in self.templates)
+        self.data_fingerprint = None if self.data is None else fingerprint_df(self.data)
 
     def create_elements(self):
         """Initialize the charts, tables, and other Dash elements."""
@@ -212,11 +273,77 @@ class TabBase(AppBase):  # noqa: H601
 
         self.register_update_chart()
 
+    def create_chart(self, name_func, kwargs):
+        """Return the chart for the selected function and arguments, reusing a cached figure when available.
+
+        Args:
+            name_func: key in `func_map`
+            kwargs: keyword arguments from the template and dimension dropdowns
+
+        Returns:
+            dict: Plotly figure or figure dictionary
+
+        """
+
+        def create_figure():
+            func = self.func_map[name_func]
+            data, reduced_kwargs, trace_updates = self.reduce_data(func, kwargs)
+            if 'render_mode' in inspect.signature(func).parameters:
+                reduced_kwargs.setdefault('render_mode', 'webgl')
+            fig = func(data, height=650, **reduced_kwargs)
+            for trace_type, update in trace_updates.items():
+                fig.update_traces(selector={'type': trace_type}, **update)
+            return fig
+
+        if self.figure_cache is None:
+            return create_figure()
+        key = self.figure_cache.make_key(self.name, self.data_fingerprint, name_func, kwargs, self.max_points,
+                                         self.max_bins)
+        return self.figure_cache.get_or_create(key, create_figure)
+
+    def reduce_data(self, func, kwargs):
+        """Pre-bin or downsample the data when there are more than `max_points` rows.
+
+        Histograms are aggregated into one row per bin and density contours into one row per grid cell, then plotted
+        with `histfunc='sum'` and the original bins. Other charts are downsampled with `downsample()`. Charts with a
+        trendline or marginal plots are always downsampled because those are computed from the individual rows
+
+        Args:
+            func: Plotly Express function from `func_map`
+            kwargs: keyword arguments from the template and dimension dropdowns
+
+        Returns:
+            tuple: `(data, kwargs, trace_updates)` where `trace_updates` maps a trace type to `update_traces` keywords
+
+        """
+        kwargs = {**kwargs}
+        data = self.data
+        if data is None or len(data) <= self.max_points:
+            return data, kwargs, {}
+
+        x_col, y_col = kwargs.get('x'), kwargs.get('y')
+        groups = [kwargs[key] for key in self.group_keys if kwargs.get(key)]
+        is_row_based = any(kwargs.get(key) for key in ('trendline', 'marginal', 'marginal_x', 'marginal_y'))
+        if func.__name__ == 'histogram' and not is_row_based and (x_col or y_col):
+            column, weight, bins_key = (x_col, y_col, 'xbins') if x_col else (y_col, None, 'ybins')
+            if weight is None or is_numeric(data, weight):
+                data, weight_column, edges = bin_histogram(data, column, groups, weight=weight, bins=self.max_bins)
+                kwargs.update({'x' if x_col else 'y': column, 'y' if x_col else 'x': weight_column,
+                               'histfunc': 'sum'})
+                return data, kwargs, {} if edges is None else {'histogram': {bins_key: bin_spec(edges)}}
+        if (func.__name__ == 'density_contour' and not is_row_based and x_col and y_col
+                and is_numeric(data, x_col) and is_numeric(data, y_col)):
+            data, count_column, x_edges, y_edges = bin_density(data, x_col, y_col, groups, bins=self.max_bins)
+            kwargs.update({'z': count_column, 'histfunc': 'sum'})
+            return data, kwargs, {'histogram2dcontour': {'xbins': bin_spec(x_edges), 'ybins': bin_spec(y_edges)}}
+        return downsample(data, self.max_points, x=x_col, y=y_col, groups=groups), kwargs, {}
+
     def register_update_chart(self):
         """Register the update_chart callback."""
         outputs = [(self.id_chart, 'figure')]
         inputs = [(_id, 'value') for _id in self.input_ids]
         states = ()
+
         @self.callback(outputs, inputs, states)
         def update_chart(*raw_args):
             a_in, _a_states = map_args(raw_args, inputs, states)
@@ -229,7 +356,7 @@ class TabBase(AppBase):  # noqa: H601
                 if self.takes_args:
                     # Parse the arguments to generate a new plot
                     kwargs = {key: a_in[key]['value'] for key in self.input_ids[1:]}
-                    new_chart = self.func_map[name_func](self.data, height=650, **kwargs)
+                    new_chart = self.create_chart(name_func, kwargs)
                 else:
                     new_chart = self.func_map[name_func]()
             # Example Mapping Output. Alternatively, just: `return [new_chart]`
@@ -240,7 +367,6 @@ class TabTip(TabBase):  # noqa: H601
     """TabTip properties."""
 
     name = 'Tip Data'
-    data = px.data.tips()
     func_map = OrderedDict([
         ('scatter', px.scatter),
         ('density_contour', px.density_contour),
@@ -252,12 +378,15 @@ class TabTip(TabBase):  # noqa: H601
         ('trendline', ('ols', 'lowess')),
     ])
 
+    def load_data(self):
+        """Return the tips demo dataset."""  # noqa: DAR201
+        return load_demo_data('tips')
+
 
 class TabIris(TabBase):  # noqa: H601
     """TabIris properties."""
 
     name = 'Iris Data'
-    data = px.data.iris()
     func_map = OrderedDict([
         ('histogram', px.histogram),
         ('density_contour', px.density_contour),
@@ -267,3 +396,7 @@ class TabIris(TabBase):  # noqa: H601
         ('scatter', px.scatter),
     ])
     dims = ('x', 'y', 'color', 'facet_col', 'facet_row')
+
+    def load_data(self):
+        """Return the iris demo dataset."""  # noqa: DAR201
+        return load_demo_data('iris')
@@ -24,25 +24,54 @@ table.update(dict(name='John Doe', age=47), ['name'])
 
 """
 
+import gzip
+import hashlib
 import json
+import os
+import re
+import threading
 import time
+import weakref
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
 
 import dataset
-from dash_charts.dash_helpers import uniq_table_id
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
 
-from .kitsu_helpers import LOGGER
+from .kitsu_helpers import LOGGER, LRUCache, chunked
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
 
 CACHE_DIR = Path(__file__).parent / 'local_cache'
 """Path to folder with all downloaded responses from Kitsu API."""
 
 
 class DBConnect:
-    """Manage database connection since closing connection isn't possible."""
+    """Manage a `dataset` database that is shared by threads and by other processes, such as web workers.
+
+    `dataset` opens one SQLite connection for each thread on first use. Each connection uses WAL mode and waits up to
+    `busy_timeout` seconds for a lock. Transactions start with `BEGIN IMMEDIATE`, so a writer waits for the write
+    lock when the transaction starts. It does not fail with "database is locked" when a deferred read is upgraded to
+    a write. Connections of threads that have exited are closed periodically
+
+    """
 
     database_path = None
     """Path to the local storage SQLite database file. Initialize in `__init__()`."""
 
+    busy_timeout = 30
+    """Seconds that a connection waits for a lock held by another connection before raising an error."""
+
+    prune_interval = 60
+    """Seconds between checks for connections of threads that have exited."""
+
     _db = None
 
     @property
@@ -54,19 +83,140 @@ class DBConnect:
 
         """
         if self._db is None:
-            LOGGER.debug(f'Initializing dataset instance for {self.database_path}')
-            self._db = dataset.connect(f'sqlite:///{self.database_path}')
+            with self._lock:
+                if self._db is None:
+                    LOGGER.debug(f'Initializing dataset instance for {self.database_path}')
+                    self._db = self._connect()
+        elif time.monotonic() - self._last_prune > self.prune_interval:
+            self.prune_connections()
         return self._db
 
-    def __init__(self, database_path):
+    def __init__(self, database_path, busy_timeout=None):
         """Store the database path and ensure the parent directory exists.
 
         Args:
             database_path: path to the SQLite file
+            busy_timeout: optional seconds to wait for a lock. Default is `DBConnect.busy_timeout`
 
         """
         self.database_path = database_path.resolve()
         self.database_path.parent.mkdir(exist_ok=True)
+        if busy_timeout is not None:
+            self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._last_prune = time.monotonic()
+        self._connections_lock = threading.Lock()
+        self._connections = weakref.WeakValueDictionary()
+
+    def __enter__(self):
+        """Return the database for use in a `with` block that closes all connections on exit.
+
+        Returns:
+            dict: `dataset` database instance
+
+        """
+        return self.db
+
+    def __exit__(self, *exc_info):
+        """Close all connections."""  # noqa: DAR101
+        self.close()
+
+    def _connect(self):
+        """Create the `dataset` database with the connection settings for concurrent access.
+
+        Returns:
+            dict: `dataset` database instance
+
+        """
+        db = dataset.connect(
+            f'sqlite:///{self.database_path}',
+            # Connections of exited threads are closed from another thread in `prune_connections()`
+            engine_kwargs={'connect_args': {'timeout': self.busy_timeout, 'check_same_thread': False}},
+        )
+        pragmas = [f'busy_timeout = {int(self.busy_timeout * 1000)}', 'journal_mode = WAL', 'synchronous = NORMAL']
+        with self._connections_lock:
+            self._connections = weakref.WeakValueDictionary()
+
+        @event.listens_for(db.engine, 'connect')
+        def configure_connection(dbapi_connection, _connection_record):
+            # Transactions are started by `begin_immediate()` rather than implicitly by the sqlite3 module
+            dbapi_connection.isolation_level = None
+            for pragma in pragmas:
+                dbapi_connection.execute(f'PRAGMA {pragma}')
+
+        @event.listens_for(db.engine, 'engine_connect')
+        def track_connection(connection, branch):
+            if not branch:
+                with self._connections_lock:
+                    self._connections[threading.get_ident()] = connection
+
+        @event.listens_for(db.engine, 'begin')
+        def begin_immediate(connection):
+            connection.execute(text('BEGIN IMMEDIATE'))
+
+        return db
+
+    @contextmanager
+    def transaction(self):
+        """Group writes into a single transaction that holds the write lock from the start.
+
+        Yields:
+            dict: `dataset` database instance within the transaction
+
+        """
+        with self.db as tx:
+            yield tx
+
+    def insert_batches(self, table_name, rows, batch_size=500):
+        """Insert rows with one transaction for each batch, so that other writers can run between batches.
+
+        Args:
+            table_name: name of the table. Created by `dataset` if needed
+            rows: iterable of row dictionaries
+            batch_size: number of rows in each transaction. Default is 500
+
+        Returns:
+            int: number of rows inserted
+
+        """
+        row_count = 0
+        for batch in chunked(rows, batch_size):
+            with self.transaction() as tx:
+                tx[table_name].insert_many(batch, chunk_size=batch_size)
+            row_count += len(batch)
+        return row_count
+
+    def prune_connections(self):
+        """Close the connections opened by threads that have exited, such as the threads of a web server.
+
+        The connections are invalidated rather than closed, so that a thread that is later given the same identifier
+        opens a new connection on first use
+
+        Returns:
+            int: number of closed connections
+
+        """
+        self._last_prune = time.monotonic()
+        alive = {thread.ident for thread in threading.enumerate()}
+        with self._connections_lock:
+            stale = [conn for tid, conn in self._connections.items() if tid not in alive and not conn.invalidated]
+        for connection in stale:
+            connection.invalidate()
+        return len(stale)
+
+    def close_thread(self):
+        """Close the connection of the current thread. A new connection is opened on the next use."""
+        with self._connections_lock:
+            connection = self._connections.get(threading.get_ident())
+        if connection is not None and not connection.invalidated:
+            connection.invalidate()
+
+    def close(self):
+        """Close the connections of all threads. A new connection is opened on the next use."""
+        with self._lock:
+            db, self._db = self._db, None
+        if db is not None:
+            db.close()
 
 
 FILE_DATA = DBConnect(CACHE_DIR / '_file_lookup_database.db')
@@ -75,6 +225,55 @@ FILE_DATA = DBConnect(CACHE_DIR / '_file_lookup_database.db')
 KITSU_DATA = DBConnect(CACHE_DIR / '_kitsu_data.db')
 """Global instance of the DBConnect() for the output for the Kitsu API parser."""
 
+BULK_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -64 * 1024}
+"""SQLite pragmas for bulk loading. WAL with `synchronous=NORMAL` only syncs at checkpoints. A negative cache is KiB."""
+
+
+def apply_pragmas(db, pragmas=None):
+    """Set SQLite pragmas on the database connection of the current thread.
+
+    `journal_mode` is stored in the database file, while the other pragmas only apply to the current connection. Must
+    be called outside of a transaction
+
+    Args:
+        db: dataset database
+        pragmas: dictionary of pragma names and values. Default is `BULK_PRAGMAS`
+
+    """
+    for name, value in (pragmas or BULK_PRAGMAS).items():
+        db.query(f'PRAGMA {name} = {value}')
+
+
+def quote_name(name):
+    """Quote a table or column name for use in a SQL statement.
+
+    Args:
+        name: table or column name
+
+    Returns:
+        str: quoted identifier
+
+    """
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+URL_CACHE = LRUCache(maxsize=4096)
+"""In-process cache of URL to database row for the most recently requested URLs to skip the SQLite lookup."""
+
+_DAY = 24 * 60 * 60
+
+CACHE_TTL = {
+    'user': 30 * _DAY,
+    'library': _DAY / 24,
+    'library-next': _DAY / 24,
+    'anime': 30 * _DAY,
+    'streams': 7 * _DAY,
+}
+"""Seconds that a cached response is considered fresh for each prefix. Prefixes not listed never expire."""
+
+_FIND_URL = 'SELECT * FROM files WHERE url = :url'
+"""Single parameterized lookup statement so that SQLite can reuse the prepared statement and the url index."""
+
 
 def pretty_dump_json(filename, obj):
     """Write indented JSON file.
@@ -88,18 +287,345 @@ def pretty_dump_json(filename, obj):
     Path(filename).write_text(json.dumps(obj, indent=4, separators=(',', ': ')))
 
 
-def initialize_cache():
-    """Ensure that the directory and database exist. Remove files from database if manually removed."""
+def write_ndjson(filename, rows):
+    """Write each row as a line of JSON (NDJSON) as the rows are produced.
+
+    Args:
+        filename: Path or plain string filename to write (should end with `.ndjson`)
+        rows: iterable of JSON objects. Can be a generator
+
+    Returns:
+        int: number of rows written
+
+    """
+    LOGGER.debug(f'Creating file: {filename}')
+    count = 0
+    with open(filename, 'w', encoding='utf-8') as ndjson_file:
+        for row in rows:
+            ndjson_file.write(json.dumps(row) + '\n')
+            count += 1
+    return count
+
+
+def iter_ndjson(filename):
+    """Read each row from a NDJSON file one line at a time.
+
+    Args:
+        filename: Path or plain string filename to read
+
+    Yields:
+        dict: JSON object for each line
+
+    """
+    with open(filename, encoding='utf-8') as ndjson_file:
+        for line in ndjson_file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ResponseStore(ABC):
+    """Base class for serializing the cached responses. Child classes must set `suffix` and implement encode/decode."""
+
+    suffix = None
+    """File extension used to identify which store can load a cached file. Must be overridden in child class."""
+
+    @abstractmethod
+    def encode(self, obj):
+        """Serialize the response.
+
+        Args:
+            obj: JSON object to write
+
+        Returns:
+            bytes: data to write to the file
+
+        """
+
+    @abstractmethod
+    def decode(self, raw):
+        """Deserialize the response.
+
+        Args:
+            raw: bytes read from file
+
+        Returns:
+            dict: JSON object
+
+        """
+
+    def dump(self, path, obj):
+        """Write the response. The file is written to a temporary path first so that readers never see partial data.
+
+        Args:
+            path: Path to the destination file
+            obj: JSON object to write
+
+        Returns:
+            int: number of bytes written
+
+        """
+        LOGGER.debug(f'Creating file: {path}')
+        tmp_path = path.with_name(f'{path.name}.tmp')
+        size = tmp_path.write_bytes(self.encode(obj))
+        os.replace(tmp_path, path)
+        return size
+
+    def load(self, path):
+        """Read the response.
+
+        Args:
+            path: Path to the cached file
+
+        Returns:
+            dict: JSON object
+
+        """
+        return self.decode(Path(path).read_bytes())
+
+
+class JSONStore(ResponseStore):
+    """Indented JSON files. Format used by earlier versions of the cache."""
+
+    suffix = '.json'
+
+    def encode(self, obj):
+        """Return indented JSON bytes."""  # noqa: DAR101,DAR201
+        return json.dumps(obj, indent=4, separators=(',', ': ')).encode('utf-8')
+
+    def decode(self, raw):
+        """Parse JSON bytes."""  # noqa: DAR101,DAR201
+        return json.loads(raw)
+
+
+class GzipStore(ResponseStore):
+    """Compact JSON compressed with gzip."""
+
+    suffix = '.json.gz'
+
+    compresslevel = 6
+    """Gzip compression level from 1 (fastest) to 9 (smallest)."""
+
+    def encode(self, obj):
+        """Return compact JSON compressed with gzip."""  # noqa: DAR101,DAR201
+        return gzip.compress(json.dumps(obj, separators=(',', ':')).encode('utf-8'), compresslevel=self.compresslevel)
+
+    def decode(self, raw):
+        """Decompress and parse JSON."""  # noqa: DAR101,DAR201
+        return json.loads(gzip.decompress(raw))
+
+
+class ZstdStore(ResponseStore):
+    """Compact JSON compressed with zstandard. Requires the optional `zstandard` package."""
+
+    suffix = '.json.zst'
+
+    level = 3
+    """Zstandard compression level."""
+
+    def __init__(self):
+        """Verify that the optional dependency is installed.
+
+        Raises:
+            RuntimeError: if `zstandard` is not installed
+
+        """
+        if zstandard is None:
+            raise RuntimeError('ZstdStore requires the `zstandard` package. Install with `poetry install -E zstd`')
+
+    def encode(self, obj):
+        """Return compact JSON compressed with zstandard."""  # noqa: DAR101,DAR201
+        return zstandard.ZstdCompressor(level=self.level).compress(json.dumps(obj, separators=(',', ':')).encode())
+
+    def decode(self, raw):
+        """Decompress and parse JSON."""  # noqa: DAR101,DAR201
+        return json.loads(zstandard.ZstdDecompressor().decompress(raw))
+
+
+CACHE_STORE = GzipStore()
+"""Store used to write new responses. Any store can be used to read existing files based on the file extension."""
+
+STORE_TYPES = {'json': JSONStore, 'gzip': GzipStore, 'zstd': ZstdStore}
+"""Map of names to each available ResponseStore."""
+
+
+def get_store(filename):
+    """Return the store that can read the specified file based on the file extension.
+
+    Args:
+        filename: Path or plain string filename of a cached response
+
+    Returns:
+        ResponseStore: instance to load the file
+
+    Raises:
+        RuntimeError: if the file extension is not recognized
+
+    """
+    name = Path(filename).name
+    for store_type in STORE_TYPES.values():
+        if name.endswith(store_type.suffix):
+            return store_type()
+    raise RuntimeError(f'Unknown cache file type: {filename}')
+
+
+def load_response(filename):
+    """Load a cached response from any of the supported stores.
+
+    Args:
+        filename: Path or plain string filename of a cached response
+
+    Returns:
+        dict: JSON object
+
+    """
+    return get_store(filename).load(filename)
+
+
+def normalize_url(url):
+    """Return the URL in a canonical form so that equivalent URLs share one cached response.
+
+    The scheme and host are lower case, the query arguments are sorted by name and the brackets are not
+    percent-encoded (`filter[kind]=anime`), and any trailing slash and fragment are removed
+
+    Args:
+        url: full URL
+
+    Returns:
+        str: normalized URL
+
+    """
+    parts = urlsplit(url)
+    query = sorted(parse_qsl(parts.query, keep_blank_values=True), key=lambda pair: pair[0])
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/') or '/',
+                       urlencode(query, safe='[],'), ''))
+
+
+def cache_filename(prefix, url, store):
+    """Return the content-addressed path for the response from the given URL.
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: full URL of the request
+        store: ResponseStore instance that sets the file extension
+
+    Returns:
+        Path: path to the file in `CACHE_DIR`
+
+    """
+    url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()  # noqa: S303 (not used for security)
+    return CACHE_DIR / f'{prefix}_{url_hash}{store.suffix}'
+
+
+_RESPONSE_NAME = re.compile(
+    r'^[^_]+_(?:[0-9a-f]{40}|U\d+)(?:' + '|'.join(re.escape(_s.suffix) for _s in STORE_TYPES.values())
+    + r')(?:\.tmp)?$',
+)
+"""Match the names of the files written by `store_response()`, including interrupted `.tmp` writes.
+
+Also matches the `<prefix>_U<timestamp_ns>.json` names from versions of the cache before content-addressed files
+
+"""
+
+
+def initialize_cache(background=False):
+    """Ensure that the directory and database exist, then reconcile the database with the files in `CACHE_DIR`.
+
+    Args:
+        background: if True, run `reconcile_cache()` in a separate thread so that the caller can start immediately.
+            Responses that are found to be missing in the meantime are requested again by `selective_request()`
+
+    Returns:
+        object: summary from `reconcile_cache()` or a `Future` with the summary if run in the background
+
+    """
     table = FILE_DATA.db.create_table('files')
+    table.create_column('filename', FILE_DATA.db.types.text)
+    table.create_column('url', FILE_DATA.db.types.text)
+    table.create_column('timestamp', FILE_DATA.db.types.float)
+    table.create_column('prefix', FILE_DATA.db.types.text)
+    table.create_column('etag', FILE_DATA.db.types.text)
+    table.create_column('last_modified', FILE_DATA.db.types.text)
+    table.create_column('size', FILE_DATA.db.types.integer)
+    table.create_column('accessed', FILE_DATA.db.types.float)
+    table.create_column('hits', FILE_DATA.db.types.integer)
+    # The unique constraint both indexes the lookup by URL and rejects duplicate responses
+    FILE_DATA.db.query('CREATE UNIQUE INDEX IF NOT EXISTS ix_files_url ON files (url)')
+
+    if not background:
+        return reconcile_cache()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='reconcile_cache')
+    future = executor.submit(reconcile_cache)
+    executor.shutdown(wait=False)
+    return future
+
+
+def scan_cache_dir():
+    """List the response files in `CACHE_DIR` with a single directory scan.
+
+    Returns:
+        dict: full filename to the `os.stat_result` for each file that matches the names from `cache_filename()`
+
+    """
+    try:
+        with os.scandir(CACHE_DIR) as entries:
+            return {entry.path: entry.stat() for entry in entries
+                    if _RESPONSE_NAME.match(entry.name) and entry.is_file()}
+    except FileNotFoundError:
+        return {}
 
-    removed_files = []
-    for row in table:
-        if not Path(row['filename']).is_file():
-            removed_files.append(row['filename'])
-    LOGGER.debug(f'Removing files: {removed_files}' if len(removed_files) > 0 else 'No removed files found')
 
-    for filename in removed_files:
-        table.delete(filename=filename)
+def reconcile_cache(remove_stray=False, batch_size=500):
+    """Remove the rows for files that were manually deleted and find the response files that are not tracked.
+
+    The database is read before `CACHE_DIR` is scanned so that files written concurrently by `store_response()` are
+    never reported as missing, and files modified after the start are never reported as stray
+
+    Args:
+        remove_stray: if True, delete the stray files. Default is False to only log them
+        batch_size: maximum number of filenames in each `DELETE` statement. Default is 500
+
+    Returns:
+        dict: with keys `tracked`, `missing`, and `stray` where `missing` and `stray` are sorted lists of filenames
+
+    """
+    start = time.time()
+    tracked = {row['filename'] for row in FILE_DATA.db.query('SELECT filename FROM files')}
+    on_disk = scan_cache_dir()
+    cache_dir = os.fspath(CACHE_DIR)
+    # Only files that the scan would have listed are missing if not found. Any other row (such as from before
+    # CACHE_DIR was moved or with an unrecognized name) is checked one by one
+    missing = sorted(
+        filename for filename in tracked.difference(on_disk)
+        if (os.path.dirname(filename) == cache_dir and _RESPONSE_NAME.match(os.path.basename(filename)))
+        or not os.path.exists(filename)
+    )
+    stray = sorted(filename for filename, stat in on_disk.items()
+                   if filename not in tracked and stat.st_mtime < start)
+
+    LOGGER.debug(f'Removing files: {missing}' if missing else 'No removed files found')
+    with FILE_DATA.transaction() as tx:
+        for chunk in chunked(missing, batch_size):
+            tx['files'].delete(filename=chunk)
+
+        # Backfill the columns for responses cached before the columns were added
+        for row in [*tx['files'].find(prefix=None)]:
+            tx['files'].update({'id': row['id'], 'prefix': Path(row['filename']).name.split('_')[0]}, ['id'])
+        for row in [*tx['files'].find(size=None)]:
+            stat = on_disk.get(row['filename'])
+            if stat is None and os.path.exists(row['filename']):
+                stat = os.stat(row['filename'])
+            tx['files'].update({'id': row['id'], 'size': stat.st_size if stat else None,
+                                'accessed': row['accessed'] or row['timestamp'], 'hits': row['hits'] or 0}, ['id'])
+    URL_CACHE.clear()
+
+    if stray:
+        LOGGER.warning(f'{"Removing" if remove_stray else "Found"} {len(stray)} untracked files in {CACHE_DIR}')
+    for filename in stray if remove_stray else []:
+        try:
+            Path(filename).unlink()
+        except FileNotFoundError:
+            pass
+    return {'tracked': len(tracked) - len(missing), 'missing': missing, 'stray': stray}
 
 
 def match_url_in_cache(url):
@@ -109,31 +635,469 @@ def match_url_in_cache(url):
         url: full URL to use as a reference if already downloaded
 
     Returns:
-        list: list of match object with keys of the SQL table
+        list: list of match object with keys of the SQL table. Will have at most one match
+
+    """
+    return [*FILE_DATA.db.query(_FIND_URL, url=url)]
+
+
+def find_cached_response(url):
+    """Return the database row for the cached response of the given URL, checking the in-process cache first.
+
+    Args:
+        url: full URL to use as a reference if already downloaded
+
+    Returns:
+        dict: row with keys of the SQL table or None if the URL has not been downloaded
+
+    """
+    row = URL_CACHE.get(url)
+    if row is None:
+        matches = match_url_in_cache(url)
+        if matches:
+            row = dict(matches[0])
+            URL_CACHE.put(url, row)
+    return row
+
+
+def forget_response(url):
+    """Remove the database row for a cached response, such as when the file was deleted.
+
+    Args:
+        url: full URL of the request
+
+    """
+    FILE_DATA.db.load_table('files').delete(url=url)
+    URL_CACHE.pop(url)
+
+
+def find_cached_filename(url):
+    """Return the filename of the cached response for the given URL.
+
+    Args:
+        url: full URL to use as a reference if already downloaded
+
+    Returns:
+        str: filename of the stored response or None if the URL has not been downloaded
+
+    """
+    row = find_cached_response(url)
+    return None if row is None else row['filename']
+
+
+def is_stale(row, now=None):
+    """Check if the cached response is older than the time-to-live for the prefix in `CACHE_TTL`.
+
+    Args:
+        row: database row from `find_cached_response()`
+        now: optional current time. Default is `time.time()`
+
+    Returns:
+        bool: True if the response should be revalidated
+
+    """
+    ttl = CACHE_TTL.get(row.get('prefix'))
+    if ttl is None:
+        return False
+    now = time.time() if now is None else now
+    return now - row['timestamp'] > ttl
+
+
+def _new_row(prefix, url, filename, size, validators):
+    """Create the database row for a response.
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: full URL to use as a reference if already downloaded
+        filename: Path to the stored response
+        size: number of bytes in the stored file
+        validators: optional dictionary with `etag` and `last_modified` headers from the response
+
+    Returns:
+        dict: new row
 
     """
-    return [*FILE_DATA.db.load_table('files').find(url=url)]
+    validators = validators or {}
+    now = time.time()
+    return {'filename': str(filename), 'url': url, 'timestamp': now, 'prefix': prefix,
+            'etag': validators.get('etag'), 'last_modified': validators.get('last_modified'),
+            'size': size, 'accessed': now, 'hits': 0}
 
 
-def store_response(prefix, url, obj):
-    """Store the response object as a JSON file and track in a SQLite database.
+def store_response(prefix, url, obj, validators=None):
+    """Store the response object with `CACHE_STORE` and track in a SQLite database.
 
     Args:
         prefix: string used to create more recognizable filenames
         url: full URL to use as a reference if already downloaded
         obj: JSON object to write
+        validators: optional dictionary with `etag` and `last_modified` headers for revalidation. Default is None
 
     Raises:
         RuntimeError: if duplicate match found when storing
 
     """
-    filename = CACHE_DIR / f'{prefix}_{uniq_table_id()}.json'
-    new_row = {'filename': str(filename), 'url': url, 'timestamp': time.time()}
-    # Check that the URL isn't already in the database
+    filename = cache_filename(prefix, url, CACHE_STORE)
+    # Store the file before updating the database so that other threads never match a missing file
+    new_row = _new_row(prefix, url, filename, CACHE_STORE.dump(filename, obj), validators)
     LOGGER.debug(f'inserting row: {new_row}')
-    matches = match_url_in_cache(url)
-    if len(matches) > 0:
+    try:
+        FILE_DATA.db.load_table('files').insert(new_row)
+    except IntegrityError:
+        matches = match_url_in_cache(url)
+        if all(match['filename'] != str(filename) for match in matches):
+            filename.unlink()
         raise RuntimeError(f'Already have an entry for this URL (`{url}`): {matches}')
-    # Update the database and store the file
-    FILE_DATA.db.load_table('files').insert(new_row)
-    pretty_dump_json(filename, obj)
+    URL_CACHE.put(url, new_row)
+    CACHE_MANAGER.record_store()
+
+
+def update_response(prefix, url, obj, validators=None):
+    """Replace a stale cached response with the new response from the server.
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: full URL to use as a reference if already downloaded
+        obj: JSON object to write
+        validators: optional dictionary with `etag` and `last_modified` headers for revalidation. Default is None
+
+    """
+    old_row = find_cached_response(url)
+    filename = cache_filename(prefix, url, CACHE_STORE)
+    new_row = _new_row(prefix, url, filename, CACHE_STORE.dump(filename, obj), validators)
+    if old_row:
+        new_row['hits'] = old_row.get('hits') or 0
+    LOGGER.debug(f'updating row: {new_row}')
+    FILE_DATA.db.load_table('files').upsert(new_row, ['url'])
+    URL_CACHE.put(url, new_row)
+    if old_row and old_row['filename'] != str(filename):
+        try:
+            Path(old_row['filename']).unlink()
+        except FileNotFoundError:
+            pass
+    CACHE_MANAGER.record_store()
+
+
+def refresh_response(url, validators=None):
+    """Reset the timestamp of a cached response after the server confirmed that it has not been modified.
+
+    Args:
+        url: full URL to use as a reference if already downloaded
+        validators: optional dictionary with new `etag` and `last_modified` headers. Default is None
+
+    """
+    row = {'url': url, 'timestamp': time.time()}
+    row.update({key: value for key, value in (validators or {}).items() if value})
+    FILE_DATA.db.load_table('files').update(row, ['url'])
+    URL_CACHE.pop(url)
+
+
+def migrate_cache(store=None):
+    """Convert every cached response to the specified store and remove the original files.
+
+    Args:
+        store: ResponseStore instance to convert to. Default is `CACHE_STORE`
+
+    Returns:
+        dict: with keys `files`, `bytes_before`, and `bytes_after` to summarize the migration
+
+    """
+    store = CACHE_STORE if store is None else store
+    initialize_cache()
+    table = FILE_DATA.db.load_table('files')
+    summary = {'files': 0, 'bytes_before': 0, 'bytes_after': 0}
+    for row in [*table.all()]:
+        old_path = Path(row['filename'])
+        prefix = old_path.name.split('_')[0]
+        new_path = cache_filename(prefix, row['url'], store)
+        summary['bytes_before'] += old_path.stat().st_size
+        if old_path != new_path:
+            size = store.dump(new_path, load_response(old_path))
+            table.update({'id': row['id'], 'filename': str(new_path), 'size': size}, ['id'])
+            old_path.unlink()
+            summary['files'] += 1
+        summary['bytes_after'] += new_path.stat().st_size
+    URL_CACHE.clear()
+    LOGGER.info(f'Migrated cache to {type(store).__name__}: {summary}')
+    return summary
+
+
+EVICTION_ORDER = {
+    'lru': 'COALESCE(accessed, timestamp) ASC',
+    'lfu': 'COALESCE(hits, 0) ASC, COALESCE(accessed, timestamp) ASC',
+}
+"""SQL `ORDER BY` terms that list the responses to evict first for each eviction policy."""
+
+
+class CacheManager:
+    """Track the use of each cached response and evict responses to keep the cache within a budget.
+
+    Hits are buffered in memory and written in a single transaction every `flush_size` events, so that a cache hit
+    does not cost a write to the database. The budget is checked whenever the buffer is flushed. Eviction removes both
+    the row and the file, so an evicted response is requested again on the next use
+
+    """
+
+    def __init__(self, max_bytes=None, max_entries=None, policy='lru', flush_size=100):
+        """Initialize the counters. The cache is not limited unless `max_bytes` or `max_entries` is set.
+
+        Args:
+            max_bytes: optional maximum total size of the cached files. Default is None for no limit
+            max_entries: optional maximum number of cached responses. Default is None for no limit
+            policy: eviction policy from `EVICTION_ORDER` (`lru` or `lfu`). Default is `lru`
+            flush_size: number of hits and stores between writes of the buffered hits. Default is 100
+
+        Raises:
+            ValueError: if the policy is not known
+
+        """
+        if policy not in EVICTION_ORDER:
+            raise ValueError(f'Unknown eviction policy `{policy}`. Expected one of: {[*EVICTION_ORDER]}')
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy
+        self.flush_size = flush_size
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0}
+        self._pending = {}
+        self._events = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+
+    def _count(self, name=None):
+        """Count an event. Returns True when the buffered hits should be flushed."""  # noqa: DAR101,DAR201
+        with self._lock:
+            if name:
+                self.stats[name] += 1
+            self._events += 1
+            return self._events >= self.flush_size
+
+    def record_hit(self, url):
+        """Record that a response was served from the cache.
+
+        Args:
+            url: full URL of the cached response
+
+        """
+        with self._lock:
+            hits = self._pending.get(url, (0, 0))[1]
+            self._pending[url] = (time.time(), hits + 1)
+        if self._count('hits'):
+            self.flush()
+
+    def record_miss(self):
+        """Record that a response had to be requested from the server."""
+        self._count('misses')
+
+    def record_store(self):
+        """Record that a response was written to the cache, which may put the cache over the budget."""
+        if self._count():
+            self.flush()
+
+    def flush(self):
+        """Write the buffered hits to the database and evict responses if the cache is over the budget.
+
+        Returns:
+            list: URLs of the evicted responses
+
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._events = 0
+        if pending:
+            with FILE_DATA.transaction() as tx:
+                tx.executable.execute(
+                    text('UPDATE files SET accessed = :accessed, hits = COALESCE(hits, 0) + :hits WHERE url = :url'),
+                    [{'accessed': accessed, 'hits': hits, 'url': url} for url, (accessed, hits) in pending.items()],
+                )
+        return self.evict()
+
+    def evict(self, batch_size=500):
+        """Remove the least recently (LRU) or least frequently (LFU) used responses that exceed the budget.
+
+        Args:
+            batch_size: maximum number of URLs in each `DELETE` statement. Default is 500
+
+        Returns:
+            list: URLs of the evicted responses
+
+        """
+        if self.max_bytes is None and self.max_entries is None:
+            return []
+        if not self._evict_lock.acquire(blocking=False):
+            return []  # Another thread is already evicting
+        try:
+            totals = FILE_DATA.db.query('SELECT COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes FROM files').next()
+            excess_entries = max(0, totals['entries'] - self.max_entries) if self.max_entries is not None else 0
+            excess_bytes = max(0, totals['bytes'] - self.max_bytes) if self.max_bytes is not None else 0
+            if not excess_entries and not excess_bytes:
+                return []
+            # Running totals select the shortest prefix of the eviction order that brings the cache within budget
+            order = EVICTION_ORDER[self.policy]
+            rows = [*FILE_DATA.db.query(
+                f'SELECT url, filename, size FROM (SELECT url, filename, COALESCE(size, 0) AS size,'
+                f' ROW_NUMBER() OVER (ORDER BY {order}) AS position,'
+                f' SUM(COALESCE(size, 0)) OVER (ORDER BY {order} ROWS UNBOUNDED PRECEDING) AS freed FROM files)'
+                ' WHERE position <= :entries OR freed - size < :bytes',
+                entries=excess_entries, bytes=excess_bytes,
+            )]
+            with FILE_DATA.transaction() as tx:
+                for chunk in chunked([row['url'] for row in rows], batch_size):
+                    tx['files'].delete(url=chunk)
+            for row in rows:
+                URL_CACHE.pop(row['url'])
+                try:
+                    Path(row['filename']).unlink()
+                except FileNotFoundError:
+                    pass
+        finally:
+            self._evict_lock.release()
+        with self._lock:
+            self.stats['evictions'] += len(rows)
+            self.stats['evicted_bytes'] += sum(row['size'] for row in rows)
+        LOGGER.info(f'Evicted {len(rows)} cached responses ({self.policy})')
+        return [row['url'] for row in rows]
+
+    def usage(self):
+        """Summarize the cached responses for each prefix.
+
+        Returns:
+            list: dictionaries with keys `prefix`, `entries`, `bytes`, `hits`, and `last_accessed`, largest first
+
+        """
+        self.flush()
+        return [dict(row) for row in FILE_DATA.db.query(
+            'SELECT prefix, COUNT(*) AS entries, COALESCE(SUM(size), 0) AS bytes, COALESCE(SUM(hits), 0) AS hits,'
+            ' MAX(COALESCE(accessed, timestamp)) AS last_accessed FROM files'
+            ' GROUP BY prefix ORDER BY bytes DESC, prefix',
+        )]
+
+
+CACHE_MANAGER = CacheManager()
+"""Usage tracking for the response cache. Set `max_bytes` or `max_entries` to limit the size of the cache."""
+
+
+class FigureCache:
+    """Bounded cache of serialized Plotly figures that is shared between dashboard worker processes.
+
+    Figures are kept as dictionaries in an in-process `LRUCache` and as gzip-compressed JSON in a SQLite table, so that
+    a figure built by one worker is reused by the others. Both levels evict the least recently used figures
+
+    """
+
+    def __init__(self, database_path, maxsize=256, memory_maxsize=32, table_name='figures'):
+        """Initialize the cache. The database file is only created on first use.
+
+        Args:
+            database_path: path to the SQLite file shared between workers
+            maxsize: maximum number of figures kept in the database. Default is 256
+            memory_maxsize: maximum number of figures kept in memory by each process. Default is 32
+            table_name: name of the table in the database. Default is `figures`
+
+        """
+        self.database = DBConnect(database_path)
+        self.maxsize = maxsize
+        self.memory = LRUCache(maxsize=memory_maxsize)
+        self.table_name = quote_name(table_name)
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._is_ready = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(*parts):
+        """Return a stable key from JSON-serializable parts, such as the tab name and chart keyword arguments.
+
+        Args:
+            parts: values that uniquely describe the figure. Dictionaries are serialized with sorted keys
+
+        Returns:
+            str: SHA1 hex digest
+
+        """
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    @property
+    def db(self):
+        """Return the dataset database and create the table if needed.
+
+        Returns:
+            dict: `dataset` database instance
+
+        """
+        db = self.database.db
+        if not self._is_ready:
+            db.query(f'CREATE TABLE IF NOT EXISTS {self.table_name} '
+                     '(key TEXT PRIMARY KEY, figure BLOB NOT NULL, accessed REAL NOT NULL)')
+            self._is_ready = True
+        return db
+
+    def _count(self, name):
+        """Increment a hit or miss counter."""  # noqa: DAR101
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        """Return the cached figure from memory, then from the shared database.
+
+        Args:
+            key: key from `make_key()`
+
+        Returns:
+            dict: figure dictionary or None if not cached
+
+        """
+        figure = self.memory.get(key)
+        if figure is not None:
+            self._count('hits')
+            return figure
+
+        rows = [*self.db.query(f'SELECT figure FROM {self.table_name} WHERE key = :key', key=key)]
+        if not rows:
+            self._count('misses')
+            return None
+        self._count('disk_hits')
+        figure = json.loads(gzip.decompress(rows[0]['figure']))
+        self.memory.put(key, figure)
+        self.db.query(f'UPDATE {self.table_name} SET accessed = :now WHERE key = :key', now=time.time(), key=key)
+        return figure
+
+    def put(self, key, figure_json):
+        """Store a serialized figure and evict the least recently used figures from the database.
+
+        Args:
+            key: key from `make_key()`
+            figure_json: JSON string, such as from `fig.to_json()`
+
+        Returns:
+            dict: deserialized figure
+
+        """
+        figure = json.loads(figure_json)
+        self.memory.put(key, figure)
+        blob = gzip.compress(figure_json.encode('utf-8'), compresslevel=6)
+        self.db.query(f'INSERT OR REPLACE INTO {self.table_name} (key, figure, accessed) VALUES (:key, :blob, :now)',
+                      key=key, blob=blob, now=time.time())
+        self.db.query(f'DELETE FROM {self.table_name} WHERE key NOT IN '
+                      f'(SELECT key FROM {self.table_name} ORDER BY accessed DESC LIMIT :maxsize)',
+                      maxsize=self.maxsize)
+        return figure
+
+    def get_or_create(self, key, create_figure):
+        """Return the cached figure or build, cache, and return a new figure.
+
+        Args:
+            key: key from `make_key()`
+            create_figure: function that returns a Plotly figure when called without arguments
+
+        Returns:
+            dict: figure dictionary
+
+        """
+        figure = self.get(key)
+        if figure is None:
+            figure = self.put(key, create_figure().to_json())
+        return figure
+
+    def clear(self):
+        """Remove all figures from memory and the database."""
+        self.memory.clear()
+        self.db.query(f'DELETE FROM {self.table_name}')
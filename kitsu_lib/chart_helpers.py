@@ -0,0 +1,218 @@
+"""Reduce large dataframes before they are passed to Plotly Express so that the figure size stays bounded.
+
+Histograms and density grids are pre-binned with NumPy and the bin counts are passed with `histfunc='sum'`, while
+point charts are downsampled with LTTB (numeric x and y) or a random sample stratified by the grouping columns.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def is_numeric(df, column):
+    """Return True if the column is numeric, but not boolean.
+
+    Args:
+        df: pandas dataframe
+        column: column name
+
+    Returns:
+        bool: True if numeric
+
+    """
+    dtype = df[column].dtype
+    return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+
+
+def unused_name(df, name):
+    """Return a column name based on `name` that is not already in the dataframe.
+
+    Args:
+        df: pandas dataframe
+        name: preferred column name
+
+    Returns:
+        str: column name
+
+    """
+    while name in df.columns:
+        name = f'_{name}'
+    return name
+
+
+def lttb_indices(x, y, n_out):
+    """Select the points that best preserve the shape of a series with Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The remaining points are split into `n_out - 2` buckets and the point
+    that forms the largest triangle with the previously selected point and the mean of the next bucket is kept
+
+    Args:
+        x: 1D array sorted in ascending order
+        y: 1D array of the same length
+        n_out: number of points to keep
+
+    Returns:
+        array: sorted integer indices of the selected points
+
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_in = len(x)
+    if n_out >= n_in:
+        return np.arange(n_in)
+    if n_out < 3:
+        return np.array([0, n_in - 1][:max(n_out, 0)], dtype=int)
+
+    edges = np.linspace(1, n_in - 1, n_out - 1).astype(int)
+    selected = np.zeros(n_out, dtype=int)
+    selected[-1] = n_in - 1
+    previous = 0
+    for idx in range(n_out - 2):
+        start, stop = edges[idx], edges[idx + 1]
+        next_start, next_stop = (stop, edges[idx + 2]) if idx + 2 < len(edges) else (n_in - 1, n_in)
+        mean_x = x[next_start:next_stop].mean()
+        mean_y = y[next_start:next_stop].mean()
+        area = np.abs((x[previous] - mean_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[idx + 1] = previous
+    return selected
+
+
+def group_budgets(sizes, max_points):
+    """Split the point budget between groups in proportion to the size of each group.
+
+    Args:
+        sizes: pandas series of the number of rows in each group
+        max_points: total number of points to keep
+
+    Returns:
+        pd.Series: number of rows to keep from each group. Every non-empty group keeps at least one row
+
+    """
+    budgets = np.floor(sizes * max_points / max(sizes.sum(), 1)).astype(int)
+    return budgets.clip(lower=np.minimum(sizes, 1), upper=sizes)
+
+
+def downsample(df, max_points, x=None, y=None, groups=(), seed=0):
+    """Reduce the number of rows to about `max_points` while keeping each group of the grouping columns.
+
+    Groups with numeric `x` and `y` columns use LTTB so that the extremes are kept. Otherwise, a random sample of each
+    group is used so that distributions (box, violin, strip) keep their shape
+
+    Args:
+        df: pandas dataframe
+        max_points: maximum number of rows to keep
+        x: optional column name for the x-axis
+        y: optional column name for the y-axis
+        groups: column names used for color, symbol, or facets. Default is none
+        seed: random seed so that the same rows are selected on each call. Default is 0
+
+    Returns:
+        pd.DataFrame: downsampled dataframe (or the original dataframe if already small enough)
+
+    """
+    if len(df) <= max_points:
+        return df
+
+    groups = [*dict.fromkeys(groups)]
+    use_lttb = x is not None and y is not None and is_numeric(df, x) and is_numeric(df, y)
+    rng = np.random.default_rng(seed)
+    grouped = df.groupby(groups, dropna=False, sort=False, observed=True) if groups else [(None, df)]
+    sizes = pd.Series([len(group) for _key, group in grouped])
+    budgets = group_budgets(sizes, max_points)
+    parts = []
+    for (_key, group), budget in zip(grouped, budgets):
+        if use_lttb:
+            group = group.dropna(subset=[x, y]).sort_values(x, kind='stable')
+            parts.append(group.iloc[lttb_indices(group[x].to_numpy(), group[y].to_numpy(), budget)])
+        else:
+            parts.append(group.iloc[np.sort(rng.choice(len(group), size=budget, replace=False))])
+    return pd.concat(parts) if parts else df.iloc[:0]
+
+
+def bin_edges(values, bins):
+    """Return evenly spaced bin edges that span the finite values.
+
+    Args:
+        values: numeric pandas series
+        bins: number of bins
+
+    Returns:
+        array: `bins + 1` edges
+
+    """
+    finite = values.to_numpy(dtype=float)
+    finite = finite[np.isfinite(finite)]
+    low, high = (finite.min(), finite.max()) if len(finite) else (0.0, 1.0)
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def bin_spec(edges):
+    """Return the Plotly `xbins` or `ybins` dictionary that matches the edges.
+
+    Args:
+        edges: evenly spaced bin edges
+
+    Returns:
+        dict: with keys `start`, `end`, and `size`
+
+    """
+    return {'start': float(edges[0]), 'end': float(edges[-1]), 'size': float(edges[1] - edges[0])}
+
+
+def bin_histogram(df, column, groups=(), weight=None, bins=100):
+    """Pre-aggregate a histogram into one row per bin (numeric column) or per value (other columns) and group.
+
+    Args:
+        df: pandas dataframe
+        column: column name that is binned
+        groups: column names used for color or facets. Default is none
+        weight: optional numeric column name that is summed in each bin. Default is None to count rows
+        bins: number of bins for a numeric column. Default is 100
+
+    Returns:
+        tuple: `(binned_df, weight_column, edges)` where `edges` is None for a categorical column. The weight column is
+            the sum (or count) for each row, so the histogram should be plotted with `histfunc='sum'`
+
+    """
+    groups = [*dict.fromkeys(_g for _g in groups if _g != column)]
+    weight_column = weight or unused_name(df, 'count')
+    values = df[[*groups, column]].copy()
+    values[weight_column] = 1 if weight is None else df[weight]
+    edges = None
+    if is_numeric(df, column):
+        edges = bin_edges(df[column], bins)
+        index = np.clip(np.searchsorted(edges, df[column].to_numpy(dtype=float), side='right') - 1, 0, bins - 1)
+        centers = (edges[:-1] + edges[1:]) / 2
+        values[column] = np.where(df[column].isna(), np.nan, centers[index])
+    binned = values.groupby([*groups, column], dropna=False, sort=False, observed=True)[weight_column].sum()
+    return binned.reset_index(), weight_column, edges
+
+
+def bin_density(df, x, y, groups=(), bins=100):
+    """Pre-aggregate a two-dimensional histogram into one row for each non-empty cell and group.
+
+    Args:
+        df: pandas dataframe
+        x: numeric column name for the x-axis
+        y: numeric column name for the y-axis
+        groups: column names used for color or facets. Default is none
+        bins: number of bins along each axis. Default is 100
+
+    Returns:
+        tuple: `(binned_df, count_column, x_edges, y_edges)`. Plot with `z=count_column` and `histfunc='sum'`
+
+    """
+    groups = [*dict.fromkeys(_g for _g in groups if _g not in (x, y))]
+    count_column = unused_name(df, 'count')
+    values = df[[*groups, x, y]].dropna(subset=[x, y]).copy()
+    x_edges = bin_edges(values[x], bins)
+    y_edges = bin_edges(values[y], bins)
+    for column, edges in ((x, x_edges), (y, y_edges)):
+        index = np.clip(np.searchsorted(edges, values[column].to_numpy(dtype=float), side='right') - 1, 0, bins - 1)
+        values[column] = ((edges[:-1] + edges[1:]) / 2)[index]
+    binned = values.groupby([*groups, x, y], dropna=False, sort=False, observed=True).size()
+    return binned.rename(count_column).reset_index(), count_column, x_edges, y_edges
@@ -1,10 +1,19 @@
 """General helpers for the kitsu_lib package."""
 
 import csv
+import importlib.util
 import logging
+import queue
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 
+from sqlalchemy import func, select
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+"""True if the optional `pyarrow` package is installed. The package is only imported by `import_pyarrow()`."""
+
 LOGGER = logging.getLogger('kitsu')
 """Module logger instance."""
 
@@ -42,16 +51,291 @@ def rm_brs(line):
     return ' '.join(line.split())
 
 
-def export_table_as_csv(csv_filename, table):
+class LRUCache:
+    """Thread-safe mapping that evicts the least recently used keys once `maxsize` is exceeded."""
+
+    maxsize = None
+    """Maximum number of keys (or total size if `sizeof` is set) to keep. Initialize in `__init__()`."""
+
+    sizeof = None
+    """Optional function that returns the size of a value, such as the number of bytes. Initialize in `__init__()`."""
+
+    def __init__(self, maxsize=1024, sizeof=None):
+        """Initialize an empty cache.
+
+        Args:
+            maxsize: maximum number of keys to keep, or the maximum total size if `sizeof` is set. Default is 1024
+            sizeof: optional function that returns the size of each value. Default is None to count keys
+
+        """
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self._data = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Return the number of cached keys."""  # noqa: DAR201
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Return the cached value and mark the key as most recently used.
+
+        Args:
+            key: hashable key
+            default: value to return if the key is not cached. Default is None
+
+        Returns:
+            object: cached value or default
+
+        """
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        """Cache a value and evict the least recently used keys if over the size limit.
+
+        A value that is larger than `maxsize` on its own is not cached
+
+        Args:
+            key: hashable key
+            value: value to cache
+
+        """
+        size = 1 if self.sizeof is None else self.sizeof(value)
+        with self._lock:
+            self.size += size - self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self._data.move_to_end(key)
+            while self.size > self.maxsize:
+                evicted_key, _value = self._data.popitem(last=False)
+                self.size -= self._sizes.pop(evicted_key)
+
+    def pop(self, key, default=None):
+        """Remove the key from the cache.
+
+        Args:
+            key: hashable key
+            default: value to return if the key is not cached. Default is None
+
+        Returns:
+            object: removed value or default
+
+        """
+        with self._lock:
+            self.size -= self._sizes.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def keys(self):
+        """Return a list of the cached keys from least to most recently used."""  # noqa: DAR201
+        with self._lock:
+            return [*self._data]
+
+    def clear(self):
+        """Remove all keys from the cache."""
+        with self._lock:
+            self._data.clear()
+            self._sizes.clear()
+            self.size = 0
+
+
+def chunked(iterable, size):
+    """Split an iterable into lists of at most `size` items without loading the full iterable into memory.
+
+    Args:
+        iterable: any iterable
+        size: maximum number of items per chunk
+
+    Yields:
+        list: next chunk of items
+
+    """
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def prefetch(iterable, size=1):
+    """Consume an iterable in a background thread, buffering up to `size` items ahead of the caller.
+
+    Exceptions raised by the iterable are re-raised in the caller when the failing item would have been returned
+
+    Args:
+        iterable: any iterable, typically a generator that makes blocking requests
+        size: maximum number of items to buffer. Default is 1
+
+    Yields:
+        object: each item from the iterable, in order
+
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def produce():
+        for item in _wrap_errors(iterable):
+            while not stop.is_set():
+                try:
+                    buffer.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            is_done, item, error = buffer.get()
+            if error is not None:
+                raise error
+            if is_done:
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+def _wrap_errors(iterable):
+    """Wrap each item so that the end of iteration and any errors can be passed through a queue.
+
+    Args:
+        iterable: any iterable
+
+    Yields:
+        tuple: `(is_done, item, error)`
+
+    """
+    try:
+        for item in iterable:
+            yield False, item, None
+    except Exception as error:
+        yield True, None, error
+        return
+    yield True, None, None
+
+
+def query_table_chunks(table, chunk_size=1000):
+    """Select all rows of a dataset table with a single cursor and return the rows in chunks.
+
+    Args:
+        table: table (or view) from dataset database
+        chunk_size: number of rows fetched at a time. Default is 1000
+
+    Returns:
+        tuple: `(columns, chunks)` with the list of column names and an iterator of lists of row tuples
+
+    """
+    result = table.db.executable.execute(table.table.select())
+    columns = [*result.keys()]
+
+    def iter_chunks():
+        try:
+            for rows in iter(lambda: result.fetchmany(chunk_size), []):
+                yield [tuple(row) for row in rows]
+        finally:
+            result.close()
+
+    return columns, iter_chunks()
+
+
+def export_table_as_csv(csv_filename, table, chunk_size=1000):
     """Create a CSV file summarizing a table of a dataset database.
 
     Args:
         csv_filename: Path to csv file
         table: table from dataset database
+        chunk_size: number of rows fetched and written at a time. Default is 1000
+
+    """
+    columns, chunks = query_table_chunks(table, chunk_size)
+    with open(csv_filename, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file, delimiter=',', quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+
+
+_ARROW_TYPES = {bool: 'bool_', int: 'int64', float: 'float64', str: 'string', bytes: 'binary'}
+"""Map of the Python type of a SQLAlchemy column to the name of the pyarrow type factory."""
+
+_SQLITE_ARROW_TYPES = {'integer': 'int64', 'real': 'float64', 'text': 'string', 'blob': 'binary'}
+"""Map of the SQLite `typeof()` for columns without a declared type (such as view expressions) to pyarrow."""
+
+
+def import_pyarrow():
+    """Import the optional `pyarrow` package on first use, which takes longer than importing the rest of kitsu_lib.
+
+    Returns:
+        tuple: `(pyarrow, pyarrow.parquet)` modules
+
+    Raises:
+        RuntimeError: if `pyarrow` is not installed
+
+    """
+    if not HAS_PYARROW:
+        raise RuntimeError('Arrow export requires the `pyarrow` package. Install with `poetry install -E arrow`')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    return pa, pq
+
+
+def arrow_schema(table):
+    """Return the pyarrow schema for a dataset table from the declared column types.
+
+    Columns without a declared type, such as expressions in a view, use the SQLite type of the first non-null value.
+    Columns with only null values are stored as strings
+
+    Args:
+        table: table (or view) from dataset database
+
+    Returns:
+        pa.Schema: schema with a field for each column
+
+    """
+    pa, _pq = import_pyarrow()
+    fields = []
+    for column in table.table.columns:
+        try:
+            type_name = _ARROW_TYPES.get(column.type.python_type, 'string')
+        except NotImplementedError:
+            query = select([func.typeof(column)]).where(column.isnot(None)).limit(1)
+            sqlite_type = table.db.executable.execute(query).scalar()
+            type_name = _SQLITE_ARROW_TYPES.get(sqlite_type or 'text', 'string')
+        fields.append(pa.field(column.name, getattr(pa, type_name)()))
+    return pa.schema(fields)
+
+
+def export_table_as_arrow(filename, table, chunk_size=10000):
+    """Stream a table of a dataset database into a columnar Parquet or Arrow IPC (Feather) file.
+
+    Rows are converted to record batches of `chunk_size` rows as they are read from SQLite. Files with the suffix
+    `.arrow` or `.feather` are written in the Arrow IPC file format, which can be memory-mapped. All other files are
+    written as Parquet
+
+    Args:
+        filename: Path to the output file
+        table: table (or view) from dataset database
+        chunk_size: number of rows in each record batch. Default is 10000
+
+    Raises:
+        RuntimeError: if `pyarrow` is not installed
 
     """
-    with open(csv_filename, 'w', newline='\n', encoding='utf-8') as csv_file:
-        writer = csv.writer(csv_file, delimiter=',', quoting=csv.QUOTE_MINIMAL)
-        writer.writerow(table.columns)
-        for row in table:
-            writer.writerow([*row.values()])
+    pa, pq = import_pyarrow()
+    schema = arrow_schema(table)
+    columns, chunks = query_table_chunks(table, chunk_size)
+    is_ipc = Path(filename).suffix in {'.arrow', '.feather'}
+    with (pa.ipc.new_file(str(filename), schema) if is_ipc else pq.ParquetWriter(str(filename), schema)) as writer:
+        for rows in chunks:
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
@@ -1,66 +1,226 @@
 """Main scraper interface."""
 
-from .analysis import create_kitsu_database, merge_anime_info
-from .api_helpers import get_anime, get_library, get_streams, get_user_id, selective_request
-from .cache_helpers import CACHE_DIR, KITSU_DATA, initialize_cache, pretty_dump_json
-from .kitsu_helpers import LOGGER, configure_logger, export_table_as_csv
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from .analysis import SYNC_KEYS, create_kitsu_database, load_sync_state, merge_anime_info, update_kitsu_database
+from .api_helpers import (entry_anime_link, get_anime, get_library, get_library_batch, get_streams, get_user_id,
+                          selective_request, split_library_page)
+from .cache_helpers import CACHE_DIR, CACHE_MANAGER, KITSU_DATA, initialize_cache, write_ndjson
+from .kitsu_helpers import HAS_PYARROW, LOGGER, configure_logger, export_table_as_arrow, export_table_as_csv, prefetch
 
-def scrape_kitsu_unsafe(username=None, limit=None):
-    """Scrape the anime from the user's database into local storage.
+
+def scrape_library_entry(anime_entry):
+    """Fetch the anime and streams for a single library entry and merge into a summary dictionary.
 
     Args:
-        username: optional Kitsu user name. Otherwise falls back to input()
-        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        anime_entry: entry from within library response
+
+    Returns:
+        dict: single summary dictionary from `merge_anime_info()`
 
     """
-    initialize_cache()
-    user_id = get_user_id(username)
-    LOGGER.debug(f'Scraping Kitsu for {username} ({user_id})')
+    anime = get_anime(entry_anime_link(anime_entry))
+    streams = get_streams(anime['data']['relationships']['streamingLinks']['links']['related'])
+    return merge_anime_info(anime_entry, anime, streams)
+
+
+def map_ordered(func, items, workers=1):
+    """Apply the function to each item with a pool of threads and yield the results in the original order.
+
+    Args:
+        func: function to call for each item
+        items: iterable of items. Can be a generator, which is consumed as results are returned
+        workers: number of threads. Default is 1 (serial)
+
+    Yields:
+        object: result of `func(item)` for each item
+
+    """
+    if workers <= 1:
+        yield from map(func, items)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            # Bound the number of queued items so that results are yielded as soon as they are available
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
 
-    # Loop through a user's library
+def iter_library_pages(user_id, limit=None, batch=False):
+    """Yield each page of the user's anime library by following the `links.next` URL.
+
+    Args:
+        user_id: Kitsu user ID
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        batch: if True, request pages with the anime and streams included from `get_library_batch()`
+
+    Yields:
+        dict: Kitsu API response for a single library page
+
+    """
     index = 0
-    all_data = []
-    library_page = get_library(user_id, is_anime=True)
+    library_page = get_library_batch(user_id) if batch else get_library(user_id, is_anime=True)
     while library_page and (limit is None or index <= limit):
-        this_lib_page = library_page
-        for anime_entry in this_lib_page['data']:
-            anime = get_anime(anime_entry['relationships']['anime']['links']['related'])
-            streams = get_streams(anime['data']['relationships']['streamingLinks']['links']['related'])
-            # FIXME: Store these datasets in three tables. See README for notes on flattening the JSON
-            all_data.append(merge_anime_info(anime_entry, anime, streams))
+        yield library_page
 
         # Check if there is a 'next' URL available or if the iterations have reached their limit
         index += 1
         next_url = None
         try:
-            next_url = this_lib_page['links']['next']
+            next_url = library_page['links']['next']
         except (AttributeError, KeyError) as error:
             LOGGER.info(f'Failed to find next URL (index:{index}) with error: {error}')
         library_page = False
-        if next_url:
+        if next_url and (limit is None or index <= limit):
             LOGGER.debug(f'Fetching next library page URL: {next_url}')
             library_page = selective_request('library-next', next_url)
 
-    summary_file_path = CACHE_DIR / 'all_data.json'
-    pretty_dump_json(summary_file_path, {'data': all_data})
-    create_kitsu_database(summary_file_path)
 
-    csv_filename = CACHE_DIR / '_database_kitsu.csv'
-    export_table_as_csv(csv_filename, KITSU_DATA.db.load_table('kitsu'))
+def iter_library_entries(user_id, limit=None, workers=1, prefetch_pages=1, batch=False):
+    """Stream summary dictionaries for each library entry as the library pages arrive.
+
+    Library pages are fetched in a background thread up to `prefetch_pages` ahead of the entries being processed, so
+    that page requests overlap with the anime and stream requests for each entry
+
+    Args:
+        user_id: Kitsu user ID
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: number of threads used to fetch library entries concurrently. Default is 1 (serial)
+        prefetch_pages: number of library pages to request ahead. Set to 0 to fetch pages inline. Default is 1
+        batch: if True, request the anime and streams with each library page instead of two requests per entry
+
+    Yields:
+        dict: single summary dictionary from `merge_anime_info()` in the same order as the library entries
+
+    """
+    pages = iter_library_pages(user_id, limit=limit, batch=batch)
+    if prefetch_pages > 0:
+        pages = prefetch(pages, size=prefetch_pages)
+    if batch:
+        # All of the data for each entry is already included in the library page
+        yield from (merge_anime_info(*args) for library_page in pages for args in split_library_page(library_page))
+        return
+
+    anime_entries = (anime_entry for library_page in pages for anime_entry in library_page['data'])
+    yield from map_ordered(scrape_library_entry, anime_entries, workers=workers)
+
+
+def scrape_library(user_id, limit=None, workers=1, prefetch_pages=1, batch=False):
+    """Scrape each entry in the user's anime library.
+
+    Args:
+        user_id: Kitsu user ID
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: number of threads used to fetch library entries concurrently. Default is 1 (serial)
+        prefetch_pages: number of library pages to request ahead. Set to 0 to fetch pages inline. Default is 1
+        batch: if True, request the anime and streams with each library page instead of two requests per entry
+
+    Returns:
+        list: summary dictionaries in the same order as the library entries
+
+    """
+    return [*iter_library_entries(user_id, limit=limit, workers=workers, prefetch_pages=prefetch_pages, batch=batch)]
+
+
+def sync_library(user_id, limit=None, workers=1, prefetch_pages=1, batch=False):
+    """Update the Kitsu database with only the library entries that were added, changed, or removed.
+
+    Entries are compared by the `SYNC_KEYS` attributes (`updatedAt` and `progressedAt`). The anime and streams are only
+    requested for new or changed entries. Removed entries are only deleted when the full library is read (no limit)
+
+    Args:
+        user_id: Kitsu user ID
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: number of threads used to fetch library entries concurrently. Default is 1 (serial)
+        prefetch_pages: number of library pages to request ahead. Set to 0 to fetch pages inline. Default is 1
+        batch: if True, request the anime and streams with each library page instead of two requests per entry
+
+    Returns:
+        dict: summary with the number of `added`, `changed`, `removed`, and `unchanged` entries
+
+    """
+    stored = load_sync_state()
+    pages = iter_library_pages(user_id, limit=limit, batch=batch)
+    if prefetch_pages > 0:
+        pages = prefetch(pages, size=prefetch_pages)
+
+    seen_ids = set()
+    changed = []
+    for library_page in pages:
+        batch_args = split_library_page(library_page) if batch else [(_e, None, None) for _e in library_page['data']]
+        for anime_entry, anime, streams in batch_args:
+            seen_ids.add(anime_entry['id'])
+            attrs = anime_entry['attributes']
+            if stored.get(anime_entry['id']) != tuple(attrs.get(key) for key in SYNC_KEYS):
+                changed.append(merge_anime_info(anime_entry, anime, streams) if batch else anime_entry)
+    if not batch:
+        changed = [*map_ordered(scrape_library_entry, changed, workers=workers)]
+    removed_ids = [] if limit is not None else [_id for _id in stored if _id not in seen_ids]
+
+    update_kitsu_database(changed, removed_ids)
+    added = len([entry for entry in changed if entry['id'] not in stored])
+    summary = {'added': added, 'changed': len(changed) - added, 'removed': len(removed_ids),
+               'unchanged': len(seen_ids) - len(changed)}
+    LOGGER.info(f'Synced library for {user_id}: {summary}')
+    return summary
+
+
+def scrape_kitsu_unsafe(username=None, limit=None, workers=1, prefetch_pages=1, batch=False, incremental=False):
+    """Scrape the anime from the user's database into local storage.
+
+    Args:
+        username: optional Kitsu user name. Otherwise falls back to input()
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: number of threads used to fetch library entries concurrently. Default is 1 (serial)
+        prefetch_pages: number of library pages to request ahead. Set to 0 to fetch pages inline. Default is 1
+        batch: if True, request the anime and streams with each library page instead of two requests per entry
+        incremental: if True, only update the library entries that changed since the last run with `sync_library()`
+
+    """
+    reconciliation = initialize_cache(background=True)
+    user_id = get_user_id(username)
+    LOGGER.debug(f'Scraping Kitsu for {username} ({user_id})')
+
+    if incremental:
+        sync_library(user_id, limit=limit, workers=workers, prefetch_pages=prefetch_pages, batch=batch)
+    else:
+        # Stream each merged entry to disk as it is produced rather than accumulating the full library in memory
+        entries = iter_library_entries(user_id, limit=limit, workers=workers, prefetch_pages=prefetch_pages,
+                                       batch=batch)
+        summary_file_path = CACHE_DIR / 'all_data.ndjson'
+        write_ndjson(summary_file_path, entries)
+        create_kitsu_database(summary_file_path)
+
+    reconciliation.result()  # Raise any error from the cache check
+    CACHE_MANAGER.flush()
+    table = KITSU_DATA.db.load_table('kitsu')
+    export_table_as_csv(CACHE_DIR / '_database_kitsu.csv', table)
+    if HAS_PYARROW:
+        # Columnar copy that can be memory-mapped by the dashboard or notebooks instead of re-parsing the CSV
+        export_table_as_arrow(CACHE_DIR / '_database_kitsu.parquet', table)
 
 
-def scrape_kitsu(username=None, limit=None):
+def scrape_kitsu(username=None, limit=None, workers=1, prefetch_pages=1, batch=False, incremental=False):
     """Capture log exception from scrape_kitsu_unsafe.
 
     Args:
         username: optional Kitsu user name. Otherwise falls back to input()
         limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: number of threads used to fetch library entries concurrently. Default is 1 (serial)
+        prefetch_pages: number of library pages to request ahead. Set to 0 to fetch pages inline. Default is 1
+        batch: if True, request the anime and streams with each library page instead of two requests per entry
+        incremental: if True, only update the library entries that changed since the last run with `sync_library()`
 
     """
     configure_logger()
     try:
-        scrape_kitsu_unsafe(username, limit)
+        scrape_kitsu_unsafe(username, limit, workers, prefetch_pages, batch, incremental)
     except Exception:
         LOGGER.exception(f'Scraping Kitsu Library for {username} Failed')
         raise
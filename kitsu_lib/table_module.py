@@ -0,0 +1,353 @@
+"""Data table module with server-side paging, filtering, and sorting of a SQLite table or view."""
+
+import re
+import time
+
+import pandas as pd
+from dash_charts.datatable import BaseDataTable
+from dash_charts.modules_datatable import ModuleFilteredTable
+from dash_charts.utils_callbacks import map_args, map_outputs
+
+from .cache_helpers import quote_name
+from .kitsu_helpers import LOGGER, LRUCache
+
+COUNT_CACHE = LRUCache(maxsize=1024)
+"""Cache of `(row_count, timestamp)` for each database, table, and filter from `count_rows()`."""
+
+COUNT_TTL = 60
+"""Seconds that a cached row count is reused before the rows are counted again."""
+
+_COMPARISONS = {
+    '=': '=', 'eq': '=', '!=': '!=', 'ne': '!=',
+    '<': '<', 'lt': '<', '<=': '<=', 'le': '<=',
+    '>': '>', 'gt': '>', '>=': '>=', 'ge': '>=',
+}
+"""Map of the DataTable relational operators to SQL."""
+
+_FILTER_PART = re.compile(
+    r'^\{(?P<column>[^{}]+)\}\s*(?P<case>[si]?)(?P<operator>[<>!]?=|[<>]|eq|ne|lt|le|gt|ge|contains|datestartswith)'
+    r'(?:\s+|(?<=[=<>]))(?P<value>"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`|[^\s"\'`{}]+)$',
+)
+"""Match a single relational filter expression, such as `{rating} >= 80` or `{title} icontains "war"`."""
+
+_FILTER_UNARY = re.compile(r'^\{(?P<column>[^{}]+)\}\s+is\s+(?P<operator>blank|nil)$')
+"""Match a unary filter expression, such as `{rating} is blank`."""
+
+_CONJUNCTION = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`(?:\\.|[^`\\])*`)|\s+(?:&&|and)\s+')
+"""Find the ` && ` or ` and ` separators that are not within a quoted value."""
+
+
+def split_filter_query(filter_query):
+    """Split a DataTable filter query into each expression that is joined by `&&` or `and`.
+
+    Args:
+        filter_query: DataTable `filter_query` string
+
+    Returns:
+        list: filter expression strings
+
+    """
+    parts = []
+    start = 0
+    for match in _CONJUNCTION.finditer(filter_query):
+        if match.group(1) is None:
+            parts.append(filter_query[start:match.start()])
+            start = match.end()
+    parts.append(filter_query[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def parse_filter_value(raw_value):
+    """Parse a quoted string or a number from a filter expression.
+
+    Args:
+        raw_value: value text from the filter expression
+
+    Returns:
+        object: string, int, or float
+
+    """
+    raw_value = raw_value.strip()
+    if len(raw_value) >= 2 and raw_value[0] == raw_value[-1] and raw_value[0] in '"\'`':
+        quote = raw_value[0]
+        return raw_value[1:-1].replace(f'\\{quote}', quote)
+    for cast in (int, float):
+        try:
+            return cast(raw_value)
+        except ValueError:
+            pass
+    return raw_value
+
+
+def parse_filter_query(filter_query, columns):
+    """Translate a DataTable filter query into a parameterized SQL `WHERE` clause.
+
+    Supports the relational operators (`=`, `!=`, `<`, `<=`, `>`, `>=` and the word variants), `contains`, and
+    `datestartswith` with an optional `s` (case-sensitive) or `i` (case-insensitive) prefix, the unary `is blank` and
+    `is nil` operators, and expressions joined by `&&` or `and`
+
+    Args:
+        filter_query: DataTable `filter_query` string. May be None or empty
+        columns: column names that can be filtered
+
+    Returns:
+        tuple: `(where_sql, params)` where `where_sql` is an empty string if there is no filter
+
+    Raises:
+        ValueError: if an expression is not supported or references an unknown column
+
+    """
+    clauses = []
+    params = []
+    for part in split_filter_query(filter_query or ''):
+        match = _FILTER_UNARY.match(part) or _FILTER_PART.match(part)
+        if match is None:
+            raise ValueError(f'Unsupported filter expression: {part}')
+        column = match.group('column')
+        if column not in columns:
+            raise ValueError(f'Unknown column in filter expression: {part}')
+        name = quote_name(column)
+        operator = match.group('operator')
+        if operator in ('blank', 'nil'):
+            clauses.append(f"({name} IS NULL OR {name} = '')" if operator == 'blank' else f'{name} IS NULL')
+            continue
+
+        value = parse_filter_value(match.group('value'))
+        text_name = f'CAST({name} AS TEXT)'
+        if match.group('case') == 'i' and isinstance(value, str):
+            name = text_name = f'lower({text_name})'
+            value = value.lower()
+        if operator == 'contains':
+            clauses.append(f'instr({text_name}, ?) > 0')
+            params.append(str(value))
+        elif operator == 'datestartswith':
+            clauses.append(f'substr({text_name}, 1, ?) = ?')
+            params.extend([len(str(value)), str(value)])
+        else:
+            clauses.append(f'{name} {_COMPARISONS[operator]} ?')
+            params.append(value)
+    return ' AND '.join(clauses), params
+
+
+def order_by_clause(sort_by, columns):
+    """Translate the DataTable `sort_by` list into a SQL `ORDER BY` clause.
+
+    Args:
+        sort_by: list of dictionaries with keys `column_id` and `direction` (`asc` or `desc`). May be None
+        columns: column names that can be sorted
+
+    Returns:
+        str: `ORDER BY` clause or an empty string
+
+    Raises:
+        ValueError: if a column is unknown
+
+    """
+    terms = []
+    for sort in sort_by or []:
+        if sort['column_id'] not in columns:
+            raise ValueError(f'Unknown sort column: {sort["column_id"]}')
+        terms.append(f'{quote_name(sort["column_id"])} {"DESC" if sort["direction"] == "desc" else "ASC"}')
+    return f'ORDER BY {", ".join(terms)}' if terms else ''
+
+
+def table_columns(db, table_name):
+    """Return the column names of a table or view.
+
+    Args:
+        db: dataset database
+        table_name: name of the table or view
+
+    Returns:
+        list: column names in order. Empty if the table does not exist
+
+    """
+    return [row['name'] for row in db.query(f'PRAGMA table_info({quote_name(table_name)})')]
+
+
+def count_rows(db, table_name, where_sql='', params=()):
+    """Return the number of rows that match the filter. Counts are cached for `COUNT_TTL` seconds.
+
+    Writers in this process call `clear_count_cache()` so that the count is not reused after the table changes
+
+    Args:
+        db: dataset database
+        table_name: name of the table or view
+        where_sql: optional `WHERE` clause from `parse_filter_query()`
+        params: parameters for the `WHERE` clause
+
+    Returns:
+        int: number of matching rows
+
+    """
+    key = (str(db.url), table_name, where_sql, tuple(params))
+    cached = COUNT_CACHE.get(key)
+    if cached is not None and time.monotonic() - cached[1] < COUNT_TTL:
+        return cached[0]
+
+    sql = f'SELECT COUNT(*) FROM {quote_name(table_name)}' + (f' WHERE {where_sql}' if where_sql else '')
+    cursor = db.executable.connection.cursor()
+    try:
+        row_count = cursor.execute(sql, [*params]).fetchone()[0]
+    finally:
+        cursor.close()
+    COUNT_CACHE.put(key, (row_count, time.monotonic()))
+    return row_count
+
+
+def clear_count_cache(db, table_name=None):
+    """Remove the cached row counts for a table after it is written so that `count_rows()` counts the rows again.
+
+    Args:
+        db: dataset database
+        table_name: optional name of the table. Default is None to clear all tables and views in the database
+
+    """
+    url = str(db.url)
+    for key in COUNT_CACHE.keys():
+        if key[0] == url and table_name in {None, key[1]}:
+            COUNT_CACHE.pop(key)
+
+
+def query_page(db, table_name, page_current=0, page_size=25, filter_query='', sort_by=None, columns=None):
+    """Return a single page of filtered and sorted rows from a table or view.
+
+    Args:
+        db: dataset database
+        table_name: name of the table or view
+        page_current: zero-based page index. Default is 0
+        page_size: number of rows per page. Default is 25
+        filter_query: DataTable `filter_query` string. Default is no filter
+        sort_by: DataTable `sort_by` list. Default is None
+        columns: optional list of columns to return. Default is None for all columns
+
+    Returns:
+        tuple: `(df_page, row_count)` where `row_count` is the total number of rows that match the filter
+
+    Raises:
+        ValueError: if the filter or sort references unknown columns or the table does not exist
+
+    """
+    all_columns = table_columns(db, table_name)
+    if not all_columns:
+        raise ValueError(f'No table or view named {table_name}')
+    columns = [col for col in all_columns if columns is None or col in columns]
+    where_sql, params = parse_filter_query(filter_query, all_columns)
+    order_sql = order_by_clause(sort_by, all_columns)
+    row_count = count_rows(db, table_name, where_sql, params)
+
+    sql = ' '.join(filter(None, [
+        f'SELECT {", ".join(map(quote_name, columns))} FROM {quote_name(table_name)}',
+        f'WHERE {where_sql}' if where_sql else '',
+        order_sql,
+        'LIMIT ? OFFSET ?',
+    ]))
+    cursor = db.executable.connection.cursor()
+    try:
+        rows = cursor.execute(sql, [*params, int(page_size), int(page_current) * int(page_size)]).fetchall()
+    finally:
+        cursor.close()
+    return pd.DataFrame.from_records(rows, columns=columns), row_count
+
+
+class SQLDataTable(BaseDataTable):
+    """Data table that requests each page, filter, and sort from the server."""
+
+    filter_action = 'custom'
+    sort_action = 'custom'
+    sort_mode = 'multi'
+
+    page_action = 'custom'
+    """DataTable.page_action. The `data` is replaced with each page by `ModuleSQLTable`."""
+
+    def create_table(self, df_raw, columns=None, **kwargs_datatable):
+        """Create the dash_table.DataTable with custom paging.
+
+        Args:
+            df_raw: data to pass to datatable. Only the first page is needed
+            columns: list of column names to display. Default is None to use all columns from df_raw
+            kwargs_datatable: keyword arguments to pass to the datatable
+
+        Returns:
+            DataTable: returns dash_table.DataTable object
+
+        """
+        return super().create_table(df_raw, columns, page_action=self.page_action, page_current=0,
+                                    **kwargs_datatable)
+
+
+class ModuleSQLTable(ModuleFilteredTable):
+    """Filtered data table module that only transfers the current page of a SQLite table or view."""
+
+    database = None
+    """DBConnect instance for the database with `table_name`. Set in `return_layout()`."""
+
+    table_name = None
+    """Name of the table or view to browse. Set in `return_layout()`."""
+
+    def create_elements(self, ids):
+        """Initialize the data table.
+
+        Args:
+            ids: `self._il` from base application
+
+        """
+        self.table = SQLDataTable()
+
+    def return_layout(self, ids, database, table_name):
+        """Return Dash application layout.
+
+        Args:
+            ids: `self._il` from base application
+            database: DBConnect instance
+            table_name: name of the table or view to browse
+
+        Returns:
+            dict: Dash HTML object
+
+        """
+        self.database = database
+        self.table_name = table_name
+        df_page, _row_count = query_page(database.db, table_name, page_size=self.table.page_size)
+        return super().return_layout(ids, df_page)
+
+    def create_callbacks(self, parent):
+        """Register callbacks to handle user interaction.
+
+        Args:
+            parent: parent instance (ex: `self`)
+
+        """
+        super().create_callbacks(parent)
+        self.register_query_page(parent)
+
+    def register_query_page(self, parent):
+        """Register the callback that queries the current page whenever the paging, filter, or sort changes.
+
+        Args:
+            parent: parent instance (ex: `self`)
+
+        """
+        outputs = [(self.get(self.id_table), 'data'), (self.get(self.id_table), 'page_count')]
+        inputs = [(self.get(self.id_table), prop) for prop in ('page_current', 'page_size', 'filter_query', 'sort_by')]
+        states = [(self.get(self.id_column_select), 'value')]
+
+        @parent.callback(outputs, inputs, states)
+        def update_page(*raw_args):
+            a_in, a_states = map_args(raw_args, inputs, states)
+            table_args = a_in[self.get(self.id_table)]
+            page_size = table_args['page_size'] or self.table.page_size
+            try:
+                df_page, row_count = query_page(
+                    self.database.db, self.table_name, page_current=table_args['page_current'] or 0,
+                    page_size=page_size, filter_query=table_args['filter_query'], sort_by=table_args['sort_by'],
+                    columns=a_states[self.get(self.id_column_select)]['value'],
+                )
+            except ValueError as error:
+                LOGGER.warning(f'Failed to query {self.table_name}: {error}')
+                df_page, row_count = pd.DataFrame(), 0
+            page_count = max(1, -(-row_count // page_size))
+            return map_outputs(outputs, [
+                (self.get(self.id_table), 'data', df_page.to_dict('records')),
+                (self.get(self.id_table), 'page_count', page_count),
+            ])
@@ -1,8 +1,12 @@
 """Upload module."""
 
+import io
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import dash
 import dash_bootstrap_components as dbc
 import dash_core_components as dcc
 import dash_html_components as html
@@ -12,8 +16,13 @@ import plotly.express as px
 from dash_charts.utils_app_modules import ModuleBase
 from dash_charts.utils_callbacks import map_args, map_outputs
 
-from .app_helpers import parse_uploaded_df
-from .cache_helpers import CACHE_DIR, DBConnect
+from .app_helpers import decode_b64_file, iter_df_chunks
+from .cache_helpers import CACHE_DIR, DBConnect, quote_name
+from .kitsu_helpers import LOGGER, LRUCache
+from .table_module import clear_count_cache
+
+DATAFRAME_CACHE = LRUCache(maxsize=256 * 1024 ** 2, sizeof=lambda df: int(df.memory_usage(deep=True).sum()))
+"""Process-level cache of the uploaded DataFrames from `UploadModule.get_data()` limited to 256 MB in total."""
 
 
 def show_toast(message, header, icon='warning', style=None, **toast_kwargs):
@@ -36,6 +45,44 @@ def show_toast(message, header, icon='warning', style=None, **toast_kwargs):
     return dbc.Toast(message, header=header, icon=icon, style=style, dismissable=True, **toast_kwargs)
 
 
+def sql_type(dtype):
+    """Return the SQLite column type for a pandas dtype.
+
+    Args:
+        dtype: pandas or numpy dtype
+
+    Returns:
+        str: SQLite column type
+
+    """
+    if pd.api.types.is_bool_dtype(dtype):
+        return 'BOOLEAN'
+    if pd.api.types.is_integer_dtype(dtype):
+        return 'INTEGER'
+    if pd.api.types.is_float_dtype(dtype):
+        return 'REAL'
+    return 'TEXT'
+
+
+def df_to_rows(df_chunk):
+    """Convert a dataframe into row tuples of Python values that can be inserted with SQLite.
+
+    Missing values are converted to None and datetimes are converted to ISO strings
+
+    Args:
+        df_chunk: pandas dataframe
+
+    Returns:
+        iterable: row tuples in column order
+
+    """
+    is_value = df_chunk.notna()
+    values = df_chunk.astype(object)
+    for column in df_chunk.select_dtypes(include=['datetime', 'datetimetz']).columns:
+        values[column] = df_chunk[column].map(lambda value: value.isoformat() if pd.notna(value) else None)
+    return values.where(is_value, None).itertuples(index=False, name=None)
+
+
 def drop_to_upload(**upload_kwargs):
     """Create drop to upload element. Dashed box of the active area or a clickable link to use the file dialog.
 
@@ -64,6 +111,109 @@ def drop_to_upload(**upload_kwargs):
     )
 
 
+class JobRunner:
+    """Run functions in a background thread pool and persist the status of each job in a SQLite table."""
+
+    active_statuses = ('queued', 'running')
+    """Status of jobs that have not finished."""
+
+    def __init__(self, database, max_workers=2, table_name='jobs'):
+        """Create the jobs table and the thread pool.
+
+        Jobs that were queued or running when the previous process exited are marked as failed
+
+        Args:
+            database: `DBConnect` instance
+            max_workers: maximum number of jobs that run at the same time. Default is 2
+            table_name: name of the table that stores each job. Default is `jobs`
+
+        """
+        self.database = database
+        self.table = database.db.create_table(table_name, primary_id='job_id', primary_type=database.db.types.text)
+        for column, example in [('username', ''), ('description', ''), ('status', ''), ('progress', 0.0),
+                                ('error', ''), ('result', ''), ('notified', False), ('created', 0.0),
+                                ('updated', 0.0)]:
+            self.table.create_column_by_example(column, example)
+        for row in self.table.find(status=[*self.active_statuses]):
+            self.update(row['job_id'], status='failed', error='Interrupted by a restart')
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{table_name}-worker')
+
+    def submit(self, username, description, func, *args):
+        """Queue a function to run in the background.
+
+        Args:
+            username: string username that owns the job
+            description: short description of the job, such as the filename
+            func: function called with `(job_id, *args)`. The return value is stored as a string in `result`
+            args: additional positional arguments for `func`
+
+        Returns:
+            str: unique job ID
+
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self.table.insert({'job_id': job_id, 'username': username, 'description': description, 'status': 'queued',
+                           'progress': 0.0, 'notified': False, 'created': now, 'updated': now})
+        self.executor.submit(self._run, job_id, func, args)
+        return job_id
+
+    def _run(self, job_id, func, args):
+        """Run the job and record the result or error.
+
+        Args:
+            job_id: unique job ID
+            func: function called with `(job_id, *args)`
+            args: additional positional arguments for `func`
+
+        """
+        self.update(job_id, status='running')
+        try:
+            result = func(job_id, *args)
+        except Exception as error:
+            LOGGER.exception(f'Background job {job_id} failed')
+            self.update(job_id, status='failed', error=f'{error}')
+        else:
+            self.update(job_id, status='done', progress=1.0, result=None if result is None else f'{result}')
+
+    def update(self, job_id, **fields):
+        """Update the stored fields of the job, such as `progress`.
+
+        Args:
+            job_id: unique job ID
+            fields: column names and values to update
+
+        """
+        self.table.update({'job_id': job_id, 'updated': time.time(), **fields}, ['job_id'])
+
+    def find_active(self, username):
+        """Return the jobs for the user that are queued or running.
+
+        Args:
+            username: string username
+
+        Returns:
+            list: job rows
+
+        """
+        return [*self.table.find(username=username, status=[*self.active_statuses], order_by='created')]
+
+    def pop_finished(self, username):
+        """Return the finished jobs for the user that have not been returned before.
+
+        Args:
+            username: string username
+
+        Returns:
+            list: job rows
+
+        """
+        rows = [*self.table.find(username=username, status=['done', 'failed'], notified=False, order_by='created')]
+        for row in rows:
+            self.update(row['job_id'], notified=True)
+        return rows
+
+
 class UploadModule(ModuleBase):
     """Module for user data upload."""
 
@@ -73,13 +223,36 @@ class UploadModule(ModuleBase):
     id_upload_output = 'upload-output'
     """Unique name for the div to contain output of the parse-upload."""
 
-    all_ids = [id_upload, id_upload_output]
+    id_upload_progress = 'upload-progress'
+    """Unique name for the progress bar of the current upload."""
+
+    id_upload_interval = 'upload-interval'
+    """Unique name for the interval that polls the upload progress."""
+
+    all_ids = [id_upload, id_upload_output, id_upload_progress, id_upload_interval]
     """List of ids to register for this module."""
 
-    def __init__(self, *args, **kwargs):
-        """Initialize module."""  # noqa: DAR101
-        super().__init__(*args, **kwargs)
+    chunksize = 10000
+    """Number of rows parsed and inserted at a time when ingesting an upload."""
+
+    max_workers = 2
+    """Number of uploads that are parsed at the same time in the background."""
+
+    database = None
+    """DBConnect instance for the uploaded data. Set in `initialize_database()`."""
+
+    jobs = None
+    """JobRunner for the uploads. Set in `create_elements()`."""
+
+    def create_elements(self, ids):
+        """Open the database and start the job runner when the app is created rather than when the module is defined.
+
+        Args:
+            ids: `self._il` from base application
+
+        """
         self.initialize_database()
+        self.jobs = JobRunner(self.database, max_workers=self.max_workers)
 
     def initialize_database(self):
         """Create data members `self.database` and `self.user_table`."""
@@ -118,30 +291,88 @@ class UploadModule(ModuleBase):
         else:
             self.user_table.insert({'username': username, 'creation': now, 'last_loaded': now})
 
-    def upload_data(self, username, df_name, df_upload):
+    def insert_chunks(self, table_name, df_chunks, progress=None):
+        """Create a table and insert each dataframe chunk with `executemany` in a separate transaction.
+
+        The table has an auto-incrementing `id` like tables created by `dataset`. Columns that first appear in a later
+        chunk are added with `ALTER TABLE`. Each chunk is committed before `progress` is called, so that other
+        connections can read the job progress and other uploads can write between chunks
+
+        Args:
+            table_name: unique name of the table to create
+            df_chunks: iterable of pandas dataframes
+            progress: optional function called with the total number of rows inserted after each chunk
+
+        Returns:
+            int: number of rows inserted
+
+        Raises:
+            RuntimeError: if there were no dataframe chunks
+
+        """
+        columns = None
+        row_count = 0
+        for df_chunk in df_chunks:
+            df_chunk = df_chunk.rename(columns=str)
+            new_columns = [col for col in df_chunk.columns if col not in (columns or [])]
+            column_defs = [f'{quote_name(col)} {sql_type(df_chunk[col].dtype)}' for col in new_columns]
+            with self.database.transaction() as tx:
+                cursor = tx.executable.connection.cursor()
+                if columns is None:
+                    column_defs.insert(0, 'id INTEGER PRIMARY KEY AUTOINCREMENT')
+                    cursor.execute(f'CREATE TABLE {quote_name(table_name)} ({", ".join(column_defs)})')
+                    columns = []
+                else:
+                    for column_def in column_defs:
+                        cursor.execute(f'ALTER TABLE {quote_name(table_name)} ADD COLUMN {column_def}')
+                columns.extend(new_columns)
+
+                if len(df_chunk.columns):
+                    names = ', '.join(map(quote_name, df_chunk.columns))
+                    params = ', '.join('?' * len(df_chunk.columns))
+                    cursor.executemany(f'INSERT INTO {quote_name(table_name)} ({names}) VALUES ({params})',
+                                       df_to_rows(df_chunk))
+                    row_count += len(df_chunk)
+                cursor.close()
+            clear_count_cache(self.database.db, table_name)
+            if progress:
+                progress(row_count)
+        if columns is None:
+            raise RuntimeError(f'No data found for {table_name}')
+        return row_count
+
+    def upload_data(self, username, df_name, df_upload, progress=None):
         """Store dataframe in database for specified user.
 
         Args:
             username: string username
             df_name: name of the stored dataframe
-            df_upload: pandas dataframe to store
+            df_upload: pandas dataframe to store or an iterable of dataframe chunks from `iter_df_chunks()`
+            progress: optional function called with the total number of rows inserted after each chunk
+
+        Returns:
+            str: unique name of the new table
 
         """
         now = time.time()
         table_name = f'{username}-{df_name}-{int(now)}'
-        table = self.database.db.create_table(table_name)
+        df_chunks = [df_upload] if isinstance(df_upload, pd.DataFrame) else df_upload
         try:
-            table.insert_many(df_upload.to_dict(orient='records'))
+            self.insert_chunks(table_name, df_chunks, progress=progress)
         except Exception:
-            table.drop()  # Delete the table if upload fails
+            # Delete the table if upload fails
+            self.database.db.query(f'DROP TABLE IF EXISTS {quote_name(table_name)}')
             raise
 
         self.inventory_table.insert({'table_name': table_name, 'df_name': df_name, 'username': username,
                                     'creation': now})
+        return table_name
 
     def get_data(self, table_name):
         """Retrieve stored data for specified dataframe name.
 
+        The DataFrame is loaded from the database once and then returned from `DATAFRAME_CACHE`
+
         Args:
             table_name: unique name of the table to retrieve
 
@@ -149,8 +380,34 @@ class UploadModule(ModuleBase):
             pd.DataFrame: pandas dataframe retrieved from the database
 
         """
-        table = self.database.db.load_table(table_name)
-        return pd.DataFrame.from_records(table.all())
+        key = (self.name, table_name)
+        df_data = DATAFRAME_CACHE.get(key)
+        if df_data is None:
+            table = self.database.db.load_table(table_name)
+            df_data = pd.DataFrame.from_records(table.all(), columns=table.columns)
+            DATAFRAME_CACHE.put(key, df_data)
+        return df_data
+
+    def get_preview(self, table_name, max_rows=10, max_columns=10):
+        """Retrieve the first rows and columns of the stored data without loading the full table.
+
+        Args:
+            table_name: unique name of the table to retrieve
+            max_rows: maximum number of rows. Default is 10
+            max_columns: maximum number of columns. Default is 10
+
+        Returns:
+            pd.DataFrame: pandas dataframe with at most `max_rows` and `max_columns`
+
+        """
+        df_data = DATAFRAME_CACHE.get((self.name, table_name))
+        if df_data is not None:
+            return df_data.iloc[:max_rows, :max_columns]
+
+        columns = self.database.db.load_table(table_name).columns[:max_columns]
+        query = (f'SELECT {", ".join(map(quote_name, columns))} FROM {quote_name(table_name)} '
+                 f'LIMIT {int(max_rows)}')
+        return pd.DataFrame.from_records(self.database.db.query(query), columns=columns)
 
     def delete_data(self, table_name):
         """Remove specified data from the database.
@@ -159,7 +416,9 @@ class UploadModule(ModuleBase):
             table_name: unique name of the table to delete
 
         """
+        DATAFRAME_CACHE.pop((self.name, table_name))
         self.database.db.load_table(table_name).drop()
+        clear_count_cache(self.database.db, table_name)
 
     def return_layout(self, ids):
         """Return Dash application layout.
@@ -175,6 +434,8 @@ class UploadModule(ModuleBase):
             html.H2('File Upload'),
             html.P('Upload Tidy Data in CSV, Excel, or JSON format'),
             drop_to_upload(id=ids[self.get(self.id_upload)]),
+            dbc.Progress(value=0, striped=True, animated=True, id=ids[self.get(self.id_upload_progress)]),
+            dcc.Interval(interval=500, disabled=True, id=ids[self.get(self.id_upload_interval)]),
             dcc.Loading(html.Div('PLACEHOLDER', id=ids[self.get(self.id_upload_output)]), type='circle'),
         ])
 
@@ -198,13 +459,13 @@ class UploadModule(ModuleBase):
             dict: Dash HTML object
 
         """
-        def format_table(df_name, username, creation, raw_df):
+        def format_table(df_name, username, creation, df_preview):
             return [
                 html.H4(df_name),
                 html.P(f'Uploaded by "{username}" on {datetime.fromtimestamp(creation)}'),
                 dash_table.DataTable(
-                    data=raw_df[:10].to_dict('records'),
-                    columns=[{'name': i, 'id': i} for i in raw_df.columns[:10]],
+                    data=df_preview.to_dict('records'),
+                    columns=[{'name': i, 'id': i} for i in df_preview.columns],
                     style_cell={
                         'overflow': 'hidden',
                         'textOverflow': 'ellipsis',
@@ -217,45 +478,90 @@ class UploadModule(ModuleBase):
         children = [html.Hr()]
         rows = self.inventory_table.find(username=username)
         for row in sorted(rows, key=lambda _row: _row['creation'], reverse=True):
-            df_upload = self.get_data(row['table_name'])
-            children.extend(format_table(row['df_name'], row['username'], row['creation'], df_upload))
-        children.extend(
-            format_table('Default', 'N/A', time.time(), pd.DataFrame.from_records(self.default_table.all())))
+            df_preview = self.get_preview(row['table_name'])
+            children.extend(format_table(row['df_name'], row['username'], row['creation'], df_preview))
+        children.extend(format_table('Default', 'N/A', time.time(), self.get_preview(self.default_table.name)))
         return html.Div(children)
 
+    def ingest_upload(self, job_id, username, filename, b64_file):
+        """Decode, parse, and store an uploaded file. Run as a background job with `self.jobs`.
+
+        Args:
+            job_id: unique job ID used to report progress
+            username: string username
+            filename: filename of upload file. Name only
+            b64_file: file encoded in base64
+
+        Returns:
+            str: unique name of the new table
+
+        Raises:
+            RuntimeError: if the file could not be parsed
+
+        """
+        # Stream the decoded file into the database in chunks. Missing values are stored as NULL
+        content_type, buffer = decode_b64_file(b64_file)
+        total_bytes = max(buffer.seek(0, io.SEEK_END), 1)
+        buffer.seek(0)
+
+        def progress(row_count):
+            self.jobs.update(job_id, progress=buffer.tell() / total_bytes)
+
+        try:
+            return self.upload_data(username, filename, iter_df_chunks(buffer, filename, self.chunksize), progress)
+        except Exception as error:
+            raise RuntimeError(f'Could not parse {filename} ({content_type})\nError: {error}')
+
     def register_upload_handler(self, parent):
         """Register callbacks to handle user interaction.
 
+        New uploads are queued as background jobs so that the callback returns immediately. The interval then polls
+        the job progress and renders the uploaded data once all of the user's jobs have finished
+
         Args:
             parent: parent instance (ex: `self`)
 
         """
-        outputs = [(self.get(self.id_upload_output), 'children')]
-        inputs = [(self.get(self.id_upload), 'contents')]
-        states = [(self.get(self.id_upload), 'filename'), (self.get(self.id_upload), 'last_modified')]
+        outputs = [(self.get(self.id_upload_output), 'children'), (self.get(self.id_upload_interval), 'disabled'),
+                   (self.get(self.id_upload_progress), 'value'), (self.get(self.id_upload_progress), 'children')]
+        inputs = [(self.get(self.id_upload), 'contents'), (self.get(self.id_upload_interval), 'n_intervals')]
+        states = [(self.get(self.id_upload), 'filename')]
 
         @parent.callback(outputs, inputs, states)
         def upload_handler(*raw_args):
             a_in, a_state = map_args(raw_args, inputs, states)
             b64_file = a_in[self.get(self.id_upload)]['contents']
             filename = a_state[self.get(self.id_upload)]['filename']
-            timestamp = a_state[self.get(self.id_upload)]['last_modified']
             username = 'username'  # TODO: IMPLEMENT
 
-            child_output = []
-            try:
-                if b64_file is not None:
-                    df_upload = parse_uploaded_df(b64_file, filename, timestamp)
-                    df_upload = df_upload.dropna(axis='columns')  # FIXME: Need to better handle NaN values
-                    self.add_user(username)
-                    self.upload_data(username, filename, df_upload)
-
-            except Exception as error:
-                child_output.extend([
-                    show_toast(f'{error}', 'Upload Error', icon='danger'),
-                    dcc.Markdown(f'### Upload Error\n\n{type(error)}\n\n```\n{error}\n```'),
+            ctx = dash.callback_context
+            if b64_file is not None and ctx.triggered and ctx.triggered[0]['prop_id'].endswith('.contents'):
+                self.add_user(username)
+                self.jobs.submit(username, filename, self.ingest_upload, username, filename, b64_file)
+
+            active_jobs = self.jobs.find_active(username)
+            if active_jobs:
+                percent = int(100 * sum(job['progress'] for job in active_jobs) / len(active_jobs))
+                label = f'{len(active_jobs)} upload(s): {percent}%'
+                return map_outputs(outputs, [
+                    (self.get(self.id_upload_output), 'children', dash.no_update),
+                    (self.get(self.id_upload_interval), 'disabled', False),
+                    (self.get(self.id_upload_progress), 'value', percent),
+                    (self.get(self.id_upload_progress), 'children', label),
                 ])
 
+            child_output = []
+            for job in self.jobs.pop_finished(username):
+                if job['status'] == 'failed':
+                    error = job['error']
+                    child_output.extend([
+                        show_toast(f'{error}', 'Upload Error', icon='danger'),
+                        dcc.Markdown(f'### Upload Error ({job["description"]})\n\n```\n{error}\n```'),
+                    ])
             child_output.append(self.show_data(username))
-
-            return map_outputs(outputs, [(self.get(self.id_upload_output), 'children', html.Div(child_output))])
+            return map_outputs(outputs, [
+                (self.get(self.id_upload_output), 'children', html.Div(child_output)),
+                (self.get(self.id_upload_interval), 'disabled', True),
+                (self.get(self.id_upload_progress), 'value', 0),
+                (self.get(self.id_upload_progress), 'children', ''),
+            ])
@@ -0,0 +1,153 @@
+"""Benchmark loading a synthetic library summary into the Kitsu database.
+
+Compares the bulk loader in `create_kitsu_database()` against inserting the same entries with `dataset`. Example:
+
+`poetry run python scripts/bench_database.py --entries 50000`
+
+"""
+
+import argparse
+import copy
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import humps
+
+from kitsu_lib import analysis
+from kitsu_lib.analysis import (KITSU_SCHEMA, create_kitsu_database, create_kitsu_schema, create_kitsu_view,
+                                split_summary)
+from kitsu_lib.cache_helpers import DBConnect, iter_ndjson, write_ndjson
+from kitsu_lib.kitsu_helpers import chunked
+
+DATA_DIR = Path(__file__).resolve().parents[1] / 'tests' / 'Data'
+"""Directory with the recorded summary file."""
+
+HOSTS = ['amazon', 'crunchyroll', 'funimation', 'hidive', 'hulu', 'netflix', 'tubitv', 'vrv']
+"""Stream hosts assigned at random to each synthetic entry."""
+
+
+def synthesize_summary(entries, seed=0):
+    """Yield summary dictionaries with a random set of categories and stream hosts for each entry.
+
+    Args:
+        entries: number of summary dictionaries
+        seed: random seed so that each run loads the same data. Default is 0
+
+    Yields:
+        dict: summary dictionary in the format of `merge_anime_info()`
+
+    """
+    rng = random.Random(seed)
+    templates = json.loads((DATA_DIR / 'all_data.json').read_text())['data']
+    categories = sorted({cat for template in templates for cat in template['categories']})
+    categories += [f'category-{idx}' for idx in range(100)]
+    for idx in range(entries):
+        entry = copy.deepcopy(templates[idx % len(templates)])
+        for host in HOSTS:
+            entry.pop(host, None)
+        entry['id'] = str(idx)
+        entry['slug'] = f'{entry["slug"]}-{idx}'
+        entry['categories'] = rng.sample(categories, rng.randint(1, 12))
+        for host in rng.sample(HOSTS, rng.randint(0, 4)):
+            entry[host] = f'https://{host}.example.com/{entry["slug"]}'
+        yield entry
+
+
+def load_wide_table(summary_file_path, chunk_size):
+    """Load the summary into one wide table with `dataset` and a column for each category and host.
+
+    Args:
+        summary_file_path: path to the NDJSON summary file
+        chunk_size: number of entries to insert at a time
+
+    """
+    table = analysis.KITSU_DATA.db.create_table('kitsu', primary_id='slug',
+                                                primary_type=analysis.KITSU_DATA.db.types.text)
+    for chunk in chunked(iter_ndjson(summary_file_path), chunk_size):
+        for entry in chunk:
+            for category in entry.pop('categories'):
+                entry[humps.camelize(category)] = True
+        table.insert_many(chunk)
+
+
+def load_normalized_dataset(summary_file_path, chunk_size):
+    """Load the summary into the normalized tables with `dataset.insert_many()`.
+
+    Args:
+        summary_file_path: path to the NDJSON summary file
+        chunk_size: number of entries to insert at a time
+
+    """
+    db = analysis.KITSU_DATA.db
+    create_kitsu_schema(db)
+    for chunk in chunked(iter_ndjson(summary_file_path), chunk_size):
+        rows = {table: [] for table in KITSU_SCHEMA}
+        for entry in chunk:
+            for table, table_rows in split_summary(entry).items():
+                rows[table].extend(table_rows)
+        for table, table_rows in rows.items():
+            db[table].insert_many(table_rows)
+    create_kitsu_view(db)
+
+
+def load_bulk(summary_file_path, chunk_size):
+    """Load the summary with the bulk loader from `create_kitsu_database()`.
+
+    Args:
+        summary_file_path: path to the NDJSON summary file
+        chunk_size: number of entries to insert at a time
+
+    """
+    create_kitsu_database(summary_file_path, chunk_size=chunk_size)
+
+
+def time_load(loader, summary_file_path, chunk_size, tmp_dir):
+    """Run a loader against a new database.
+
+    Args:
+        loader: function that accepts the summary file path and chunk size
+        summary_file_path: path to the NDJSON summary file
+        chunk_size: number of entries to insert at a time
+        tmp_dir: directory for the database file
+
+    Returns:
+        tuple: `(elapsed_seconds, row_count_of_kitsu)`
+
+    """
+    analysis.KITSU_DATA = DBConnect(Path(tmp_dir) / f'{loader.__name__}.db')
+    start = time.perf_counter()
+    loader(summary_file_path, chunk_size)
+    elapsed = time.perf_counter() - start
+    return elapsed, analysis.KITSU_DATA.db.query('SELECT COUNT(*) AS count FROM kitsu').next()['count']
+
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, default=50000, help='number of synthetic library entries')
+    parser.add_argument('--chunk-size', type=int, default=500, help='number of entries inserted at a time')
+    parser.add_argument('--skip-wide', action='store_true', help='skip the slow wide table load')
+    args = parser.parse_args()
+
+    loaders = [load_normalized_dataset, load_bulk]
+    if not args.skip_wide:
+        loaders.insert(0, load_wide_table)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        summary_file_path = Path(tmp_dir) / 'all_data.ndjson'
+        write_ndjson(summary_file_path, synthesize_summary(args.entries))
+        results = [(loader.__name__, *time_load(loader, summary_file_path, args.chunk_size, tmp_dir))
+                   for loader in loaders]
+
+    bulk_time = results[-1][1]
+    for label, elapsed, count in results:
+        if count != args.entries:
+            raise RuntimeError(f'Expected {args.entries} rows from {label}, but found {count}')
+        print(f'{label:>24}: {elapsed:7.2f} s ({args.entries / elapsed:9.1f} entries/s, '  # noqa: T001
+              f'{elapsed / bulk_time:5.2f}x the bulk load time)')
+
+
+if __name__ == '__main__':
+    main()
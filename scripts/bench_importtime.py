@@ -0,0 +1,115 @@
+"""Benchmark the start up time of the scraper and the dashboard with `python -X importtime`.
+
+Each module is imported in a new interpreter several times and the median cumulative import time is compared against
+a budget. The scraper must also not import the packages that are only needed by the dashboard. Example:
+
+`poetry run python scripts/bench_importtime.py --repeat 7`
+
+Exits with a non-zero status if a budget is exceeded so that the script can be used as a regression check in CI.
+
+"""
+
+import argparse
+import statistics
+import subprocess  # noqa: S404
+import sys
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).resolve().parents[1]
+"""Directory with the kitsu_lib package."""
+
+BUDGETS = {
+    'kitsu_lib.scraper': 800,
+    'kitsu_lib.app': 4000,
+}
+"""Maximum median cumulative import time in milliseconds for each module."""
+
+FORBIDDEN = {
+    'kitsu_lib.scraper': ('dash', 'icecream', 'numpy', 'pandas', 'plotly', 'pyarrow'),
+}
+"""Top-level packages that must not be imported by each module."""
+
+
+def parse_importtime(stderr):
+    """Parse the output of `python -X importtime` into the cumulative time of each imported module.
+
+    Args:
+        stderr: standard error output from the interpreter
+
+    Returns:
+        dict: module name to `(depth, cumulative_us)` with the depth of the nested import (0 for the top level)
+
+    """
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _self_us, cumulative_us, raw_name = line[len('import time:'):].split('|')
+        name = raw_name.strip()
+        timings[name] = ((len(raw_name) - len(raw_name.lstrip()) - 1) // 2, int(cumulative_us))
+    return timings
+
+
+def measure_import(module, repeat):
+    """Import the module in a new interpreter `repeat` times.
+
+    Args:
+        module: dotted module name
+        repeat: number of interpreters to start
+
+    Returns:
+        tuple: `(median_ms, timings)` with the timings from the last run from `parse_importtime()`
+
+    Raises:
+        RuntimeError: if the module could not be imported
+
+    """
+    totals = []
+    for _idx in range(repeat):
+        result = subprocess.run(  # noqa: S603
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            capture_output=True, text=True, cwd=PROJECT_DIR,
+        )
+        if result.returncode != 0:
+            raise RuntimeError(f'Failed to import {module}:\n{result.stderr.splitlines()[-1]}')
+        timings = parse_importtime(result.stderr)
+        totals.append(timings[module][1] / 1000)
+    return statistics.median(totals), timings
+
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=5, help='number of interpreters started for each module')
+    parser.add_argument('--top', type=int, default=8, help='number of the slowest direct imports to list')
+    parser.add_argument('--modules', nargs='+', default=[*BUDGETS], help='modules to import')
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        try:
+            median_ms, timings = measure_import(module, args.repeat)
+        except RuntimeError as error:
+            print(f'{module:>18}: skipped. {error}')  # noqa: T001
+            continue
+        budget_ms = BUDGETS.get(module)
+        status = 'ok' if budget_ms is None or median_ms <= budget_ms else 'OVER BUDGET'
+        print(f'{module:>18}: {median_ms:7.1f} ms (budget: {budget_ms} ms) {status}')  # noqa: T001
+        slowest = sorted(((cumulative, name) for name, (depth, cumulative) in timings.items() if depth == 1),
+                         reverse=True)
+        for cumulative, name in slowest[:args.top]:
+            print(f'{"":>20}{cumulative / 1000:7.1f} ms  {name}')  # noqa: T001
+
+        imported = {name.split('.')[0] for name in timings}
+        forbidden = sorted(imported.intersection(FORBIDDEN.get(module, ())))
+        if forbidden:
+            failures.append(f'{module} imports {", ".join(forbidden)}')
+        if status != 'ok':
+            failures.append(f'{module} took {median_ms:.1f} ms, which exceeds the budget of {budget_ms} ms')
+
+    if failures:
+        sys.exit('\n'.join(failures))
+
+
+if __name__ == '__main__':
+    main()
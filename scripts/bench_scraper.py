@@ -0,0 +1,266 @@
+"""Benchmark the library scraper against a local stub server that replays recorded Kitsu API responses.
+
+Compares entries per second for the serial loop against the concurrent, pipelined, and batched scrapers. Set
+`--titles` below `--entries` to check that library entries for the same anime share one request. Example:
+
+`poetry run python scripts/bench_scraper.py --entries 200 --titles 50 --latency 0.05 --workers 8`
+
+"""
+
+import argparse
+import copy
+import json
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from kitsu_lib import api_helpers, cache_helpers
+from kitsu_lib.scraper import scrape_library
+
+DATA_DIR = Path(__file__).resolve().parents[1] / 'tests' / 'Data'
+"""Directory with the recorded Kitsu API responses."""
+
+RECORDED_URL = 'https://kitsu.io/api/edge'
+"""Base URL found in the recorded responses that is replaced with the stub server URL."""
+
+PAGE_SIZE = 10
+"""Number of library entries returned per page (matches the Kitsu API default)."""
+
+
+def load_recorded(name, base_url):
+    """Load a recorded response with all Kitsu URLs pointed at the stub server.
+
+    Args:
+        name: stem of the JSON file in `DATA_DIR`
+        base_url: base URL of the stub server
+
+    Returns:
+        dict: recorded response
+
+    """
+    return json.loads((DATA_DIR / f'{name}.json').read_text().replace(RECORDED_URL, base_url))
+
+
+class RecordedKitsu:
+    """Synthesize a library of arbitrary size from the recorded responses."""
+
+    def __init__(self, base_url, entries, titles=None):
+        """Load the recorded responses.
+
+        Args:
+            base_url: base URL of the stub server
+            entries: number of entries in the synthetic library
+            titles: optional number of unique anime shared by the entries. Default is None for one per entry
+
+        """
+        self.base_url = base_url
+        self.entries = entries
+        self.titles = titles or entries
+        self.user = load_recorded('user', base_url)
+        self.lib_entry = load_recorded('lib_entry', base_url)['data'][0]
+        self.anime = load_recorded('anime', base_url)
+        self.streams = load_recorded('streams', base_url)
+        self.routes = [
+            (re.compile(r'^/users$'), self.get_user),
+            (re.compile(r'^/users/\d+/library-entries$'), self.get_library_page),
+            (re.compile(r'^/library-entries/(\d+)/anime$'), self.get_entry_anime),
+            (re.compile(r'^/anime/(\d+)$'), self.get_anime),
+            (re.compile(r'^/anime/(\d+)/streaming-links$'), self.get_streams),
+        ]
+
+    def get_user(self, query):
+        """Return the recorded user response."""  # noqa: DAR101,DAR201
+        return self.user
+
+    def get_library_page(self, query):
+        """Return a page of synthetic library entries based on the `page[offset]` query argument.
+
+        If the `include` query argument has the streams, the anime, categories, and streams are included in the
+        response. Otherwise, only the ID and slug of each anime are included
+
+        Args:
+            query: parsed query dictionary from `parse_qs`
+
+        Returns:
+            dict: library page
+
+        """
+        offset = int(query.get('page[offset]', ['0'])[0])
+        page_size = int(query.get('page[limit]', [str(PAGE_SIZE)])[0])
+        is_batch = 'streamingLinks' in query.get('include', [''])[0]
+        data = []
+        included = {}
+        for idx in range(offset, min(offset + page_size, self.entries)):
+            entry = copy.deepcopy(self.lib_entry)
+            entry['id'] = str(idx)
+            entry['relationships']['anime']['links']['related'] = f'{self.base_url}/library-entries/{idx}/anime'
+            anime_id = str(idx % self.titles)
+            if 'include' in query and not is_batch:
+                entry['relationships']['anime']['data'] = {'type': 'anime', 'id': anime_id}
+                included[('anime', anime_id)] = {'type': 'anime', 'id': anime_id, 'attributes': {'slug': anime_id}}
+            elif is_batch:
+                anime = self.get_anime(query, anime_id)
+                relationships = anime['data']['relationships']
+                relationships['categories']['data'] = [
+                    {'type': _r['type'], 'id': _r['id']} for _r in anime['included']]
+                relationships['streamingLinks']['data'] = [
+                    {'type': _r['type'], 'id': _r['id']} for _r in self.streams['data']]
+                entry['relationships']['anime']['data'] = {'type': 'anime', 'id': anime_id}
+                for resource in [anime['data'], *anime['included'], *self.streams['data']]:
+                    included[(resource['type'], resource['id'])] = resource
+            data.append(entry)
+
+        user_id = self.user['data'][0]['id']
+        url = f'{self.base_url}/users/{user_id}/library-entries?filter[kind]=anime&page[limit]={page_size}'
+        if 'include' in query:
+            url += ''.join(f'&{key}={values[0]}' for key, values in query.items()
+                           if not key.startswith(('page', 'filter')))
+        links = {'first': f'{url}&page[offset]=0'}
+        if offset + page_size < self.entries:
+            links['next'] = f'{url}&page[offset]={offset + page_size}'
+        page = {'data': data, 'meta': {'count': self.entries}, 'links': links}
+        if included:
+            page['included'] = [*included.values()]
+        return page
+
+    def get_entry_anime(self, query, idx):
+        """Return the anime of a library entry."""  # noqa: DAR101,DAR201
+        return self.get_anime(query, str(int(idx) % self.titles))
+
+    def get_anime(self, query, idx):
+        """Return the recorded anime with a unique slug and streaming link."""  # noqa: DAR101,DAR201
+        anime = copy.deepcopy(self.anime)
+        anime['data']['id'] = idx
+        anime['data']['attributes']['slug'] += f'-{idx}'
+        streaming_links = anime['data']['relationships']['streamingLinks']['links']
+        streaming_links['related'] = f'{self.base_url}/anime/{idx}/streaming-links'
+        return anime
+
+    def get_streams(self, query, idx):
+        """Return the recorded streams."""  # noqa: DAR101,DAR201
+        return self.streams
+
+    def route(self, path, query):
+        """Return the response for the requested path or None if not found.
+
+        Args:
+            path: URL path relative to the API base
+            query: parsed query dictionary from `parse_qs`
+
+        Returns:
+            dict: response or None
+
+        """
+        for pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match:
+                return handler(query, *match.groups())
+        return None
+
+
+def start_stub_server(entries, latency, titles=None):
+    """Start a threaded HTTP server in the background that replays recorded responses.
+
+    Args:
+        entries: number of entries in the synthetic library
+        latency: seconds of artificial round trip latency per response
+        titles: optional number of unique anime shared by the entries. Default is None for one per entry
+
+    Returns:
+        tuple: `(server, base_url)`
+
+    """
+    class Handler(BaseHTTPRequestHandler):
+        """Reply to each GET request with the matching recorded response after a delay."""
+
+        def do_GET(self):  # noqa: N802
+            """Handle GET request."""
+            time.sleep(latency)
+            parsed = urlparse(self.path)
+            resp = recorded.route(parsed.path, parse_qs(parsed.query))
+            body = json.dumps(resp).encode('utf-8')
+            self.send_response(404 if resp is None else 200)
+            self.send_header('Content-Type', 'application/vnd.api+json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """Silence the default request logging."""  # noqa: DAR101
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    recorded = RecordedKitsu(base_url, entries, titles)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+def time_scrape(workers, prefetch_pages, batch=False):
+    """Scrape the stub library into an empty temporary cache.
+
+    Args:
+        workers: number of threads passed to `scrape_library()`
+        prefetch_pages: number of library pages to request ahead passed to `scrape_library()`
+        batch: if True, use the batched library requests. Default is False
+
+    Returns:
+        tuple: `(all_data, elapsed_seconds, connection_stats)`
+
+    """
+    api_helpers.KITSU_SESSION.close()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache_helpers.CACHE_DIR = Path(tmp_dir)
+        cache_helpers.FILE_DATA = cache_helpers.DBConnect(Path(tmp_dir) / '_file_lookup_database.db')
+        cache_helpers.initialize_cache()
+        user_id = api_helpers.get_user_id('bench')
+
+        start = time.perf_counter()
+        all_data = scrape_library(user_id, workers=workers, prefetch_pages=prefetch_pages, batch=batch)
+        return all_data, time.perf_counter() - start, api_helpers.KITSU_SESSION.stats()
+
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, default=200, help='number of library entries')
+    parser.add_argument('--titles', type=int, help='number of unique anime (default: one per entry)')
+    parser.add_argument('--latency', type=float, default=0.05, help='artificial latency per response (s)')
+    parser.add_argument('--workers', type=int, default=8, help='number of workers for the concurrent scraper')
+    parser.add_argument('--rate', type=float, default=1000, help='token bucket rate (requests per second)')
+    parser.add_argument('--prefetch', type=int, default=2, help='number of library pages to prefetch')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.entries, args.latency, args.titles)
+    api_helpers.KITSU_API_URL = base_url
+    api_helpers.RATE_LIMITER = api_helpers.TokenBucket(rate=args.rate, capacity=args.workers)
+    api_helpers.KITSU_SESSION = api_helpers.SessionConnect(pool_size=args.workers + 1)
+    modes = [
+        ('serial', 1, 0, False),
+        (f'prefetch={args.prefetch}', 1, args.prefetch, False),
+        (f'workers={args.workers}', args.workers, 0, False),
+        (f'workers={args.workers},prefetch={args.prefetch}', args.workers, args.prefetch, False),
+        ('batch', 1, 0, True),
+        (f'batch,prefetch={args.prefetch}', 1, args.prefetch, True),
+    ]
+    results = []
+    try:
+        for label, workers, prefetch_pages, batch in modes:
+            results.append((label, *time_scrape(workers=workers, prefetch_pages=prefetch_pages, batch=batch)))
+    finally:
+        server.shutdown()
+
+    serial_data, serial_time = results[0][1:3]
+    for label, all_data, elapsed, stats in results:
+        if all_data != serial_data:
+            raise RuntimeError(f'Output from the {label} scraper does not match the serial scraper')
+        print(f'{label:>22}: {elapsed:7.2f} s ({args.entries / elapsed:8.1f} entries/s, '  # noqa: T001
+              f'{serial_time / elapsed:5.2f}x) {stats["requests"]:5} requests over '
+              f'{stats["connections"]:3} connections')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Micro-benchmarks for classifying stream hosts and summarizing the streams of each library entry.
+
+Compares `classify_stream_host()` against parsing each URL with `furl` and times `summarize_streams()` with and without
+eagerly formatting the streams response with `ic.format()`. Example:
+
+`poetry run python scripts/bench_streams.py --number 2000`
+
+"""
+
+import argparse
+import json
+import timeit
+from pathlib import Path
+
+from furl import furl
+from icecream import ic
+
+from kitsu_lib.analysis import classify_stream_host, filter_stream_urls, summarize_streams
+
+DATA_DIR = Path(__file__).resolve().parents[1] / 'tests' / 'Data'
+"""Directory with the recorded Kitsu API responses."""
+
+STREAM_URLS = [
+    'http://a.co/d/9hJEmKC',
+    'https://www.netflix.com/title/80113701',
+    'https://www.hidive.com/stream/cowboy-bebop',
+]
+"""Additional URLs for the known and fallback cases that are not in the recorded streams response."""
+
+
+def classify_with_furl(stream_url):
+    """Return the host key with the previous `furl` implementation."""  # noqa: DAR101,DAR201
+    if 'a.co/' in stream_url:
+        return 'amazon'
+    return furl(stream_url).asdict()['host'].split('.')[-2]
+
+
+def summarize_eager(streams):
+    """Format the streams response on every call like the previous `summarize_streams()`."""  # noqa: DAR101,DAR201
+    ic.format(streams)
+    return summarize_streams(streams)
+
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=2000, help='number of calls for each benchmark')
+    args = parser.parse_args()
+
+    streams = json.loads((DATA_DIR / 'streams.json').read_text())
+    stream_urls = filter_stream_urls(streams) + STREAM_URLS
+    if [*map(classify_stream_host, stream_urls)] != [*map(classify_with_furl, stream_urls)]:
+        raise RuntimeError('classify_stream_host() does not match the furl implementation')
+
+    benchmarks = [
+        ('furl host', lambda: [*map(classify_with_furl, stream_urls)], len(stream_urls)),
+        ('classify_stream_host', lambda: [*map(classify_stream_host, stream_urls)], len(stream_urls)),
+        ('summarize (eager ic)', lambda: summarize_eager(streams), 1),
+        ('summarize_streams', lambda: summarize_streams(streams), 1),
+    ]
+    for label, func, calls in benchmarks:
+        elapsed = min(timeit.repeat(func, number=args.number, repeat=3))
+        print(f'{label:>22}: {elapsed / args.number / calls * 1e6:9.2f} us per call')  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Report the size of the cached Kitsu API responses in `local_cache` by prefix and optionally evict responses.
+
+Example: `poetry run python scripts/cache_report.py --max-mb 200 --policy lfu`
+
+"""
+
+import argparse
+import time
+
+from kitsu_lib.cache_helpers import CACHE_MANAGER, EVICTION_ORDER, initialize_cache
+
+
+def main():
+    """Run the report from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--max-mb', type=float, help='evict responses until the cache is at most this many megabytes')
+    parser.add_argument('--max-entries', type=int, help='evict responses until at most this many are cached')
+    parser.add_argument('--policy', choices=[*EVICTION_ORDER], default='lru', help='eviction policy')
+    args = parser.parse_args()
+
+    initialize_cache()
+    CACHE_MANAGER.max_bytes = None if args.max_mb is None else int(args.max_mb * 1024 ** 2)
+    CACHE_MANAGER.max_entries = args.max_entries
+    CACHE_MANAGER.policy = args.policy
+    evicted = CACHE_MANAGER.evict()
+
+    now = time.time()
+    print(f'{"prefix":<14}{"entries":>9}{"MB":>10}{"hits":>9}{"last used (h)":>15}')  # noqa: T001
+    for row in CACHE_MANAGER.usage():
+        age = (now - row['last_accessed']) / 3600 if row['last_accessed'] else float('nan')
+        print(f'{row["prefix"] or "-":<14}{row["entries"]:>9,}{row["bytes"] / 1024 ** 2:>10.2f}'  # noqa: T001
+              f'{row["hits"]:>9,}{age:>15.1f}')
+    if evicted:
+        evicted_mb = CACHE_MANAGER.stats['evicted_bytes'] / 1024 ** 2
+        print(f'Evicted {len(evicted):,} responses ({evicted_mb:.2f} MB)')  # noqa: T001
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,18 @@
+"""Convert the cached Kitsu API responses in `local_cache` to a different storage format.
+
+Example: `poetry run python scripts/migrate_cache.py gzip`
+
+"""
+
+import argparse
+
+from kitsu_lib.cache_helpers import STORE_TYPES, migrate_cache
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('store', choices=[*STORE_TYPES], help='name of the storage format to convert to')
+    args = parser.parse_args()
+
+    summary = migrate_cache(STORE_TYPES[args.store]())
+    print(f"Converted {summary['files']} files. Total size {summary['bytes_before']:,} "  # noqa: T001
+          f"-> {summary['bytes_after']:,} bytes")
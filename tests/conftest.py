@@ -1,3 +1,31 @@
 """PyTest configuration."""
 
+import pytest
 from dash_dev.conftest import pytest_configure  # noqa: F401
+from kitsu_lib import api_helpers, cache_helpers
+
+from .configuration import TEMP_DIR
+
+
+@pytest.fixture()
+def temp_cache(monkeypatch):
+    """Point the response cache at an empty temporary directory.
+
+    Args:
+        monkeypatch: pytest fixture
+
+    Returns:
+        Path: temporary cache directory
+
+    """
+    cache_dir = TEMP_DIR / 'local_cache'
+    if cache_dir.is_dir():
+        for path in cache_dir.glob('*'):
+            path.unlink()
+    monkeypatch.setattr(cache_helpers, 'CACHE_DIR', cache_dir)
+    monkeypatch.setattr(cache_helpers, 'FILE_DATA', cache_helpers.DBConnect(cache_dir / '_file_lookup_database.db'))
+    for module in (cache_helpers, api_helpers):
+        monkeypatch.setattr(module, 'CACHE_MANAGER', cache_helpers.CacheManager())
+    cache_helpers.URL_CACHE.clear()
+    cache_helpers.initialize_cache()
+    return cache_dir
@@ -1,11 +1,19 @@
 """Test the analysis.py file."""
 
+import copy
 import json
 
-from kitsu_lib.analysis import (create_kitsu_database, filter_stream_urls, merge_anime_info, parse_categories,
-                                summarize_streams)
+import humps
+import icecream
+import pandas as pd
+import pytest
+from kitsu_lib import analysis
+from kitsu_lib.analysis import (DATETIME_KEYS, KITSU_SCHEMA, classify_stream_host, create_kitsu_database,
+                                filter_stream_urls, load_sync_state, merge_anime_info, merge_library_frame,
+                                parse_categories, summarize_streams, update_kitsu_database)
+from kitsu_lib.cache_helpers import DBConnect, write_ndjson
 
-from .configuration import TEST_DATA_DIR
+from .configuration import TEMP_DIR, TEST_DATA_DIR
 
 # FYI: ^ Will rework functions in this file. Expect these to change
 
@@ -52,6 +60,32 @@ def test_summarize_streams():
     assert summary == expected_summary
 
 
+@pytest.mark.parametrize(('stream_url', 'key'), [
+    ('http://a.co/d/9hJEmKC', 'amazon'),
+    ('https://www.amazon.com/gp/video/detail/B06VW8K7ZJ/', 'amazon'),
+    ('http://www.crunchyroll.com/cowboy-bebop', 'crunchyroll'),
+    ('https://WWW.Funimation.com/shows/43625', 'funimation'),
+    ('https://www.netflix.com/title/80113701', 'netflix'),
+    ('http://tubitv.com/series/2052/cowboy_bebop', 'tubitv'),
+    ('https://www.hidive.com:443/stream/cowboy-bebop', 'hidive'),
+    ('ftp://user@files.example.org/anime', 'example'),
+])
+def test_classify_stream_host(stream_url, key):
+    """Test that known providers and other hosts are classified by the second level domain name."""
+    result = classify_stream_host(stream_url)  # act
+
+    assert result == key
+
+
+def test_summarize_streams_lazy_format(monkeypatch):
+    """Test that the streams response is only formatted when there is a collision to log."""
+    def fail_format(obj):
+        raise AssertionError('ic.format() should not be called')
+    monkeypatch.setattr(icecream.ic, 'format', fail_format)
+
+    summarize_streams(STREAMS)  # act
+
+
 def test_parse_categories():
     """Test_parse_categories."""
     expected_categories = [
@@ -136,6 +170,36 @@ def test_merge_anime_info():
     assert data == expected_data
 
 
+def test_merge_library_frame():
+    """Test that the columns of the merged DataFrame match the summary dictionaries from merge_anime_info."""
+    second_entry = copy.deepcopy(LIB_ENTRY['data'][0])
+    second_entry['id'] = '1'
+    second_anime = copy.deepcopy(ANIME)
+    second_anime['included'] = second_anime['included'][:1]
+    batch = [(LIB_ENTRY['data'][0], ANIME, STREAMS), (second_entry, second_anime, {'data': []})]
+
+    frame = merge_library_frame(batch)  # act
+
+    assert frame.attrs['categories'] == [humps.camelize(category) for category in parse_categories(ANIME)]
+    for row, args in zip(frame.to_dict(orient='records'), batch):
+        expected = merge_anime_info(*args)
+        categories = {humps.camelize(category) for category in expected.pop('categories')}
+        expected['averageRating'] = float(expected['averageRating'])
+        for key in DATETIME_KEYS:
+            expected[key] = pd.to_datetime(expected[key], utc=True) if expected[key] else None
+        assert {key: None if row[key] is pd.NA or row[key] is pd.NaT else row[key] for key in expected} == expected
+        assert {key for key in frame.attrs['categories'] if row[key]} == categories
+    assert frame['progress'].dtype == 'Int64'
+    assert frame['private'].dtype == 'boolean'
+    assert frame['averageRating'].dtype == float
+    assert frame['ratingTwenty'].isna().all()
+    for key in DATETIME_KEYS:
+        assert isinstance(frame[key].dtype, pd.DatetimeTZDtype)
+    assert frame['space'].dtype == pd.SparseDtype(bool, False)
+    assert frame['canonicalTitle'].dtype == object
+    assert merge_library_frame([]).empty
+
+
 def test_create_kitsu_database():
     """Test_create_kitsu_database."""
     summary_file_path = TEST_DATA_DIR / 'all_data.json'
@@ -144,3 +208,60 @@ def test_create_kitsu_database():
 
     # TODO: test database created from summary file!
     # WIP: assert db.get_table('anime').distinct('something') == ['vash', 'cowboy']
+
+
+def test_create_kitsu_database_ndjson(monkeypatch):
+    """Test that the Kitsu database can be loaded in chunks from a NDJSON summary file."""
+    monkeypatch.setattr(analysis, 'KITSU_DATA', DBConnect(TEMP_DIR / 'test_create_kitsu_database_ndjson.db'))
+    entries = json.loads((TEST_DATA_DIR / 'all_data.json').read_text())['data']
+    summary_file_path = TEMP_DIR / 'all_data.ndjson'
+    write_ndjson(summary_file_path, iter(entries))
+
+    create_kitsu_database(summary_file_path, chunk_size=1)  # act
+
+    table = analysis.KITSU_DATA.db['kitsu']
+    assert sorted(table.distinct('slug'), key=lambda row: row['slug']) == [{'slug': 'cowboy-bebop'}, {'slug': 'trigun'}]
+    assert analysis.KITSU_DATA.db.query('PRAGMA journal_mode').next()['journal_mode'] == 'wal'
+
+
+def test_update_kitsu_database(monkeypatch):
+    """Test that only the changed and removed entries are updated in the Kitsu database."""
+    database_path = TEMP_DIR / 'test_update_kitsu_database.db'
+    if database_path.is_file():
+        database_path.unlink()
+    monkeypatch.setattr(analysis, 'KITSU_DATA', DBConnect(database_path))
+    entries = json.loads((TEST_DATA_DIR / 'all_data.json').read_text())['data']
+    update_kitsu_database(copy.deepcopy(entries))
+    changed_entry = copy.deepcopy(entries[0])
+    changed_entry['updatedAt'] = '2021-01-01T00:00:00.000Z'
+    changed_entry['categories'] = ['space']
+
+    update_kitsu_database([changed_entry], removed_ids=[entries[1]['id']])  # act
+
+    assert load_sync_state() == {entries[0]['id']: ('2021-01-01T00:00:00.000Z', entries[0]['progressedAt'])}
+    row = analysis.KITSU_DATA.db['kitsu'].find_one(id=entries[0]['id'])
+    assert row['space'] == 1
+    assert row.get('drama') is None
+    assert row['crunchyroll'] == entries[0]['crunchyroll']
+
+
+def test_kitsu_schema(monkeypatch):
+    """Test that the summary is split into the normalized tables and joined back into the wide `kitsu` view."""
+    database_path = TEMP_DIR / 'test_kitsu_schema.db'
+    if database_path.is_file():
+        database_path.unlink()
+    monkeypatch.setattr(analysis, 'KITSU_DATA', DBConnect(database_path))
+    entry = merge_anime_info(LIB_ENTRY['data'][0], ANIME, STREAMS)
+    update_kitsu_database([copy.deepcopy(entry)])
+
+    db = analysis.KITSU_DATA.db
+    row = db['kitsu'].find_one(slug=entry['slug'])  # act
+
+    assert {*db.tables} == set(KITSU_SCHEMA)
+    assert len(db['anime_category']) == len(entry['categories'])
+    assert [row['host'] for row in db['anime_stream'].all()] == [*summarize_streams(STREAMS)]
+    categories = entry.pop('categories')
+    assert {key: row[key] for key in entry} == entry
+    assert all(row[humps.camelize(category)] == 1 for category in categories)
+    plan = db.query("EXPLAIN QUERY PLAN SELECT slug FROM anime_category WHERE category = 'space'")
+    assert 'ix_anime_category_category' in ' '.join(row['detail'] for row in plan)
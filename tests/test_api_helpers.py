@@ -1,7 +1,178 @@
 """Test the api_helpers.py file."""
 
-from kitsu_lib.api_helpers import (get_anime, get_data, get_kitsu, get_library, get_streams, get_user, get_user_id,
-                                   selective_request)
+import copy
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from kitsu_lib import api_helpers, cache_helpers
+from kitsu_lib.analysis import merge_anime_info
+from kitsu_lib.api_helpers import (BATCH_FIELDS, InFlightRequests, SessionConnect, TokenBucket, entry_anime_link,
+                                   get_anime, get_data, get_kitsu, get_library, get_streams, get_user, get_user_id,
+                                   selective_request, split_library_page)
+from kitsu_lib.cache_helpers import match_url_in_cache
+
+from .configuration import TEST_DATA_DIR
+
+LIB_ENTRY = json.loads((TEST_DATA_DIR / 'lib_entry.json').read_text())
+"""Example lib_entry response."""
+
+STREAMS = json.loads((TEST_DATA_DIR / 'streams.json').read_text())
+"""Example streams response."""
+
+ANIME = json.loads((TEST_DATA_DIR / 'anime.json').read_text())
+"""Example anime response."""
+
+
+def link(resource):
+    """Return the JSON API resource linkage for a resource."""  # noqa: DAR101,DAR201
+    return {'type': resource['type'], 'id': resource['id']}
+
+
+def test_token_bucket():
+    """Check that the token bucket allows an initial burst and then limits the request rate."""
+    bucket = TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+
+    for _idx in range(5):
+        bucket.acquire()  # act
+
+    # The first two tokens are available immediately, then one token every 20ms
+    assert time.monotonic() - start >= 0.9 * 3 / 50
+
+
+def test_session_connect():
+    """Check the pool size, retries, and compression headers of the shared session."""
+    connect = SessionConnect(pool_size=4, retries=2)
+
+    session = connect.session  # act
+
+    adapter = session.get_adapter('https://kitsu.io/api/edge')
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 2
+    assert 429 in adapter.max_retries.status_forcelist
+    assert 'gzip' in session.headers['accept-encoding']
+    assert connect.session is session
+    assert connect.stats() == {'connections': 0, 'requests': 0}
+    connect.close()
+
+
+def test_selective_request_revalidation(temp_cache, monkeypatch):
+    """Check that stale responses are revalidated with the stored ETag and replaced only if modified."""
+    url = 'https://kitsu.io/api/edge/users/1/library-entries'
+    requests = []
+
+    def fake_conditional_get(url, validators=None, **kwargs):
+        requests.append(validators and validators['etag'])
+        if validators and validators['etag'] == 'v2':
+            return None, {'etag': 'v2', 'last_modified': None}
+        return {'data': [len(requests)]}, {'etag': f'v{len(requests)}', 'last_modified': None}
+    monkeypatch.setattr(api_helpers, 'conditional_get', fake_conditional_get)
+    monkeypatch.setitem(cache_helpers.CACHE_TTL, 'library', -1)  # Always stale
+
+    responses = [selective_request('library', url) for _idx in range(3)]  # act
+
+    assert requests == [None, 'v1', 'v2']
+    assert responses == [{'data': [1]}, {'data': [2]}, {'data': [2]}]
+    assert match_url_in_cache(url)[0]['etag'] == 'v2'
+
+
+def test_selective_request_missing_file(temp_cache, monkeypatch):
+    """Check that a response is requested again if the cached file was deleted before the cache was reconciled."""
+    url = 'https://kitsu.io/api/edge/anime/1'
+    monkeypatch.setattr(api_helpers, 'conditional_get', lambda url, **kwargs: ({'data': [1]}, {}))
+    selective_request('anime', url)
+    Path(match_url_in_cache(url)[0]['filename']).unlink()
+
+    result = selective_request('anime', url)  # act
+
+    assert result == {'data': [1]}
+    assert Path(match_url_in_cache(url)[0]['filename']).is_file()
+
+
+def test_in_flight_requests():
+    """Check that concurrent calls for the same key share one call and its exception."""
+    in_flight = InFlightRequests()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return {'data': len(calls)}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first = executor.submit(in_flight.run, 'key', slow_call)
+        started.wait(timeout=5)
+        others = [executor.submit(in_flight.run, 'key', slow_call) for _idx in range(3)]
+        while in_flight.shared < 3:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in [first, *others]]  # act
+
+    assert calls == [1]
+    assert results == [{'data': 1}] * 4
+    assert results[0] is results[-1]
+    with pytest.raises(ZeroDivisionError):
+        in_flight.run('key', lambda: 1 / 0)
+    assert in_flight.run('key', lambda: 'new call') == 'new call'
+
+
+def test_selective_request_dedup(temp_cache, monkeypatch):
+    """Check that equivalent URLs requested by concurrent workers are fetched and stored once."""
+    requests = []
+
+    def fake_conditional_get(url, **kwargs):
+        requests.append(url)
+        time.sleep(0.05)
+        return {'data': [url]}, {}
+    monkeypatch.setattr(api_helpers, 'conditional_get', fake_conditional_get)
+    urls = ['https://kitsu.io/api/edge/anime/1?include=categories&fields[anime]=slug',
+            'https://kitsu.io/api/edge/anime/1?fields%5Banime%5D=slug&include=categories'] * 4
+
+    with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+        result = [*executor.map(lambda url: selective_request('anime', url), urls)]  # act
+
+    assert requests == ['https://kitsu.io/api/edge/anime/1?fields[anime]=slug&include=categories']
+    assert result == [{'data': requests}] * len(urls)
+    assert len(cache_helpers.FILE_DATA.db['files']) == 1
+
+
+def test_entry_anime_link():
+    """Check that the anime ID from the relationship is used so that library entries for one anime share a URL."""
+    anime_entry = json.loads((TEST_DATA_DIR / 'lib_entry.json').read_text())['data'][0]
+    related = anime_entry['relationships']['anime']['links']['related']
+    linked_entry = copy.deepcopy(anime_entry)
+    linked_entry['relationships']['anime']['data'] = {'type': 'anime', 'id': '7442'}
+
+    result = entry_anime_link(linked_entry)  # act
+
+    assert result == f'{api_helpers.KITSU_API_URL}/anime/7442'
+    assert entry_anime_link(anime_entry) == related
+
+
+def test_split_library_page():
+    """Check that the included resources of a batched library page match the separate anime and streams requests."""
+    anime_entry = copy.deepcopy(LIB_ENTRY['data'][0])
+    anime_entry['relationships']['anime']['data'] = link(ANIME['data'])
+    anime_data = copy.deepcopy(ANIME['data'])
+    anime_data['relationships']['categories']['data'] = [link(category) for category in ANIME['included']]
+    anime_data['relationships']['streamingLinks']['data'] = [link(stream) for stream in STREAMS['data']]
+    library_page = {'data': [anime_entry], 'included': [*STREAMS['data'], anime_data, *ANIME['included']]}
+
+    batch = split_library_page(library_page)  # act
+
+    assert len(batch) == 1
+    assert merge_anime_info(*batch[0]) == merge_anime_info(LIB_ENTRY['data'][0], ANIME, STREAMS)
+    # Check that the sparse fieldsets include every attribute and relationship that was used
+    assert 'anime' in BATCH_FIELDS['libraryEntries']
+    assert {'categories', 'streamingLinks'}.issubset(BATCH_FIELDS['anime'])
+
 
 # def test_get_data():
 #     """Test get_data with simple smoke test."""
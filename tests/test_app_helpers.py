@@ -0,0 +1,51 @@
+"""Test the app_helpers.py file."""
+
+import base64
+import json
+
+import pandas as pd
+import pytest
+from kitsu_lib.app_helpers import decode_b64_file, iter_df_chunks
+
+
+def encode_upload(raw, content_type='text/csv'):
+    """Return the raw bytes as a base64 string in the format of a Dash upload."""  # noqa: DAR101,DAR201
+    return f'data:{content_type};base64,{base64.b64encode(raw).decode()}'
+
+
+@pytest.mark.parametrize('chunk_size', [4, 7, 2 ** 20])
+def test_decode_b64_file(chunk_size):
+    """Test that the file is decoded in slices into a binary buffer."""
+    raw = bytes(range(256)) * 3
+
+    content_type, buffer = decode_b64_file(encode_upload(raw), chunk_size=chunk_size)  # act
+
+    assert content_type == 'data:text/csv'
+    assert buffer.read() == raw
+
+
+@pytest.mark.parametrize(('filename', 'raw'), [
+    ('upload.csv', b'name,score\nAlpha,1\nBeta,\nGamma,3\n'),
+    ('upload.ndjson', b'{"name": "Alpha", "score": 1}\n{"name": "Beta"}\n{"name": "Gamma", "score": 3}\n'),
+    ('upload.json', json.dumps({'data': [{'name': 'Alpha', 'score': 1}, {'name': 'Beta'},
+                                         {'name': 'Gamma', 'score': 3}]}).encode()),
+])
+def test_iter_df_chunks(filename, raw):
+    """Test that each supported file type is parsed into chunks of rows."""
+    _content_type, buffer = decode_b64_file(encode_upload(raw))
+
+    chunks = [*iter_df_chunks(buffer, filename, chunksize=2)]  # act
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    df_upload = pd.concat(chunks)
+    assert [*df_upload['name']] == ['Alpha', 'Beta', 'Gamma']
+    assert df_upload['score'].isna().sum() == 1
+    assert not buffer.closed
+
+
+def test_iter_df_chunks_unsupported():
+    """Test that an unsupported file type raises an error."""
+    _content_type, buffer = decode_b64_file(encode_upload(b'text'))
+
+    with pytest.raises(RuntimeError, match='unsupported'):
+        [*iter_df_chunks(buffer, 'upload.txt')]  # act
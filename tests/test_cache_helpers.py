@@ -1,9 +1,282 @@
 """Test the cache_helpers.py file."""
 
-from kitsu_lib.cache_helpers import DBConnect, initialize_cache, match_url_in_cache, pretty_dump_json, store_response
+import copy
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+from kitsu_lib import analysis, cache_helpers
+from kitsu_lib.analysis import load_sync_state, update_kitsu_database
+from kitsu_lib.cache_helpers import (CacheManager, DBConnect, FigureCache, GzipStore, JSONStore, ResponseStore,
+                                     cache_filename, find_cached_filename, initialize_cache, is_stale, load_response,
+                                     match_url_in_cache, migrate_cache, normalize_url, pretty_dump_json,
+                                     reconcile_cache, store_response)
+
+from .configuration import TEST_DATA_DIR
 
-# class DBConnect:
 # def pretty_dump_json(filename, obj):
-# def initialize_cache():
-# def match_url_in_cache(url):
-# def store_response(prefix, url, obj):
+
+
+def test_store_response(temp_cache):
+    """Check that a stored response can be found by URL and that duplicate URLs are rejected."""
+    url = 'https://kitsu.io/api/edge/anime/1'
+
+    store_response('anime', url, {'data': []})  # act
+
+    matches = match_url_in_cache(url)
+    assert len(matches) == 1
+    assert find_cached_filename(url) == matches[0]['filename']
+    assert find_cached_filename(f'{url}0') is None
+    with pytest.raises(RuntimeError, match='Already have an entry'):
+        store_response('anime', url, {'data': []})
+    assert len([*temp_cache.glob('anime_*')]) == 1
+
+
+@pytest.mark.parametrize('url', [
+    'https://kitsu.io/api/edge/users/1/library-entries?filter[kind]=anime&page[limit]=10',
+    'https://KITSU.io/api/edge/users/1/library-entries/?page%5Blimit%5D=10&filter%5Bkind%5D=anime',
+])
+def test_normalize_url(url):
+    """Check that URLs that only differ in encoding, case, or the order of query arguments are equal."""
+    result = normalize_url(url)  # act
+
+    assert result == 'https://kitsu.io/api/edge/users/1/library-entries?filter[kind]=anime&page[limit]=10'
+
+
+def test_initialize_cache(temp_cache):
+    """Check that rows are removed for files that were manually deleted."""
+    url = 'https://kitsu.io/api/edge/anime/2'
+    store_response('anime', url, {'data': []})
+    Path(find_cached_filename(url)).unlink()
+
+    initialize_cache()  # act
+
+    assert match_url_in_cache(url) == []
+    assert find_cached_filename(url) is None
+
+
+@pytest.mark.parametrize('background', [False, True])
+def test_reconcile_cache(temp_cache, background):
+    """Check that missing files are removed in batches and that untracked response files are found."""
+    urls = [f'https://kitsu.io/api/edge/anime/{idx}' for idx in range(12)]
+    for url in urls:
+        store_response('anime', url, {'data': []})
+    missing = sorted(find_cached_filename(url) for url in urls[:7])
+    for filename in missing:
+        Path(filename).unlink()
+    stray = cache_filename('anime', 'https://kitsu.io/api/edge/anime/untracked', GzipStore())
+    stray.write_bytes(b'')
+    (temp_cache / 'notes.json').write_text('{}')
+
+    result = initialize_cache(background=background)  # act
+
+    summary = result.result() if background else result
+    assert summary == {'tracked': 5, 'missing': missing, 'stray': [str(stray)]}
+    assert len(cache_helpers.FILE_DATA.db['files']) == 5
+    assert reconcile_cache(remove_stray=True, batch_size=2)['stray'] == [str(stray)]
+    assert not stray.is_file()
+    assert (temp_cache / 'notes.json').is_file()
+
+
+@pytest.mark.parametrize(('policy', 'expected'), [('lru', [1, 0]), ('lfu', [1, 2])])
+def test_cache_manager_evict(temp_cache, policy, expected):
+    """Check that the least recently or least frequently used responses are evicted to stay within the budget."""
+    urls = [f'https://kitsu.io/api/edge/anime/{idx}' for idx in range(5)]
+    for url in urls:
+        store_response('anime', url, {'data': []})
+    manager = CacheManager(max_entries=3, policy=policy)
+    for idx in [0, 0, 0, 2, 3, 4]:
+        manager.record_hit(urls[idx])
+
+    result = manager.flush()  # act
+
+    assert result == [urls[idx] for idx in expected]
+    assert [find_cached_filename(url) is None for url in urls] == [idx in expected for idx in range(5)]
+    assert len([*temp_cache.glob('anime_*')]) == 3
+    assert manager.stats['hits'] == 6
+    assert manager.stats['evictions'] == 2
+
+
+def test_cache_manager_usage(temp_cache, monkeypatch):
+    """Check that the byte budget is enforced as responses are stored and that usage is summarized by prefix."""
+    manager = CacheManager(max_bytes=10 ** 6, flush_size=1)
+    monkeypatch.setattr(cache_helpers, 'CACHE_MANAGER', manager)
+    for idx in range(4):
+        store_response('anime' if idx else 'user', f'https://kitsu.io/api/edge/anime/{idx}', {'data': 'x' * 100})
+    size = cache_helpers.FILE_DATA.db['files'].find_one(prefix='user')['size']
+    manager.record_hit('https://kitsu.io/api/edge/anime/0')
+    manager.max_bytes = 2 * size
+
+    result = manager.usage()  # act
+
+    assert [(row['prefix'], row['entries'], row['bytes'], row['hits']) for row in result] == [
+        ('anime', 1, size, 0), ('user', 1, size, 1),
+    ]
+    assert manager.stats == {'hits': 1, 'misses': 0, 'evictions': 2, 'evicted_bytes': 2 * size}
+    with pytest.raises(ValueError, match='Unknown eviction policy'):
+        CacheManager(policy='random')
+
+
+@pytest.mark.parametrize('store', [JSONStore(), GzipStore()])
+def test_response_store(temp_cache, store):
+    """Check that each store can write and read a response."""
+    obj = {'data': [{'id': '1', 'attributes': {'slug': 'cowboy-bebop'}}]}
+    path = temp_cache / f'test{store.suffix}'
+
+    store.dump(path, obj)  # act
+
+    assert load_response(path) == obj
+
+
+def test_response_store_abstract():
+    """Check that a store without encode and decode can't be created."""
+    class IncompleteStore(ResponseStore):
+        suffix = '.txt'
+
+        def encode(self, obj):
+            return b''
+
+    with pytest.raises(TypeError, match='abstract'):
+        IncompleteStore()  # act
+
+
+def test_migrate_cache(temp_cache, monkeypatch):
+    """Check that the JSON files are converted to gzip and can still be loaded."""
+    monkeypatch.setattr(cache_helpers, 'CACHE_STORE', JSONStore())
+    url = 'https://kitsu.io/api/edge/anime/3'
+    obj = {'data': {'id': '3', 'attributes': {'synopsis': 'Text ' * 100}}}
+    store_response('anime', url, obj)
+
+    summary = migrate_cache(GzipStore())  # act
+
+    assert summary['files'] == 1
+    assert summary['bytes_after'] < summary['bytes_before']
+    filename = find_cached_filename(url)
+    assert filename.endswith('.json.gz')
+    assert load_response(filename) == obj
+    assert [*temp_cache.glob('anime_*.json')] == []
+
+
+def test_migrate_legacy_cache(temp_cache):
+    """Check that rows for files named before content-addressed files are kept by the reconciliation and migrated."""
+    table = cache_helpers.FILE_DATA.db['files']
+    legacy = {}
+    for idx, name in enumerate(['anime_U1600000000000000001.json', 'streams_U1600000000000000002.json',
+                                'library_custom-name.json']):
+        url = f'https://kitsu.io/api/edge/legacy/{idx}'
+        legacy[url] = {'data': {'id': str(idx)}}
+        pretty_dump_json(temp_cache / name, legacy[url])
+        table.insert({'filename': str(temp_cache / name), 'url': url, 'timestamp': 1e9})
+
+    summary = reconcile_cache()  # act
+
+    assert summary == {'tracked': 3, 'missing': [], 'stray': []}
+    assert all(row['size'] > 0 for row in table.all())
+    assert migrate_cache(GzipStore())['files'] == 3
+    assert len(table) == 3
+    for url, obj in legacy.items():
+        assert find_cached_filename(url).endswith('.json.gz')
+        assert load_response(find_cached_filename(url)) == obj
+    assert [*temp_cache.glob('*.json')] == []
+
+
+def test_is_stale():
+    """Check that only responses older than the TTL for their prefix are stale."""
+    now = 1e9
+    rows = [
+        {'prefix': 'library', 'timestamp': now - 2 * cache_helpers.CACHE_TTL['library']},
+        {'prefix': 'anime', 'timestamp': now - 60},
+        {'prefix': 'unknown', 'timestamp': 0},
+    ]
+
+    result = [is_stale(row, now=now) for row in rows]  # act
+
+    assert result == [True, False, False]
+
+
+class _Figure:
+    """Minimal stand-in for a Plotly figure."""
+
+    def __init__(self, title):
+        """Store the title."""  # noqa: DAR101
+        self.title = title
+
+    def to_json(self):
+        """Return the serialized figure."""  # noqa: DAR201
+        return json.dumps({'layout': {'title': str(self.title)}})
+
+
+def test_figure_cache(temp_cache):
+    """Check that figures are shared through the database and that the least recently used figures are evicted."""
+    path = temp_cache / '_figure_cache.db'
+    cache = FigureCache(path, maxsize=2, memory_maxsize=1)
+    keys = [FigureCache.make_key('tab', 'fingerprint', 'scatter', {'x': idx, 'template': 'plotly'}) for idx in range(3)]
+
+    figures = [cache.get_or_create(key, lambda idx=idx: _Figure(idx)) for idx, key in enumerate(keys)]  # act
+
+    assert figures[2] == {'layout': {'title': '2'}}
+    assert cache.get_or_create(keys[2], lambda: pytest.fail('Expected a cached figure')) == figures[2]
+    assert cache.get(keys[1]) == figures[1]
+    assert cache.get(keys[0]) is None
+    assert cache.stats == {'hits': 1, 'disk_hits': 1, 'misses': 4}
+    # A second process with an empty memory cache reads the figures from the shared database
+    other = FigureCache(path, maxsize=2)
+    assert other.get(keys[2]) == figures[2]
+    assert other.stats['disk_hits'] == 1
+    assert FigureCache.make_key('a', {'y': 1, 'x': 2}) == FigureCache.make_key('a', {'x': 2, 'y': 1})
+
+
+def test_db_connect_threads(temp_cache):
+    """Check that each thread has a connection, that transactions are batched, and that connections can be closed."""
+    with DBConnect(temp_cache / 'test_db_connect.db', busy_timeout=1) as db:
+        connect = cache_helpers.DBConnect(temp_cache / 'test_db_connect.db')
+        inserted = connect.insert_batches('rows', ({'value': idx} for idx in range(25)), batch_size=10)
+        thread_connections = []
+        thread = threading.Thread(target=lambda: thread_connections.append(connect.db.executable))
+        thread.start()
+        thread.join()
+
+        assert inserted == 25
+        assert db['rows'].count() == 25
+        assert thread_connections[0] is not connect.db.executable
+        assert connect.prune_connections() == 1
+        assert thread_connections[0].invalidated
+        assert db.query('PRAGMA busy_timeout').next()['timeout'] == 1000
+        assert db.query('PRAGMA journal_mode').next()['journal_mode'] == 'wal'
+    connection = connect.db.executable
+    connect.close_thread()
+    assert connection.invalidated
+    assert connect.db['rows'].count() == 25
+    connect.close()
+
+
+@pytest.mark.parametrize('workers', [8])
+def test_db_connect_stress(temp_cache, monkeypatch, workers):
+    """Run concurrent readers and writers against the response cache and Kitsu databases without lock errors."""
+    monkeypatch.setattr(analysis, 'KITSU_DATA', DBConnect(temp_cache / '_kitsu_data.db', busy_timeout=10))
+    entries = json.loads((TEST_DATA_DIR / 'all_data.json').read_text())['data']
+    steps = 10
+
+    def write(idx):
+        for step in range(steps):
+            store_response('anime', f'https://kitsu.io/api/edge/anime/{idx}-{step}', {'data': [idx, step]})
+            entry = copy.deepcopy(entries[step % len(entries)])
+            entry['id'] = f'{idx}-{step}'
+            entry['slug'] = f'{entry["slug"]}-{idx}-{step}'
+            update_kitsu_database([entry])
+
+    def read(idx):
+        for step in range(steps * 2):
+            match_url_in_cache(f'https://kitsu.io/api/edge/anime/{idx}-{step}')
+            load_sync_state()
+            analysis.KITSU_DATA.db.query('SELECT COUNT(*) AS count FROM library_entry').next()
+
+    analysis.create_kitsu_schema(analysis.KITSU_DATA.db)
+    with ThreadPoolExecutor(max_workers=2 * workers) as executor:
+        futures = [executor.submit(func, idx) for idx in range(workers) for func in (write, read)]
+        [future.result() for future in futures]  # act
+
+    assert len(load_sync_state()) == workers * steps
+    assert len(cache_helpers.FILE_DATA.db['files']) == workers * steps
@@ -0,0 +1,66 @@
+"""Test the chart_helpers.py file."""
+
+import numpy as np
+import pandas as pd
+import pytest
+from kitsu_lib.chart_helpers import bin_density, bin_histogram, bin_spec, downsample, lttb_indices
+
+DF_POINTS = pd.DataFrame({
+    'x': np.arange(10000, dtype=float),
+    'y': np.sin(np.arange(10000) / 100),
+    'group': np.repeat(['a', 'b', 'c', 'd'], [7000, 2000, 999, 1]),
+})
+"""Dataframe with one large and one single-row group."""
+
+
+def test_lttb_indices():
+    """Check that LTTB keeps the end points and the extremes of a smooth series."""
+    x = DF_POINTS['x'].to_numpy()
+    y = DF_POINTS['y'].to_numpy()
+
+    result = lttb_indices(x, y, 500)  # act
+
+    assert len(result) == 500
+    assert result[0] == 0
+    assert result[-1] == len(x) - 1
+    assert np.all(np.diff(result) > 0)
+    assert y[result].max() == pytest.approx(1, abs=1e-3)
+    assert y[result].min() == pytest.approx(-1, abs=1e-3)
+    assert [*lttb_indices(x[:5], y[:5], 10)] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('x', ['x', 'group'])
+def test_downsample(x):
+    """Check that each group is kept in proportion to its size with LTTB or a random sample."""
+    result = downsample(DF_POINTS, 1000, x=x, y='y', groups=['group'])  # act
+
+    assert len(result) <= 1000
+    assert result['group'].value_counts().to_dict() == {'a': 700, 'b': 200, 'c': 99, 'd': 1}
+    assert downsample(DF_POINTS, len(DF_POINTS), x=x, y='y') is DF_POINTS
+
+
+def test_bin_histogram():
+    """Check that the pre-binned counts and sums match the original data."""
+    df = DF_POINTS.assign(weight=2.0)
+
+    binned, weight_column, edges = bin_histogram(df, 'x', groups=['group'], bins=20)  # act
+
+    assert weight_column == 'count'
+    assert binned['count'].sum() == len(df)
+    assert len(binned) <= 20 * 4
+    assert bin_spec(edges) == {'start': 0.0, 'end': 9999.0, 'size': pytest.approx(9999 / 20)}
+    binned, weight_column, edges = bin_histogram(df, 'group', weight='weight')
+    assert edges is None
+    assert binned.set_index('group')['weight'].to_dict() == {'a': 14000, 'b': 4000, 'c': 1998, 'd': 2}
+
+
+def test_bin_density():
+    """Check that only non-empty cells are returned and that the counts match the original data."""
+    df = DF_POINTS.assign(y=DF_POINTS['x'] * 2)
+
+    binned, count_column, x_edges, y_edges = bin_density(df, 'x', 'y', bins=10)  # act
+
+    assert binned[count_column].sum() == len(df)
+    assert len(binned) == 10  # Only the cells along the diagonal
+    assert (x_edges[0], x_edges[-1]) == (0, 9999)
+    assert y_edges[-1] == 2 * 9999
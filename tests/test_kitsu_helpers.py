@@ -3,7 +3,9 @@
 import filecmp
 
 import dataset
-from kitsu_lib.kitsu_helpers import configure_logger, export_table_as_csv, rm_brs
+import pytest
+from kitsu_lib.kitsu_helpers import (LRUCache, chunked, configure_logger, export_table_as_arrow, export_table_as_csv,
+                                     prefetch, query_table_chunks, rm_brs)
 
 from .configuration import TEMP_DIR, TEST_DATA_DIR
 
@@ -18,6 +20,64 @@ def test_rm_brs():
     assert '1 2 3 4' == rm_brs('\n\n\r1\t2\n3\n\r\n4  ')  # act
 
 
+def test_lru_cache():
+    """Verify that the least recently used key is evicted first."""
+    cache = LRUCache(maxsize=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+
+    cache.put('c', 3)  # act
+
+    assert len(cache) == 2
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.pop('c') == 3
+
+
+def test_lru_cache_sizeof():
+    """Verify that the total size of the values is limited when a sizeof function is set."""
+    cache = LRUCache(maxsize=10, sizeof=len)
+    cache.put('a', 'aaaa')
+    cache.put('b', 'bbbb')
+
+    cache.put('c', 'cccc')  # act
+
+    assert [*cache._data] == ['b', 'c']
+    assert cache.size == 8
+    cache.put('d', 'd' * 11)
+    assert len(cache) == 0
+    assert cache.size == 0
+
+
+def test_chunked():
+    """Verify that chunked splits an iterable into lists of at most the chunk size."""
+    chunks = [*chunked(iter(range(7)), 3)]  # act
+
+    assert chunks == [[0, 1, 2], [3, 4, 5], [6]]
+
+
+def test_prefetch():
+    """Verify that prefetch returns every item in order."""
+    items = [*prefetch(iter(range(25)), size=3)]  # act
+
+    assert items == [*range(25)]
+
+
+def test_prefetch_error():
+    """Verify that an error in the background iterable is raised in the caller after the preceding items."""
+    def failing_iterable():
+        yield 1
+        raise ValueError('Failed on second item')
+    items = []
+
+    with pytest.raises(ValueError, match='second item'):
+        for item in prefetch(failing_iterable()):  # act
+            items.append(item)
+
+    assert items == [1]
+
+
 def test_export_table_as_csv():
     """Test that a CSV file is correctly exported for a given SQL table."""
     expected_csv = TEST_DATA_DIR / 'test_export_table_as_csv.csv'
@@ -35,3 +95,37 @@ def test_export_table_as_csv():
 
     # Check that new file is identical to expected format
     assert filecmp.cmp(expected_csv, csv_filename, shallow=False)
+
+
+def test_query_table_chunks():
+    """Test that rows with different keys are returned in column order and in chunks from a single cursor."""
+    db = dataset.connect('sqlite:///:memory:')
+    table = db['TEST']
+    table.insert_many([{'col1': 'Alpha'}, {'col2': 2}, {'col1': 'Gamma', 'col3': True}])
+
+    columns, chunks = query_table_chunks(table, chunk_size=2)  # act
+
+    assert columns == ['id', 'col1', 'col2', 'col3']
+    assert [*chunks] == [[(1, 'Alpha', None, None), (2, None, 2, None)], [(3, 'Gamma', None, True)]]
+
+
+@pytest.mark.parametrize('suffix', ['.parquet', '.arrow'])
+def test_export_table_as_arrow(suffix):
+    """Test that a table and a view are exported with typed columns in record batches."""
+    pa = pytest.importorskip('pyarrow')
+    filename = TEMP_DIR / f'test_export_table_as_arrow{suffix}'
+    db = dataset.connect('sqlite:///:memory:')
+    db['TEST'].insert_many([{'name': 'Alpha', 'score': 1.5, 'flag': True}, {'name': 'Beta', 'score': None}])
+    db.query('CREATE VIEW test_view AS SELECT name, (SELECT 1 WHERE flag) AS "in""dicator" FROM TEST')
+
+    for table in [db['TEST'], db.load_table('test_view')]:
+        export_table_as_arrow(filename, table, chunk_size=1)  # act
+
+        if suffix == '.arrow':
+            with pa.memory_map(str(filename)) as source:
+                result = pa.ipc.open_file(source).read_all()
+        else:
+            result = pytest.importorskip('pyarrow.parquet').read_table(str(filename))
+        assert result.num_rows == 2
+    assert result.schema.field('in"dicator').type == pa.int64()
+    assert result.to_pydict() == {'name': ['Alpha', 'Beta'], 'in"dicator': [1, None]}
@@ -1,6 +1,23 @@
 """Test the scraper.py file."""
 
+import subprocess  # noqa: S404
+import sys
+
 from kitsu_lib.scraper import scrape_kitsu, scrape_kitsu_unsafe
 
+from .configuration import TEST_DIR
+
 # scrape_kitsu_unsafe(username=None, limit=None):
 # scrape_kitsu(username=None, limit=None):
+
+
+def test_scraper_import_is_lightweight():
+    """Check that importing the scraper does not import the packages that are only needed by the dashboard."""
+    code = 'import sys, kitsu_lib.scraper; print(" ".join(sorted({_m.split(".")[0] for _m in sys.modules})))'
+
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,  # noqa: S603
+                            cwd=TEST_DIR.parent, check=True)  # act
+
+    imported = set(result.stdout.split())
+    assert 'kitsu_lib' in imported
+    assert imported.isdisjoint({'dash', 'icecream', 'numpy', 'pandas', 'plotly', 'pyarrow'})
@@ -0,0 +1,108 @@
+"""Test the table_module.py file."""
+
+import pandas as pd
+import pytest
+from kitsu_lib import table_module
+from kitsu_lib.cache_helpers import DBConnect
+from kitsu_lib.table_module import clear_count_cache, count_rows, parse_filter_query, query_page, split_filter_query
+
+from .configuration import TEMP_DIR
+
+COLUMNS = ['title', 'rating', 'started']
+
+
+@pytest.fixture()
+def library_db():
+    """Return a database with a `library` table of 1000 rows.
+
+    Returns:
+        dataset: database instance
+
+    """
+    database_path = TEMP_DIR / 'test_table_module.db'
+    if database_path.is_file():
+        database_path.unlink()
+    db = DBConnect(database_path).db
+    db['library'].insert_many([
+        {'title': f'Title {idx}' if idx % 10 else f'War {idx}', 'rating': None if idx % 7 == 3 else idx % 100,
+         'started': f'2020-{idx % 12 + 1:02}-01'}
+        for idx in range(1000)
+    ])
+    table_module.COUNT_CACHE.clear()
+    return db
+
+
+def test_split_filter_query():
+    """Check that conjunctions within quoted values are not split."""
+    result = split_filter_query('{title} contains "cats && dogs" && {rating} > 5 and {started} is blank')  # act
+
+    assert result == ['{title} contains "cats && dogs"', '{rating} > 5', '{started} is blank']
+
+
+@pytest.mark.parametrize(('filter_query', 'expected'), [
+    ('', ('', [])),
+    ('{rating} >= 80', ('"rating" >= ?', [80])),
+    ('{rating} ge 80 && {title} ne "War 10"', ('"rating" >= ? AND "title" != ?', [80, 'War 10'])),
+    ('{title} icontains WAR', ('instr(lower(CAST("title" AS TEXT)), ?) > 0', ['war'])),
+    ('{started} datestartswith 2020-03', ('substr(CAST("started" AS TEXT), 1, ?) = ?', [7, '2020-03'])),
+    ('{rating} is nil', ('"rating" IS NULL', [])),
+])
+def test_parse_filter_query(filter_query, expected):
+    """Check that DataTable filter expressions are translated into parameterized SQL."""
+    result = parse_filter_query(filter_query, COLUMNS)  # act
+
+    assert result == expected
+
+
+@pytest.mark.parametrize('filter_query', ['{unknown} = 1', '{rating} > 1 || {rating} < 5', 'rating = 1'])
+def test_parse_filter_query_errors(filter_query):
+    """Check that unknown columns and unsupported expressions raise an error."""
+    with pytest.raises(ValueError, match='filter expression'):
+        parse_filter_query(filter_query, COLUMNS)  # act
+
+
+def test_query_page(library_db):
+    """Check that a single filtered and sorted page is returned with the total number of matching rows."""
+    sort_by = [{'column_id': 'rating', 'direction': 'desc'}, {'column_id': 'id', 'direction': 'asc'}]
+
+    df_page, row_count = query_page(library_db, 'library', page_current=1, page_size=5,
+                                    filter_query='{title} contains War && {rating} > 50', sort_by=sort_by,
+                                    columns=['id', 'rating'])  # act
+
+    df_all = pd.DataFrame.from_records(library_db['library'].all())
+    df_match = df_all[df_all['title'].str.startswith('War') & (df_all['rating'] > 50)]
+    df_match = df_match.sort_values(['rating', 'id'], ascending=[False, True])
+    assert row_count == len(df_match)
+    assert df_page.columns.tolist() == ['id', 'rating']
+    assert df_page['id'].tolist() == df_match['id'].iloc[5:10].tolist()
+    with pytest.raises(ValueError, match='Unknown sort column'):
+        query_page(library_db, 'library', sort_by=[{'column_id': 'unknown', 'direction': 'asc'}])
+
+
+def test_count_rows_cache(library_db):
+    """Check that the row count is cached until the TTL expires."""
+    library_db['library'].delete(rating=None)
+    count = count_rows(library_db, 'library')
+    library_db['library'].delete()
+
+    result = count_rows(library_db, 'library')  # act
+
+    assert result == count
+    table_module.COUNT_CACHE.clear()
+    assert count_rows(library_db, 'library') == 0
+
+
+def test_clear_count_cache(library_db):
+    """Check that only the cached counts for the written table are cleared."""
+    library_db['other'].insert({'title': 'Other'})
+    count_rows(library_db, 'library')
+    count_rows(library_db, 'library', '"rating" > ?', (50,))
+    count_rows(library_db, 'other')
+    library_db['library'].delete(rating=None)
+
+    clear_count_cache(library_db, 'library')  # act
+
+    assert count_rows(library_db, 'library') == library_db['library'].count()
+    assert [key[1] for key in table_module.COUNT_CACHE.keys()] == ['other', 'library']
+    clear_count_cache(library_db)
+    assert len(table_module.COUNT_CACHE) == 0
@@ -0,0 +1,123 @@
+"""Test the upload_module.py file."""
+
+import base64
+import threading
+import time
+
+import pandas as pd
+from kitsu_lib import table_module, upload_module
+from kitsu_lib.cache_helpers import DBConnect
+from kitsu_lib.table_module import count_rows
+from kitsu_lib.upload_module import JobRunner, UploadModule
+
+from .configuration import TEMP_DIR
+
+
+def wait_for_jobs(jobs, username, timeout=5):
+    """Wait until all of the user's jobs have finished."""  # noqa: DAR101
+    start = time.monotonic()
+    while jobs.find_active(username) and time.monotonic() - start < timeout:
+        time.sleep(0.01)
+
+
+def new_database(name):
+    """Return a DBConnect instance for an empty database."""  # noqa: DAR101,DAR201
+    database_path = TEMP_DIR / f'{name}.db'
+    if database_path.is_file():
+        database_path.unlink()
+    return DBConnect(database_path)
+
+
+def test_job_runner():
+    """Test that background jobs report progress and store the result or error in the jobs table."""
+    jobs = JobRunner(new_database('test_job_runner'), max_workers=2)
+
+    def task(job_id, value):
+        jobs.update(job_id, progress=0.5)
+        if value is None:
+            raise ValueError('Missing value')
+        return value * 2
+
+    job_ids = [jobs.submit('user', f'task-{value}', task, value) for value in [2, None]]  # act
+
+    wait_for_jobs(jobs, 'user')
+    finished = {row['job_id']: row for row in jobs.pop_finished('user')}
+    assert finished[job_ids[0]]['status'] == 'done'
+    assert finished[job_ids[0]]['result'] == '4'
+    assert finished[job_ids[1]]['status'] == 'failed'
+    assert finished[job_ids[1]]['error'] == 'Missing value'
+    assert jobs.pop_finished('user') == []
+
+
+def test_job_runner_interrupted():
+    """Test that jobs left running by a previous process are marked as failed."""
+    database = new_database('test_job_runner_interrupted')
+    jobs = JobRunner(database)
+    jobs.table.insert({'job_id': 'stale', 'username': 'user', 'status': 'running', 'notified': False})
+
+    JobRunner(database)  # act
+
+    assert jobs.table.find_one(job_id='stale')['status'] == 'failed'
+
+
+def test_ingest_upload_progress(monkeypatch):
+    """Test that the progress of a multi-chunk upload can be polled from another connection while it runs."""
+    monkeypatch.setattr(upload_module, 'CACHE_DIR', TEMP_DIR)
+    new_database('_placeholder_app-test-ingest')
+    module = UploadModule('test-ingest')
+    module.chunksize = 100
+    module.create_elements(None)
+    update = module.jobs.update
+
+    def slow_update(job_id, **fields):
+        update(job_id, **fields)
+        if 'progress' in fields:
+            time.sleep(0.02)  # Leave time to poll between chunks
+    monkeypatch.setattr(module.jobs, 'update', slow_update)
+    csv_text = pd.DataFrame({'idx': range(2000), 'text': ['x' * 200] * 2000}).to_csv(index=False)
+    b64_file = f'data:text/csv;base64,{base64.b64encode(csv_text.encode()).decode()}'
+    polled = []
+    stop = threading.Event()
+
+    def poll(job_id):
+        reader = DBConnect(module.database.database_path)
+        while not stop.is_set():
+            row = reader.db['jobs'].find_one(job_id=job_id)
+            polled.append((row['status'], row['progress']))
+            time.sleep(0.005)
+        reader.close()
+
+    job_ids = [module.jobs.submit('user', 'data.csv', module.ingest_upload, 'user', 'data.csv', b64_file)]
+    poller = threading.Thread(target=poll, args=(job_ids[0],))
+    poller.start()
+    job_ids.append(module.jobs.submit('user', 'other.csv', module.ingest_upload, 'user', 'other.csv', b64_file))
+    wait_for_jobs(module.jobs, 'user', timeout=30)  # act
+    stop.set()
+    poller.join()
+
+    assert any(0 < progress < 1 for status, progress in polled if status == 'running')
+    finished = {row['job_id']: row for row in module.jobs.pop_finished('user')}
+    assert [finished[job_id]['status'] for job_id in job_ids] == ['done', 'done']
+    for job_id in job_ids:
+        assert len(module.database.db[finished[job_id]['result']]) == 2000
+    module.database.close()
+
+
+def test_insert_chunks_count(monkeypatch):
+    """Test that the cached row count of a table is cleared after each chunk is inserted and when it is deleted."""
+    monkeypatch.setattr(upload_module, 'CACHE_DIR', TEMP_DIR)
+    new_database('_placeholder_app-test-count')
+    module = UploadModule('test-count')
+    module.create_elements(None)
+    df_chunks = [pd.DataFrame({'idx': range(start, start + 10)}) for start in range(0, 30, 10)]
+    counts = []
+
+    def progress(row_count):
+        counts.append((row_count, count_rows(module.database.db, 'counted')))
+
+    module.insert_chunks('counted', df_chunks, progress=progress)  # act
+
+    assert counts == [(10, 10), (20, 20), (30, 30)]
+    module.delete_data('counted')
+    assert [key for key in table_module.COUNT_CACHE.keys() if key[1] == 'counted'] == []
+    module.database.close()